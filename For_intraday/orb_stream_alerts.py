@@ -0,0 +1,157 @@
+import json
+import time
+import smtplib
+from email.mime.text import MIMEText
+from google.oauth2.service_account import Credentials
+from datetime import datetime
+from dotenv import load_dotenv
+import os
+import sys
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.sheet_inputs import SheetInputs
+from shared.sheets_client import authorize
+from shared.http_transport import HttpTransport
+from shared.log_setup import setup_logging
+from shared.orb_stream import OrbEngine, TapeRecorder, TapeReplayer, YahooMinuteSource, ist
+from shared.trading_calendar import TradingCalendar, should_run
+
+# Streaming opening-range-breakout alerts: polls minute bars for the watchlist
+# from 9:15 AM IST and emails as soon as a stock trades above its opening range.
+# Set INTRADAY_TAPE to a recorded tape to replay a session offline instead.
+
+# Load environment variables from .env file
+load_dotenv()
+
+log_runtime = setup_logging()
+logger = logging.getLogger(__name__)
+
+start_time = time.time()
+logger.info("Starting streaming opening range breakout alerts...")
+
+or_minutes = int(os.getenv('INTRADAY_OR_MINUTES', '5'))
+poll_seconds = int(os.getenv('INTRADAY_POLL_SECONDS', '60'))
+stop_at = os.getenv('INTRADAY_STREAM_UNTIL', '10:15')
+tape_path = os.getenv('INTRADAY_TAPE')
+record_path = os.getenv('INTRADAY_RECORD_TAPE')
+sheet_id = '1ZYa5e92hmTc27KYSLKJyx_zvYydR5b1jMk7dYIqFsss'
+transport = HttpTransport(pool_size=5)
+
+recipients = []
+if tape_path:
+    # Offline replay: watchlist comes from the tape, alerts are only printed
+    source = TapeReplayer(tape_path)
+    watchlist = sorted(source.bars)
+    session_date = datetime.fromtimestamp(source.clock, ist).date()
+    poll_seconds = 0
+else:
+    # The market never opens on weekends and NSE holidays, so there is nothing to wait for
+    if not should_run(TradingCalendar(), 'orb_stream_alerts', datetime.now(ist).date()):
+        exit(0)
+    try:
+        credentials_info = json.loads(os.getenv('GOOGLE_CREDENTIALS'))
+        creds = Credentials.from_service_account_info(credentials_info, scopes=[
+            'https://spreadsheets.google.com/feeds',
+            'https://www.googleapis.com/auth/drive',
+            'https://www.googleapis.com/auth/spreadsheets'
+        ])
+        client = authorize(creds, transport=transport)
+    except Exception as e:
+        logger.error(f"Error loading credentials: {e}")
+        exit(1)
+    workbook = client.open_by_key(sheet_id)
+
+    # Watchlist: INTRADAY_WATCHLIST (comma separated) or column B of a sheet from row 4
+    if os.getenv('INTRADAY_WATCHLIST'):
+        names = [s.strip() for s in os.getenv('INTRADAY_WATCHLIST').split(',') if s.strip()]
+    else:
+        watch_sheet = workbook.worksheet(os.getenv('INTRADAY_WATCHLIST_SHEET', 'high_break_trade'))
+        names = [s for s in watch_sheet.col_values(2)[3:] if s.strip()]
+    watchlist = [n if n.endswith('.NS') else f"{n}.NS" for n in names]
+
+    email_column = SheetInputs(client, sheet_id, {'recipients': 'credential!D3:D'}).load()['recipients']
+    recipients = [email for email in email_column if email]
+
+    source = YahooMinuteSource(session=transport.yahoo_session())
+    if record_path:
+        source = TapeRecorder(source, record_path)
+    session_date = datetime.now(ist).date()
+
+logger.info(f"Watching {len(watchlist)} symbols with a {or_minutes}-minute opening range")
+
+smtp_server = 'smtp.gmail.com'
+smtp_port = 587
+username = os.getenv('SMTP_USERNAME')
+password = os.getenv('SMTP_PASSWORD')
+sender = f'"HighBreak Alert ORB" <{username}>'
+
+def send_alert_email(alerts):
+    rows = ''.join(
+        f'<tr><td style="padding: 10px; border: 1px solid #dee2e6;">{a.symbol[:-3]}</td>'
+        f'<td style="padding: 10px; border: 1px solid #dee2e6;">{datetime.fromtimestamp(a.ts, ist).strftime("%H:%M")}</td>'
+        f'<td style="padding: 10px; border: 1px solid #dee2e6;">{a.level:.2f}</td>'
+        f'<td style="padding: 10px; border: 1px solid #dee2e6;">{a.price:.2f}</td></tr>'
+        for a in alerts
+    )
+    html_body = f"""
+<html>
+  <body style="font-family: 'Helvetica Neue', Arial, sans-serif; color: #333;">
+    <h3 style="color: #2c3e50; border-bottom: 2px solid #007bff; padding-bottom: 8px;">Opening Range Breakouts</h3>
+    <table style="border-collapse: collapse; width: 100%;">
+      <tr><th>Stock</th><th>Bar</th><th>Range High</th><th>Last Price</th></tr>{rows}
+    </table>
+    <div style="margin-top: 30px; text-align: center; color: #6c757d; font-size: 0.9em;">This is an automated report from HighBreak Alert. For support, contact our team.</div>
+  </body>
+</html>
+"""
+    try:
+        with smtplib.SMTP(smtp_server, smtp_port) as s:
+            s.starttls()
+            s.login(username, password)
+            for recipient_email in recipients:
+                msg = MIMEText(html_body, 'html')
+                msg['Subject'] = f"ORB breakout: {', '.join(a.symbol[:-3] for a in alerts)}"
+                msg['From'] = sender
+                msg['To'] = recipient_email
+                s.sendmail(sender, [recipient_email], msg.as_string())
+        logger.info(f"Alert emailed to {len(recipients)} recipients")
+    except Exception as e:
+        logger.error(f"Error sending alert email: {e}")
+
+def on_alert(alerts):
+    for a in alerts:
+        logger.info(f"BREAKOUT {a.symbol} at {datetime.fromtimestamp(a.ts, ist).strftime('%H:%M')}: "
+                    f"high broke {a.level:.2f}, last {a.price:.2f}")
+    if recipients:
+        send_alert_email(alerts)
+
+engine = OrbEngine(watchlist, source, session_date, or_minutes=or_minutes, on_alert=on_alert)
+
+# Wait for the open before polling live data
+stop_hour, stop_minute = (int(x) for x in stop_at.split(':'))
+stop_time = ist.localize(datetime.combine(session_date, datetime.min.time()).replace(hour=stop_hour, minute=stop_minute))
+if not tape_path:
+    wait_seconds = engine.open_ts - time.time()
+    if wait_seconds > 0:
+        logger.info(f"Waiting {wait_seconds:.0f} seconds until 9:15 AM IST to start polling...")
+        time.sleep(wait_seconds)
+
+polls = 0
+while True:
+    if tape_path and source.exhausted:
+        break
+    if not tape_path and datetime.now(ist) >= stop_time:
+        break
+    poll_started = time.time()
+    engine.step()
+    polls += 1
+    time.sleep(max(0, poll_seconds - (time.time() - poll_started)))
+
+# Summary
+elapsed_time = time.time() - start_time
+if not tape_path:
+    client.quota.log_report()
+    transport.log_report()
+logger.info(f"{len(engine.alerts)} breakouts from {polls} polls of {len(watchlist)} symbols. Process completed in {elapsed_time:.2f} seconds.")
+log_runtime.log_report()
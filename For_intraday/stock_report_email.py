@@ -1,88 +1,164 @@
 import json
 import requests
 import time
-import smtplib
 from email.mime.text import MIMEText
-import gspread
 from google.oauth2.service_account import Credentials
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from datetime import timezone
 from dotenv import load_dotenv
 import os
+import sys
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.http_transport import HttpTransport
+from shared.log_setup import setup_logging
+from shared.mail_queue import MAIL_QUEUE_ENABLED, MailQueue
+from shared.mailer import BROADCAST_ENABLED, BROADCAST_GREETING_NAME, SmtpPool, recipient_name, send_broadcast
+from shared.sheet_inputs import SheetInputs
+from shared.sheets_client import CoalescedWrites, authorize
+from shared.trading_calendar import TradingCalendar, should_run
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Shared helpers report through logging
+log_runtime = setup_logging()
+logger = logging.getLogger(__name__)
+
 # Record start time
 start_time = time.time()
-print("Starting to fetch and send stock report emails...")
+logger.info("Starting to fetch and send stock report emails...")
+
+# No market refreshes to wait for on weekends and NSE holidays
+today_ist = (datetime.now(timezone.utc) + timedelta(hours=5, minutes=30)).date()
+if not should_run(TradingCalendar(), 'stock_report_email', today_ist):
+    exit(0)
+
+# Pooled HTTP connections shared by the macro and Sheets requests
+transport = HttpTransport(pool_size=5)
 
 # Function to execute macro with retry logic
+# Only failures before the macro started are retried: after a read timeout
+# or an error response it may have run (or still be running)
 def execute_macro_with_retry(url, retries=3, delay=5):
     for attempt in range(retries):
         try:
-            response = requests.get(url)
+            response = transport.get(url, timeout=transport.macro_timeout)
             response.raise_for_status()
-            print(f"Macro executed successfully on attempt {attempt + 1}")
+            logger.info(f"Macro executed successfully on attempt {attempt + 1}")
             return True
+        except (requests.exceptions.ReadTimeout, requests.exceptions.HTTPError) as e:
+            logger.error(f"Attempt {attempt + 1} failed after the macro was triggered, not retrying: {e}")
+            return False
         except Exception as e:
-            print(f"Attempt {attempt + 1} failed: {e}")
+            logger.warning(f"Attempt {attempt + 1} failed: {e}")
             if attempt < retries - 1:
                 time.sleep(delay)
-    print("All retry attempts failed for macro execution")
+    logger.error("All retry attempts failed for macro execution")
     return False
 
+sheet_id = '1ZYa5e92hmTc27KYSLKJyx_zvYydR5b1jMk7dYIqFsss'
+
+# SMTP setup
+smtp_server = 'smtp.gmail.com'
+smtp_port = 587
+username = os.getenv('SMTP_USERNAME')
+password = os.getenv('SMTP_PASSWORD')
+sender = '"HighBreak Alert ORB <' + os.getenv('SMTP_USERNAME') + '>'
+
+# Pre-warm: authentication, worksheet handles (and gids) and recipients do not
+# depend on the refreshed data, so they are resolved in the background while
+# the script waits for the market refreshes below
+def prewarm_sheets():
+    credentials_info = json.loads(os.getenv('GOOGLE_CREDENTIALS'))
+    creds = Credentials.from_service_account_info(credentials_info, scopes=[
+        'https://spreadsheets.google.com/feeds',
+        'https://www.googleapis.com/auth/drive',
+        'https://www.googleapis.com/auth/spreadsheets'
+    ])
+    client = authorize(creds, transport=transport)
+    workbook = client.open_by_key(sheet_id)
+    worksheets = {ws.title: ws for ws in workbook.worksheets()}  # one metadata read for every tab
+    # Fetch emails from "credential" sheet (column D from row 3, cached until the sheet changes)
+    email_column = SheetInputs(client, sheet_id, {'recipients': 'credential!D3:D'}).load()['recipients']
+    logger.info("Pre-warmed Google Sheets access, worksheet handles and recipients.")
+    return client, workbook, worksheets, [email for email in email_column if email]
+
+prewarm = ThreadPoolExecutor(max_workers=1).submit(prewarm_sheets)
+
+# Static parts of both report emails, rendered once up front; only the data
+# sections and the greeting are built after the refresh
+PAGE_HEAD = """
+<html>
+  <head>
+    <style>
+      body { font-family: 'Helvetica Neue', Arial, sans-serif; color: #333; line-height: 1.6; background-color: #f4f4f4; margin: 0; padding: 20px; }
+      .container { max-width: 800px; margin: 0 auto; background: #fff; padding: 30px; border-radius: 8px; box-shadow: 0 2px 8px rgba(0,0,0,0.1); }
+      h3 { color: #2c3e50; margin-top: 30px; border-bottom: 2px solid #007bff; padding-bottom: 8px; }
+      p { margin: 10px 0; }
+      table { border-collapse: collapse; width: 100%; margin-bottom: 20px; }
+      ul { list-style: none; padding: 0; }
+      .download-btn { display: inline-block; padding: 12px 24px; background-color: #007bff; color: #fff; text-decoration: none; border-radius: 5px; font-weight: 500; transition: background-color 0.3s, transform 0.2s; }
+      .download-btn:hover { background-color: #0056b3; transform: translateY(-2px); }
+      .footer { margin-top: 30px; text-align: center; color: #6c757d; font-size: 0.9em; }
+      @media (max-width: 600px) { .container { padding: 15px; } table { font-size: 0.9em; } }
+    </style>
+  </head>
+  <body>
+    <div class="container">
+"""
+PAGE_FOOT = """      <div class="footer">This is an automated report from HighBreak Alert. For support, contact our team.</div>
+    </div>
+  </body>
+</html>
+"""
+
 # Step 1: Wait until 9:15 AM IST to execute the first Google Apps Script macro
 current_time_ist = datetime.now(timezone.utc) + timedelta(hours=5, minutes=30)
 target_time_ist_1 = current_time_ist.replace(hour=9, minute=15, second=0, microsecond=0)
 if current_time_ist < target_time_ist_1:
     wait_seconds = (target_time_ist_1 - current_time_ist).total_seconds()
-    print(f"Waiting {wait_seconds:.0f} seconds until 9:15 AM IST to refresh Google Sheet...")
+    logger.info(f"Waiting {wait_seconds:.0f} seconds until 9:15 AM IST to refresh Google Sheet...")
     time.sleep(wait_seconds)
 
 # Execute the Google Apps Script macro (first refresh)
 macro_url = "https://script.google.com/macros/s/AKfycbwkJqNZI6FCkozCQ5GusMXWttwsEMnzp02cWQcbJ9dRIWidBLS_ok0b71cUViDfxsJv/exec"
 execute_macro_with_retry(macro_url)
-print("First Google Sheet refresh completed at 9:15 AM IST.")
+logger.info("First Google Sheet refresh completed at 9:15 AM IST.")
 
 # Step 2: Wait 5 minutes (until 9:20 AM IST) for the second refresh
 target_time_ist_2 = target_time_ist_1 + timedelta(minutes=5)
 wait_seconds = (target_time_ist_2 - (datetime.now(timezone.utc) + timedelta(hours=5, minutes=30))).total_seconds()
 if wait_seconds > 0:
-    print(f"Waiting {wait_seconds:.0f} seconds until 9:20 AM IST for second refresh...")
+    logger.info(f"Waiting {wait_seconds:.0f} seconds until 9:20 AM IST for second refresh...")
     time.sleep(wait_seconds)
 
 # Execute the Google Apps Script macro again (second refresh)
 execute_macro_with_retry(macro_url)
-print("Second Google Sheet refresh completed at 9:20 AM IST.")
+logger.info("Second Google Sheet refresh completed at 9:20 AM IST.")
 
-# Step 3: Access the Google Sheet data
+# Step 3: Access the Google Sheet data (authenticated during the waits above)
 try:
-    credentials_info = json.loads(os.getenv('GOOGLE_CREDENTIALS'))
-    creds = Credentials.from_service_account_info(credentials_info, scopes=[
-        'https://spreadsheets.google.com/feeds',
-        'https://www.googleapis.com/auth/drive',
-        'https://www.googleapis.com/auth/spreadsheets'
-    ])
-    client = gspread.authorize(creds)
+    client, workbook, worksheets, recipients = prewarm.result()
 except Exception as e:
-    print(f"Error loading credentials: {e}")
+    logger.error(f"Error preparing Google Sheets access: {e}")
     exit(1)
 
-sheet_id = '1ZYa5e92hmTc27KYSLKJyx_zvYydR5b1jMk7dYIqFsss'
-workbook = client.open_by_key(sheet_id)
-
-
-print("waiting for 9:21 to find breaking stocks")
-time.sleep(60)  #insted of exact 9:20 AM run at 9:21 for sending the email 
+# Authenticated SMTP sessions for the per-recipient sends, opened while waiting
+smtp_pool = SmtpPool(smtp_server, smtp_port, username, password, size=min(15, max(1, len(recipients))))
+prewarm_smtp = not (BROADCAST_ENABLED or MAIL_QUEUE_ENABLED)
 
-#waitoing for 1m
+logger.info("waiting for 9:21 to find breaking stocks")
+wait_started = time.time()
+if prewarm_smtp:
+    smtp_pool.warm()
+time.sleep(max(0, 60 - (time.time() - wait_started)))  #insted of exact 9:20 AM run at 9:21 for sending the email 
 
- 
 # Fetch data from both sheets
-high_break_trade_sheet = workbook.worksheet('high_break_trade')
-onetime_five_open_sheet = workbook.worksheet('onetime_five_open')
+high_break_trade_sheet = worksheets['high_break_trade']
+onetime_five_open_sheet = worksheets['onetime_five_open']
 
 gid_high_break = high_break_trade_sheet.id
 data_high_break = high_break_trade_sheet.get_all_values()
@@ -91,31 +167,28 @@ column_b_values = onetime_five_open_sheet.col_values(2)
 last_row_b = max(i for i, val in enumerate(column_b_values, 1) if val) if any(column_b_values) else 3
 data_onetime_five = onetime_five_open_sheet.get_all_values()[:last_row_b + 1]
 
-# Fetch emails from "credential" sheet
-credential_sheet = workbook.worksheet('credential')
-email_column = credential_sheet.col_values(4)
-recipients = [email for email in email_column[2:] if email]
-
 # Write stock names and formulas to "compare" sheet at 9:20 AM
-compare_sheet = workbook.worksheet('compare')
+compare_sheet = worksheets['compare']
 stock_names_920 = [row[1] for row in data_high_break[3:] if row[1]]  # Fetch stocks from column B, skipping headers
 num_stocks_920 = len(stock_names_920)
 
-# Flush (clear) existing data in ranges B4:E and G4:J
-compare_sheet.batch_clear(['B4:E', 'G4:J'])
-print("Cleared existing data from B4:E and G4:J in compare sheet at 9:21 AM IST.")
+# Clear and rewrite the 9:20 AM block in three requests instead of five
+with CoalescedWrites(compare_sheet) as writes:
+    # Flush (clear) existing data in ranges B4:E and G4:J
+    writes.batch_clear(['B4:E', 'G4:J'])
 
-# Write new stock names to column B
-compare_sheet.update(range_name='B4', values=[[stock] for stock in stock_names_920])  # Write to B4 downward
-print(f"Wrote {num_stocks_920} stocks to column B at 9:20 AM IST.")
+    # Write new stock names to column B
+    writes.update(range_name='B4', values=[[stock] for stock in stock_names_920])  # Write to B4 downward
 
-# Generate and write formulas row-by-row for 9:20 AM data
-c_formulas = [f'=CONCAT("NSE:",B{row+4})' for row in range(num_stocks_920)]
-d_formulas = [f'=GOOGLEFINANCE(C{row+4},"priceopen")' for row in range(num_stocks_920)]
-e_formulas = [f'=GOOGLEFINANCE(C{row+4},"price")' for row in range(num_stocks_920)]
-compare_sheet.update(range_name='C4:C' + str(3 + num_stocks_920), values=[[formula] for formula in c_formulas], value_input_option='USER_ENTERED')
-compare_sheet.update(range_name='D4:D' + str(3 + num_stocks_920), values=[[formula] for formula in d_formulas], value_input_option='USER_ENTERED')
-compare_sheet.update(range_name='E4:E' + str(3 + num_stocks_920), values=[[formula] for formula in e_formulas], value_input_option='USER_ENTERED')
+    # Generate and write formulas row-by-row for 9:20 AM data
+    c_formulas = [f'=CONCAT("NSE:",B{row+4})' for row in range(num_stocks_920)]
+    d_formulas = [f'=GOOGLEFINANCE(C{row+4},"priceopen")' for row in range(num_stocks_920)]
+    e_formulas = [f'=GOOGLEFINANCE(C{row+4},"price")' for row in range(num_stocks_920)]
+    writes.update(range_name='C4:C' + str(3 + num_stocks_920), values=[[formula] for formula in c_formulas], value_input_option='USER_ENTERED')
+    writes.update(range_name='D4:D' + str(3 + num_stocks_920), values=[[formula] for formula in d_formulas], value_input_option='USER_ENTERED')
+    writes.update(range_name='E4:E' + str(3 + num_stocks_920), values=[[formula] for formula in e_formulas], value_input_option='USER_ENTERED')
+logger.info("Cleared existing data from B4:E and G4:J in compare sheet at 9:21 AM IST.")
+logger.info(f"Wrote {num_stocks_920} stocks to column B at 9:20 AM IST.")
 
 time.sleep(10)  # Increased sleep to allow GOOGLEFINANCE  to fetch data
 
@@ -137,26 +210,9 @@ onetime_five_rows = ''.join(
 )
 
 export_url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=xlsx&gid={gid_high_break}"
-html_body_template = """
-<html>
-  <head>
-    <style>
-      body {{ font-family: 'Helvetica Neue', Arial, sans-serif; color: #333; line-height: 1.6; background-color: #f4f4f4; margin: 0; padding: 20px; }}
-      .container {{ max-width: 800px; margin: 0 auto; background: #fff; padding: 30px; border-radius: 8px; box-shadow: 0 2px 8px rgba(0,0,0,0.1); }}
-      h3 {{ color: #2c3e50; margin-top: 30px; border-bottom: 2px solid #007bff; padding-bottom: 8px; }}
-      p {{ margin: 10px 0; }}
-      table {{ border-collapse: collapse; width: 100%; margin-bottom: 20px; }}
-      ul {{ list-style: none; padding: 0; }}
-      .download-btn {{ display: inline-block; padding: 12px 24px; background-color: #007bff; color: #fff; text-decoration: none; border-radius: 5px; font-weight: 500; transition: background-color 0.3s, transform 0.2s; }}
-      .download-btn:hover {{ background-color: #0056b3; transform: translateY(-2px); }}
-      .footer {{ margin-top: 30px; text-align: center; color: #6c757d; font-size: 0.9em; }}
-      @media (max-width: 600px) {{ .container {{ padding: 15px; }} table {{ font-size: 0.9em; }} }}
-    </style>
-  </head>
-  <body>
-    <div class="container">
-      <p>Dear {recipient_name},</p>
-      <p>Generated on: {generated_time}</p>
+
+generated_time = (datetime.now(timezone.utc) + timedelta(hours=5, minutes=30)).strftime('%Y-%m-%d %H:%M:%S') + ' IST'
+first_sections = f"""      <p>Generated on: {generated_time}</p>
       <h3>High Break Trade Data</h3>
       <table>{high_break_headers}{high_break_rows}</table>
       <h3>Onetime Five Open Data</h3>
@@ -164,118 +220,118 @@ html_body_template = """
       <h3>Stock Names (Column B)</h3>
       <ul>{high_break_stocks}</ul>
       <p><a href="{export_url}" class="download-btn">Download Excel</a></p>
-      <div class="footer">This is an automated report from HighBreak Alert. For support, contact our team.</div>
-    </div>
-  </body>
-</html>
 """
 
-# SMTP setup
-smtp_server = 'smtp.gmail.com'
-smtp_port = 587
-username = os.getenv('SMTP_USERNAME')
-password = os.getenv('SMTP_PASSWORD')
-sender = '"HighBreak Alert ORB <' + os.getenv('SMTP_USERNAME') + '>'
-generated_time = (datetime.now(timezone.utc) + timedelta(hours=5, minutes=30)).strftime('%Y-%m-%d %H:%M:%S') + ' IST'
-
-# Send email function
+# Send email function (over one of the pre-opened SMTP sessions)
 def send_email(recipient_email, html_body):
     try:
-        with smtplib.SMTP(smtp_server, smtp_port) as s:
-            s.starttls()
-            s.login(username, password)
-            msg = MIMEText(html_body, 'html')
-            msg['Subject'] = 'Stock Data Report from high_break_trade and onetime_five_open'
-            msg['From'] = sender
-            msg['To'] = recipient_email
-            s.sendmail(sender, [recipient_email], msg.as_string())
-            print(f"Email sent to {recipient_email}")
+        msg = MIMEText(html_body, 'html')
+        msg['Subject'] = 'Stock Data Report from high_break_trade and onetime_five_open'
+        msg['From'] = sender
+        msg['To'] = recipient_email
+        smtp_pool.sendmail(sender, [recipient_email], msg.as_string())
+        logger.debug(f"Email sent to {recipient_email}")
         return True
     except Exception as e:
-        print(f"Error sending to {recipient_email}: {e}")
+        logger.error(f"Error sending a report email: {e}")
+        logger.debug(f"Failed recipient: {recipient_email}")
         return False
 
 # Prepare personalized messages
-messages_to_send = []
-for recipient_email in recipients:
-    recipient_name = recipient_email.split('@')[0].replace('.', ' ').replace('_', ' ').title()
-    html_body = html_body_template.format(
-        recipient_name=recipient_name,
-        generated_time=generated_time,
-        high_break_headers=high_break_headers,
-        high_break_rows=high_break_rows,
-        high_break_stocks=high_break_stocks,
-        onetime_five_headers=onetime_five_headers,
-        onetime_five_rows=onetime_five_rows,
-        export_url=export_url
-    )
-    messages_to_send.append((recipient_email, html_body))
+def render_first_html(recipient_name):
+    return f"{PAGE_HEAD}      <p>Dear {recipient_name},</p>\n{first_sections}{PAGE_FOOT}"
+
+# Send a report to every recipient: one BCC'd message per batch in broadcast
+# mode, through the persistent outbox when MAIL_QUEUE is set, otherwise one
+# personalised message per address
+def send_report(render_html, subject, log_name):
+    if BROADCAST_ENABLED:
+        msg = MIMEText(render_html(BROADCAST_GREETING_NAME), 'html')
+        msg['Subject'] = subject
+        msg['From'] = sender
+        return send_broadcast(msg, recipients, smtp_server, smtp_port, username, password, sender, log_name=log_name)
+    if MAIL_QUEUE_ENABLED:
+        queued = []
+        for recipient_email in recipients:
+            msg = MIMEText(render_html(recipient_name(recipient_email)), 'html')
+            msg['Subject'] = subject
+            msg['From'] = sender
+            msg['To'] = recipient_email
+            queued.append((recipient_email, msg))
+        # Keyed by the IST session date, like the other scripts' queue runs
+        return MailQueue().deliver(f"{log_name}-{today_ist}", queued)
+    messages = [(recipient_email, render_html(recipient_name(recipient_email))) for recipient_email in recipients]
+    with ThreadPoolExecutor(max_workers=15) as executor:
+        results = executor.map(lambda args: send_email(*args), messages)
+        return sum(1 for success in results if success)
 
 # Send emails immediately after second refresh
-print("Sending emails at 9:20 AM IST...")
-emails_sent = 0
-with ThreadPoolExecutor(max_workers=15) as executor:
-    results = executor.map(lambda args: send_email(*args), messages_to_send)
-    emails_sent = sum(1 for success in results if success)
+logger.info("Sending emails at 9:20 AM IST...")
+emails_sent = send_report(render_first_html, 'Stock Data Report from high_break_trade and onetime_five_open', 'intraday_first_delivery')
 
 # Wait 3 minutes until 9:23 AM IST
-print("\nWaiting until 9:23 AM IST to refresh Google Sheet again... & writing stock for colum G ub sheet (compare)\n")
+logger.info("Waiting until 9:23 AM IST to refresh Google Sheet again... & writing stock for colum G ub sheet (compare)")
 time.sleep(120)
 
 # Execute the Google Apps Script macro again (third refresh at 9:23 AM)
 execute_macro_with_retry(macro_url)
-print("Third Google Sheet refresh completed at 9:23 AM IST.")
+logger.info("Third Google Sheet refresh completed at 9:23 AM IST.")
 data_high_break_923 = high_break_trade_sheet.get_all_values()
 stock_names_923 = [row[1] for row in data_high_break_923[3:] if row[1]]  # Fetch updated stocks
 num_stocks_923 = len(stock_names_923)
-compare_sheet.update(range_name='G4', values=[[stock] for stock in stock_names_923])  # Write to G4 downward
-print(f"Wrote {num_stocks_923} stocks to column G at 9:23 AM IST.")
-# Generate and write formulas row-by-row for 9:23 AM data
-h_formulas = [f'=CONCAT("NSE:",G{row+4})' for row in range(num_stocks_923)]
-i_formulas = [f'=GOOGLEFINANCE(H{row+4},"priceopen")' for row in range(num_stocks_923)]
-j_formulas = [f'=GOOGLEFINANCE(H{row+4},"price")' for row in range(num_stocks_923)]
-compare_sheet.update(range_name='H4:H' + str(3 + num_stocks_923), values=[[formula] for formula in h_formulas], value_input_option='USER_ENTERED')
-compare_sheet.update(range_name='I4:I' + str(3 + num_stocks_923), values=[[formula] for formula in i_formulas], value_input_option='USER_ENTERED')
-compare_sheet.update(range_name='J4:J' + str(3 + num_stocks_923), values=[[formula] for formula in j_formulas], value_input_option='USER_ENTERED')
-
-time.sleep(10)  # Increased sleep to allow GOOGLEFINANCE to fetch data
+with CoalescedWrites(compare_sheet) as writes:
+    writes.update(range_name='G4', values=[[stock] for stock in stock_names_923])  # Write to G4 downward
+    # Generate and write formulas row-by-row for 9:23 AM data
+    h_formulas = [f'=CONCAT("NSE:",G{row+4})' for row in range(num_stocks_923)]
+    i_formulas = [f'=GOOGLEFINANCE(H{row+4},"priceopen")' for row in range(num_stocks_923)]
+    j_formulas = [f'=GOOGLEFINANCE(H{row+4},"price")' for row in range(num_stocks_923)]
+    writes.update(range_name='H4:H' + str(3 + num_stocks_923), values=[[formula] for formula in h_formulas], value_input_option='USER_ENTERED')
+    writes.update(range_name='I4:I' + str(3 + num_stocks_923), values=[[formula] for formula in i_formulas], value_input_option='USER_ENTERED')
+    writes.update(range_name='J4:J' + str(3 + num_stocks_923), values=[[formula] for formula in j_formulas], value_input_option='USER_ENTERED')
+logger.info(f"Wrote {num_stocks_923} stocks to column G at 9:23 AM IST.")
+
+wait_started = time.time()
+if prewarm_smtp:
+    smtp_pool.warm()  # replace sessions the server dropped since the first send
+time.sleep(max(0, 10 - (time.time() - wait_started)))  # Increased sleep to allow GOOGLEFINANCE to fetch data
 
 # New section for orb_dhan sheet updates
-orb_dhan_sheet = workbook.worksheet('orb_dhan')
+orb_dhan_sheet = worksheets['orb_dhan']
 
-# Flush (clear) existing data in columns B4 downward and H4 downward
-orb_dhan_sheet.batch_clear(['B4:F', 'H4:L'])
-print("\nCleared existing data from B4:B and H4:H in orb_dhan sheet.")
-
-# Fetch stock names for 9:20 AM data from compare sheet column L (L4 downward)
-stock_names_920 = compare_sheet.col_values(12)[3:]  # Column L is index 12 (1-based), skip rows 1-3
-stock_names_920 = [stock for stock in stock_names_920 if stock]  # Filter out empty values
+# Fetch stock names for 9:20 AM (column L) and 9:23 AM (column M) data from compare sheet, L4/M4 downward, in one read
+compare_l, compare_m = compare_sheet.batch_get(['L4:L', 'M4:M'])
+stock_names_920 = [row[0] for row in compare_l if row and row[0]]  # Filter out empty values
 num_stocks_920 = len(stock_names_920)
-orb_dhan_sheet.update(range_name='B4', values=[[stock] for stock in stock_names_920])
-print(f"Wrote {num_stocks_920} stocks to column B in orb_dhan sheet.")
-
-# Fetch stock names for 9:23 AM data from compare sheet column M (M4 downward)
-stock_names_923 = compare_sheet.col_values(13)[3:]  # Column M is index 13 (1-based), skip rows 1-3
-stock_names_923 = [stock for stock in stock_names_923 if stock]  # Filter out empty values
+stock_names_923 = [row[0] for row in compare_m if row and row[0]]
 num_stocks_923 = len(stock_names_923)
-orb_dhan_sheet.update(range_name='H4', values=[[stock] for stock in stock_names_923])
-print(f"Wrote {num_stocks_923} stocks to column H in orb_dhan sheet.")
+
+# Clear and rewrite orb_dhan as one batch_clear plus one batch_update per input option
+writes = CoalescedWrites(orb_dhan_sheet)
+
+# Flush (clear) existing data in columns B4 downward and H4 downward
+writes.batch_clear(['B4:F', 'H4:L'])
+writes.update(range_name='B4', values=[[stock] for stock in stock_names_920])
+writes.update(range_name='H4', values=[[stock] for stock in stock_names_923])
 
 # Update formulas for 9:20 AM data (columns C, D, E) based on column B
-orb_dhan_sheet.update(range_name='C4:C' + str(3 + num_stocks_920), values=[[f'=CONCAT("NSE:",B{row+4})'] for row in range(num_stocks_920)], value_input_option='USER_ENTERED')
-orb_dhan_sheet.update(range_name='D4:D' + str(3 + num_stocks_920), values=[[f'=GOOGLEFINANCE(C{row+4},"priceopen")'] for row in range(num_stocks_920)], value_input_option='USER_ENTERED')
-orb_dhan_sheet.update(range_name='E4:E' + str(3 + num_stocks_920), values=[[f'=GOOGLEFINANCE(C{row+4},"price")'] for row in range(num_stocks_920)], value_input_option='USER_ENTERED')
+writes.update(range_name='C4:C' + str(3 + num_stocks_920), values=[[f'=CONCAT("NSE:",B{row+4})'] for row in range(num_stocks_920)], value_input_option='USER_ENTERED')
+writes.update(range_name='D4:D' + str(3 + num_stocks_920), values=[[f'=GOOGLEFINANCE(C{row+4},"priceopen")'] for row in range(num_stocks_920)], value_input_option='USER_ENTERED')
+writes.update(range_name='E4:E' + str(3 + num_stocks_920), values=[[f'=GOOGLEFINANCE(C{row+4},"price")'] for row in range(num_stocks_920)], value_input_option='USER_ENTERED')
 # Add percentage change formula for 9:20 AM data in column F
-orb_dhan_sheet.update(range_name='F4:F' + str(3 + num_stocks_920), values=[[f'=(E{row+4}-D{row+4})/E{row+4}*100'] for row in range(num_stocks_920)], value_input_option='USER_ENTERED')
+writes.update(range_name='F4:F' + str(3 + num_stocks_920), values=[[f'=(E{row+4}-D{row+4})/E{row+4}*100'] for row in range(num_stocks_920)], value_input_option='USER_ENTERED')
 
 # Update formulas for 9:23 AM data (columns I, J, K) based on column H
-orb_dhan_sheet.update(range_name='I4:I' + str(3 + num_stocks_923), values=[[f'=CONCAT("NSE:",H{row+4})'] for row in range(num_stocks_923)], value_input_option='USER_ENTERED')
-orb_dhan_sheet.update(range_name='J4:J' + str(3 + num_stocks_923), values=[[f'=GOOGLEFINANCE(I{row+4},"priceopen")'] for row in range(num_stocks_923)], value_input_option='USER_ENTERED')
-orb_dhan_sheet.update(range_name='K4:K' + str(3 + num_stocks_923), values=[[f'=GOOGLEFINANCE(I{row+4},"price")'] for row in range(num_stocks_923)], value_input_option='USER_ENTERED')
+writes.update(range_name='I4:I' + str(3 + num_stocks_923), values=[[f'=CONCAT("NSE:",H{row+4})'] for row in range(num_stocks_923)], value_input_option='USER_ENTERED')
+writes.update(range_name='J4:J' + str(3 + num_stocks_923), values=[[f'=GOOGLEFINANCE(I{row+4},"priceopen")'] for row in range(num_stocks_923)], value_input_option='USER_ENTERED')
+writes.update(range_name='K4:K' + str(3 + num_stocks_923), values=[[f'=GOOGLEFINANCE(I{row+4},"price")'] for row in range(num_stocks_923)], value_input_option='USER_ENTERED')
 # Add percentage change formula for 9:23 AM data in column L
-orb_dhan_sheet.update(range_name='L4:L' + str(3 + num_stocks_923), values=[[f'=(K{row+4}-J{row+4})/K{row+4}*100'] for row in range(num_stocks_923)], value_input_option='USER_ENTERED')
+writes.update(range_name='L4:L' + str(3 + num_stocks_923), values=[[f'=(K{row+4}-J{row+4})/K{row+4}*100'] for row in range(num_stocks_923)], value_input_option='USER_ENTERED')
 
-print(f"Updated formulas in orb_dhan sheet for 9:21 AM and 9:23 AM data.")
+writes.flush()
+logger.info("Cleared existing data from B4:B and H4:H in orb_dhan sheet.")
+logger.info(f"Wrote {num_stocks_920} stocks to column B in orb_dhan sheet.")
+logger.info(f"Wrote {num_stocks_923} stocks to column H in orb_dhan sheet.")
+logger.info(f"Updated formulas in orb_dhan sheet for 9:21 AM and 9:23 AM data.")
 
 # New section to send email again with high_break_trade, onetime_five_open, and orb_dhan data
 data_orb_dhan = orb_dhan_sheet.get_all_values()
@@ -313,27 +369,8 @@ onetime_five_rows = ''.join(
 export_url_orb_dhan = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=xlsx"
 generated_time = (datetime.now(timezone.utc) + timedelta(hours=5, minutes=30)).strftime('%Y-%m-%d %H:%M:%S') + ' IST'
 
-# Updated HTML template to include orb_dhan section
-html_body_template = """
-<html>
-  <head>
-    <style>
-      body {{ font-family: 'Helvetica Neue', Arial, sans-serif; color: #333; line-height: 1.6; background-color: #f4f4f4; margin: 0; padding: 20px; }}
-      .container {{ max-width: 800px; margin: 0 auto; background: #fff; padding: 30px; border-radius: 8px; box-shadow: 0 2px 8px rgba(0,0,0,0.1); }}
-      h3 {{ color: #2c3e50; margin-top: 30px; border-bottom: 2px solid #007bff; padding-bottom: 8px; }}
-      p {{ margin: 10px 0; }}
-      table {{ border-collapse: collapse; width: 100%; margin-bottom: 20px; }}
-      ul {{ list-style: none; padding: 0; }}
-      .download-btn {{ display: inline-block; padding: 12px 24px; background-color: #007bff; color: #fff; text-decoration: none; border-radius: 5px; font-weight: 500; transition: background-color 0.3s, transform 0.2s; }}
-      .download-btn:hover {{ background-color: #0056b3; transform: translateY(-2px); }}
-      .footer {{ margin-top: 30px; text-align: center; color: #6c757d; font-size: 0.9em; }}
-      @media (max-width: 600px) {{ .container {{ padding: 15px; }} table {{ font-size: 0.9em; }} }}
-    </style>
-  </head>
-  <body>
-    <div class="container">
-      <p>Dear {recipient_name},</p>
-      <p>Generated on: {generated_time}</p>
+# Data sections of the second email, including orb_dhan
+second_sections = f"""      <p>Generated on: {generated_time}</p>
       <h3>High Break Trade Data</h3>
       <table>{high_break_headers}{high_break_rows}</table>
       <h3>Onetime Five Open Data</h3>
@@ -342,40 +379,24 @@ html_body_template = """
       <table>{orb_dhan_headers}{orb_dhan_rows}</table>
       <h3>Stock Names (Column B & Column B for 9:23 )</h3>
       <ul>{high_break_stocks}</ul>
-      <p><a href="{export_url}" class="download-btn">Download Excel</a></p>
-      <div class="footer">This is an automated report from HighBreak Alert. For support, contact our team.</div>
-    </div>
-  </body>
-</html>
+      <p><a href="{export_url_orb_dhan}" class="download-btn">Download Excel</a></p>
 """
 
 # Prepare personalized messages for second email
-messages_to_send_orb_dhan = []
-for recipient_email in recipients:
-    recipient_name = recipient_email.split('@')[0].replace('.', ' ').replace('_', ' ').title()
-    html_body = html_body_template.format(
-        recipient_name=recipient_name,
-        generated_time=generated_time,
-        high_break_headers=high_break_headers,
-        high_break_rows=high_break_rows,
-        high_break_stocks=high_break_stocks,
-        onetime_five_headers=onetime_five_headers,
-        onetime_five_rows=onetime_five_rows,
-        orb_dhan_headers=orb_dhan_headers,
-        orb_dhan_rows=orb_dhan_rows,
-        export_url=export_url_orb_dhan
-    )
-    messages_to_send_orb_dhan.append((recipient_email, html_body))
+def render_second_html(recipient_name):
+    return f"{PAGE_HEAD}      <p>Dear {recipient_name},</p>\n{second_sections}{PAGE_FOOT}"
 
 # Send emails with high_break_trade, onetime_five_open, and orb_dhan data
-print("Sending second emails with high_break_trade, onetime_five_open, and orb_dhan data at 10:55 AM IST...")
-emails_sent_orb_dhan = 0
-with ThreadPoolExecutor(max_workers=15) as executor:
-    results = executor.map(lambda args: send_email(*args), messages_to_send_orb_dhan)
-    emails_sent_orb_dhan = sum(1 for success in results if success)
+logger.info("Sending second emails with high_break_trade, onetime_five_open, and orb_dhan data at 10:55 AM IST...")
+emails_sent_orb_dhan = send_report(render_second_html, 'Stock Data Report from high_break_trade and onetime_five_open', 'intraday_second_delivery')
+
+logger.info(f"Sent {emails_sent_orb_dhan} second emails successfully with high_break_trade, onetime_five_open, and orb_dhan data.")
 
-print(f"Sent {emails_sent_orb_dhan} second emails successfully with high_break_trade, onetime_five_open, and orb_dhan data.")
+smtp_pool.close()
 
 # Summary
 elapsed_time = time.time() - start_time
-print(f"\nSent {emails_sent} emails successfully. Process completed in {elapsed_time:.2f} seconds.\n")
\ No newline at end of file
+client.quota.log_report()
+transport.log_report()
+logger.info(f"Sent {emails_sent} emails successfully. Process completed in {elapsed_time:.2f} seconds.")
+log_runtime.log_report()
\ No newline at end of file
@@ -1,5 +1,4 @@
 import json
-import requests
 import time
 import smtplib
 import os
@@ -7,16 +6,38 @@ from email.mime.text import MIMEText
 import gspread
 from google.oauth2.service_account import Credentials
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import pytz
 import logging
 import yfinance as yf
 import pandas as pd
 import numpy as np
 import uuid
+from shared.results_history import append_results
+from shared.screen_rules import load_rules, run_screens
+from shared.sheet_writer import StreamingRowWriter, order_rows, write_rows_diff
+from shared.bhavcopy import use_bhavcopy
+from shared.http_transport import HttpTransport
+from shared.local_store import OFFLINE, SHEET_SINK_TIMEOUT, LocalStore, SheetSink
+from shared.log_setup import setup_logging, log_rows
+from shared.lookback import LookbackPlan
+from shared.macro import MacroTrigger
+from shared.mail_queue import MAIL_QUEUE_ENABLED, MailQueue
+from shared.mailer import BROADCAST_ENABLED, BROADCAST_GREETING_NAME, recipient_name, send_broadcast
+from shared.negative_cache import NegativeCache
+from shared.prefilter import ORB_PREFILTER, TWO_PHASE_FETCH, TwoPhaseFetch
+from shared.price_cache import PriceCache, stored_history
+from shared.run_journal import RunJournal
+from shared.sheet_inputs import SheetInputs
+from shared.sheets_client import authorize
+from shared.snapshot import PRECOMPUTE, Snapshot
+from shared.stages import StagePipeline, StageError
+from shared.state import REPO_ROOT, state_path
+from shared.timeframes import TimeframeCache
+from shared.trading_calendar import SessionLog, TradingCalendar, check_freshness, should_run
 
 # Set up logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+log_runtime = setup_logging()
 logger = logging.getLogger(__name__)
 
 # Set IST timezone
@@ -26,63 +47,78 @@ ist = pytz.timezone('Asia/Kolkata')
 start_time = time.time()
 logger.info("Starting stock report script..")
 
+# Weekends and NSE holidays have no session to report on, and a session
+# already processed has no new bar to fetch; offline runs are never scheduled
+# and always go ahead. The evening run reports on today's bar, the morning run
+# on the last completed session
+calendar = TradingCalendar()
+today = datetime.now(ist).date()
+expected_session = today if PRECOMPUTE else calendar.previous_session(today)
+sessions = SessionLog('orb_setup')
+session_mode = 'precompute' if PRECOMPUTE else 'report'
+if not OFFLINE and (not should_run(calendar, 'ORB_setup', today)
+                    or sessions.covers(session_mode, expected_session)):
+    log_runtime.log_report()
+    exit(0)
+
 
 # Step 1: Execute Google Apps Script macro twice with a 4-second pause
 macro_url = "https://script.google.com/macros/s/AKfycbxZtNEydZxYEHuwSF8KEtSysaamm_fTrFkDI3cZPpevXOkCpLBnZVZX2ePqXa7hywIi5Q/exec"
-logger.info("Executing first Google Apps Script macro...")
-try:
-    response = requests.get(macro_url)
-    requests.get(macro_url)
-    response.raise_for_status()
-    logger.info("First Google Apps Script macro executed successfully.")
-except Exception as e:
-    logger.error(f"Error executing first macro: {e}")
-
-logger.info("Pausing for 4 seconds...")
-time.sleep(4)
-
-logger.info("Executing second Google Apps Script macro...")
-try:
-    response = requests.get(macro_url)
-    response.raise_for_status()
-    logger.info("Second Google Apps Script macro executed successfully.")
-except Exception as e:
-    logger.error(f"Error executing second macro: {e}")
+# Pooled HTTP connections shared by the macro, Yahoo and Sheets requests
+transport = HttpTransport(pool_size=10)
+macro = MacroTrigger(macro_url, transport=transport, enabled=not OFFLINE)
+
+def refresh_macro():
+    logger.info("Executing first Google Apps Script macro...")
+    macro.run("First macro")
+    logger.info("Pausing for 4 seconds...")
+    time.sleep(4)
+    logger.info("Executing second Google Apps Script macro...")
+    macro.run("Second macro")
 
 # Step 2: Google Sheets authentication
-try:
+def authenticate():
     credentials_info = json.loads(os.environ.get('GOOGLE_CREDENTIALS_JSON'))
     creds = Credentials.from_service_account_info(credentials_info, scopes=[
         'https://www.googleapis.com/auth/spreadsheets',
         'https://www.googleapis.com/auth/drive'
     ])
-    client = gspread.authorize(creds)
+    client = authorize(creds, transport=transport)
     logger.info("Google Sheets authentication successful")
-except Exception as e:
-    logger.error(f"Error loading credentials: {e}")
-    exit(1)
+    return client
 
 # Open the Google Spreadsheet
 sheet_id = '1Wed42cXywWty-J7JRmXlKs-61TpnD3nNtcVfpjnIYXQ'
-try:
+
+def open_workbook(client):
     workbook = client.open_by_key(sheet_id)
     logger.info("Successfully opened Google Spreadsheet")
-except Exception as e:
-    logger.error(f"Error opening spreadsheet: {e}")
-    exit(1)
+    return workbook
+
+# The run's tables live in the local store; the sheet is mirrored in the background
+store = LocalStore('orb_setup')
+sink = SheetSink(enabled=not OFFLINE and not PRECOMPUTE)
+
+# Completed symbols, stages and emails of today's run, so a restarted run
+# resumes where the last attempt stopped
+run_date = datetime.now(ist).date()
+journal = RunJournal('orb_setup-precompute' if PRECOMPUTE else 'orb_setup-offline' if OFFLINE else 'orb_setup',
+                     run_date)
+
+# Symbols (Sheet1 column B from row 4) and recipients (credential column D from
+# row 3) change rarely, so they come from a revision-checked local copy
+def read_inputs(client):
+    values = SheetInputs(client, sheet_id, {'symbols': 'Sheet1!B4:B', 'recipients': 'credential!D3:D'}).load()
+    store.put_inputs(values)
+    return values
 
 # Get stock symbols from Sheet1 (Column B, starting from row 4)
-try:
-    sheet1 = workbook.worksheet('Sheet1')
-    stock_symbols = [s for s in sheet1.col_values(2)[3:] if s.strip()]  # Skip empty strings
+def read_symbols(inputs):
+    stock_symbols = [s for s in inputs['symbols'] if s.strip()]  # Skip empty strings
     logger.info(f"Retrieved {len(stock_symbols)} stock symbols from Sheet1: {stock_symbols[:5]}...")
-except Exception as e:
-    logger.error(f"Error reading stock symbols from Sheet1: {e}")
-    exit(1)
-
-if not stock_symbols:
-    logger.error("No stock symbols found in Sheet1, Column B, starting from row 4")
-    exit(1)
+    if not stock_symbols:
+        raise ValueError("No stock symbols found in Sheet1, Column B, starting from row 4")
+    return stock_symbols
 
 # Headers for Calculation sheet
 headers = [
@@ -92,13 +128,43 @@ headers = [
 ]
 
 # Create or open Calculation sheet
+def open_calc_sheet(workbook):
+    try:
+        calc_sheet = workbook.worksheet('Calculation')
+        logger.info("Opened Calculation sheet")
+    except gspread.WorksheetNotFound:
+        calc_sheet = workbook.add_worksheet(title='Calculation', rows=100, cols=15)
+        calc_sheet.update(values=[headers], range_name='A1:O1')
+        logger.info("Created Calculation sheet and set headers")
+    return calc_sheet
+
+# Extra declarative screens, evaluated over the already-downloaded history;
+# their weekly/monthly bars persist between runs in the timeframe cache
+rules_path = os.environ.get('SCREEN_RULES', os.path.join(REPO_ROOT, 'screen_rules.json'))
+timeframe_cache = TimeframeCache('orb_setup')
+
+# Bars each Calculation column and screen needs; the daily history covers the longest
+calc_lookbacks = {
+    'SMA(Close, 200)': 'sma(close, 200)',
+    'ADX(14)': 'adx(14)',
+    'SMA(Volume, 20)': 'sma(volume, 20)',
+    'RSI(14)': 'rsi(14)',
+}
 try:
-    calc_sheet = workbook.worksheet('Calculation')
-    logger.info("Opened Calculation sheet")
-except gspread.WorksheetNotFound:
-    calc_sheet = workbook.add_worksheet(title='Calculation', rows=100, cols=15)
-    calc_sheet.update(values=[headers], range_name='A1:O1')
-    logger.info("Created Calculation sheet and set headers")
+    lookback = LookbackPlan(calc_lookbacks, rules=load_rules(rules_path) if os.path.exists(rules_path) else None)
+except (OSError, ValueError) as e:
+    logger.error(f"Error reading screen rules from {rules_path}, planning the Calculation columns only: {e}")
+    lookback = LookbackPlan(calc_lookbacks)
+lookback.log_report(run_date)
+
+# Daily history is downloaded once per symbol and shared with get_stock_data
+price_cache = PriceCache(start=lookback.start(run_date), session=transport.yahoo_session())
+two_phase = (TwoPhaseFetch(ORB_PREFILTER, session=price_cache.session, full_bars=lookback.bars)
+             if TWO_PHASE_FETCH and not OFFLINE else None)
+if OFFLINE:
+    price_cache.provider = stored_history
+negative_cache = NegativeCache('orb_setup', today=datetime.now(ist).date())
+snapshot = Snapshot('orb_setup', headers)
 
 # Manual RSI calculation
 def calculate_rsi(close, period=14):
@@ -121,13 +187,35 @@ def calculate_adx(high, low, close, period=14):
     dx = 100 * abs(di_plus - di_minus) / (di_plus + di_minus).replace(0, np.finfo(float).eps)
     return float(dx.ewm(span=period, adjust=False).mean().iloc[-1])
 
+# Row for a symbol the short-window prefilter rejected: the cheap conditions
+# come from the short history, the SMA200/ADX cells are left blank
+def prefiltered_row(symbol, hist):
+    latest_close = float(hist['Close'].iloc[-1])
+    latest_open = float(hist['Open'].iloc[-1])
+    latest_volume = int(hist['Volume'].iloc[-1])
+    sma_vol_20 = float(hist['Volume'].rolling(window=20).mean().iloc[-1])
+    rsi_14 = calculate_rsi(hist['Close'])
+    close_gt_open = "Yes" if latest_close > latest_open else "No"
+    vol_gt_1_5_sma = "Yes" if latest_volume > 1.5 * sma_vol_20 else "No"
+    rsi_gt_40 = "Yes" if rsi_14 > 40 else "No"
+    return [symbol[:-3], symbol, latest_close, "", "", latest_open,
+            latest_volume, sma_vol_20, rsi_14, "", "",
+            close_gt_open, vol_gt_1_5_sma, rsi_gt_40, "No"]
+
 # Function to fetch and calculate stock data
 def get_stock_data(symbol):
     try:
-        stock = yf.Ticker(symbol)
-        hist = stock.history(period="1y", interval="1d", auto_adjust=False, prepost=False)
+        if two_phase and symbol in two_phase.rejected:
+            return prefiltered_row(symbol, two_phase.short[symbol]), symbol
+        # Histories fetched deeper to seed the timeframe cache are cut to the
+        # planned window so every row is computed over the same span
+        hist = price_cache.history(symbol).iloc[-lookback.bars:]
         
-        if hist.empty or len(hist) < 200:
+        if hist.empty:
+            negative_cache.record_error(symbol, 'no data', 'empty history, possibly delisted or renamed')
+            return None, symbol
+        if len(hist) < 200:
+            negative_cache.record_short_history(symbol, len(hist))
             return None, symbol
         
         latest_close = float(hist['Close'].iloc[-1])
@@ -140,6 +228,7 @@ def get_stock_data(symbol):
         
         if pd.isna(sma_200) or pd.isna(sma_vol_20):
             logger.warning(f"Missing SMA data for {symbol}")
+            negative_cache.record_error(symbol, 'missing data', 'indicator inputs are NaN')
             return None, symbol
 
         close_gt_sma200 = "Yes" if latest_close > sma_200 else "No"
@@ -151,65 +240,304 @@ def get_stock_data(symbol):
                                          close_gt_open == "Yes", vol_gt_1_5_sma == "Yes", 
                                          rsi_gt_40 == "Yes"]) else "No"
 
+        negative_cache.clear(symbol)
         return [symbol[:-3], symbol, latest_close, sma_200, adx_14, latest_open,
                 latest_volume, sma_vol_20, rsi_14, close_gt_sma200, adx_gt_25,
                 close_gt_open, vol_gt_1_5_sma, rsi_gt_40, all_conditions_met], symbol
     except Exception as e:
         logger.error(f"Error fetching data for {symbol}: {e}")
+        negative_cache.record_error(symbol, 'error', e)
         return None, symbol
 
-# Test with a known valid symbol
-logger.info("Testing data fetch with RELIANCE.NS...")
-test_data, _ = get_stock_data("RELIANCE.NS")
-if test_data:
-    logger.info(f"Test fetch successful: {test_data}")
+# Connectivity probe with a known valid symbol, kept out of the price cache so the probe symbol never
+# joins the screened histories or the negative cache
+def test_fetch():
+    logger.info("Testing data fetch with RELIANCE.NS...")
+    try:
+        hist = yf.Ticker("RELIANCE.NS", session=transport.yahoo_session()).history(period="5d", interval="1d")
+    except Exception as e:
+        logger.error(f"Test fetch failed for RELIANCE.NS: {e}")
+        return
+    if hist.empty:
+        logger.error("Test fetch failed for RELIANCE.NS. Check yfinance connectivity or API status.")
+    else:
+        logger.info(f"Test fetch successful: RELIANCE.NS closed at {float(hist['Close'].iloc[-1]):.2f} "
+                    f"on {hist.index[-1].date()}")
+
+# Rows precomputed last evening that are still current; only the others are fetched
+def load_snapshot():
+    return snapshot.load(datetime.now(ist).date(), session=transport.yahoo_session())
+
+def prefetch_prices(stock_symbols, fresh_rows=None):
+    stale = [symbol for symbol in stock_symbols if symbol not in (fresh_rows or {}) and symbol not in journal.results]
+    symbols = negative_cache.eligible([f"{symbol}.NS" for symbol in stale])
+    bhavcopy = None if OFFLINE else use_bhavcopy(price_cache, symbols)
+    if two_phase:
+        symbols = two_phase.run(symbols)
+        two_phase.log_report()
+    # Symbols whose weekly/monthly bars are too short are fetched from further back once
+    seeding = {} if OFFLINE else lookback.seed_starts(symbols, timeframe_cache, run_date)
+    price_cache.starts.update(seeding)
+    price_cache.prefetch(symbols, max_workers=10, pacing=0.05)
+    if bhavcopy:
+        logger.info(f"Bhavcopy: {bhavcopy.appended} histories extended, {bhavcopy.fallbacks} fetched from Yahoo")
+    # The evening run reports on today's bar, the morning run on the last session
+    histories = price_cache.histories()
+    timeframe_cache.mark_seeded([s for s, start in seeding.items()
+                                 if s in histories and price_cache.fetched_from.get(s) == start],
+                                lookback.timeframe_needs)
+    if two_phase:
+        histories.update((s, two_phase.short[s]) for s in two_phase.rejected)
+    # Latest bar behind any row of this run, recorded once the run completes;
+    # a partial bar of a forced run during market hours does not count
+    global latest_bar
+    latest_bar = max([h.index[-1].date() for h in histories.values()]
+                     + [date.fromisoformat(d) for d in snapshot.dates.values()]
+                     + list(journal.data_dates.values()), default=None)
+    if latest_bar:
+        latest_bar = min(latest_bar, expected_session)
+    stale = check_freshness(histories, expected_session)
+    return bool(histories) and len(stale) == len(histories)  # No new bar anywhere
+
+# Startup runs as a dependency graph so the macro refresh, Sheets auth,
+# symbol read and price downloads overlap instead of running back to back
+pipeline = StagePipeline(max_workers=6)
+if OFFLINE:
+    # Inputs from the store and prices from .state/prices/; nothing else to start
+    pipeline.add('inputs', store.inputs)
+    pipeline.add('symbols', read_symbols, deps=['inputs'])
+    pipeline.add('price_prefetch', prefetch_prices, deps=['symbols'])
+elif PRECOMPUTE:
+    pipeline.add('auth', authenticate)
+    pipeline.add('inputs', read_inputs, deps=['auth'])
+    pipeline.add('symbols', read_symbols, deps=['inputs'])
+    # Evening run: only the downloads and indicator math, for the morning snapshot
+    pipeline.add('price_prefetch', prefetch_prices, deps=['symbols'])
 else:
-    logger.error("Test fetch failed for RELIANCE.NS. Check yfinance connectivity or API status.")
-
-# Batch update data for Calculation sheet
-batch_data = []
+    pipeline.add('auth', authenticate)
+    pipeline.add('inputs', read_inputs, deps=['auth'])
+    pipeline.add('symbols', read_symbols, deps=['inputs'])
+    if not journal.done('macro_refresh'):
+        pipeline.add('macro_refresh', refresh_macro)
+    pipeline.add('workbook', open_workbook, deps=['auth'])
+    pipeline.add('calc_sheet', open_calc_sheet, deps=['workbook'])
+    if not journal.done('test_fetch'):
+        pipeline.add('test_fetch', test_fetch)
+    pipeline.add('snapshot', load_snapshot)
+    pipeline.add('price_prefetch', prefetch_prices, deps=['symbols', 'snapshot'])
+try:
+    stage_results = pipeline.run()
+except StageError as e:
+    logger.error(f"Error during startup: {e}")
+    exit(1)
+for name in ('macro_refresh', 'test_fetch'):
+    if name in stage_results:
+        journal.mark(name)
+client = stage_results.get('auth')
+workbook = stage_results.get('workbook')
+stock_symbols = stage_results['symbols']
+calc_sheet = stage_results.get('calc_sheet')
+fresh_rows = stage_results.get('snapshot', {})
+
+# Closes the sink and journal and logs the run's reports; every exit after
+# startup goes through here
+def close_run():
+    sink.close()
+    journal.close()
+    pipeline.log_report()
+    sink.log_report()
+    store.log_report()
+    if client:
+        client.quota.log_report()
+    transport.log_report()
+    log_runtime.log_report()
+
+# Evening run before the day's bars are published: every row would carry the
+# previous session's date, which the morning run recomputes anyway
+if PRECOMPUTE and stage_results['price_prefetch']:
+    logger.info(f"No history has a bar for {run_date} yet, nothing to precompute")
+    close_run()
+    exit(0)
+
+# Calculation rows go to the local store as symbols complete. The sink streams
+# them to their fixed positions in the sheet (Sheet1 symbol order) in chunks,
+# so downstream tabs fill in while the slowest downloads are still running;
+# only cells that changed are sent
+results_by_symbol = {}
 start_row = 4
+calc_cache = state_path('orb_setup', 'calculation_rows.json')
+calc_writer = None
+
+def open_calc_writer():
+    global calc_writer
+    try:
+        calc_writer = StreamingRowWriter(calc_sheet, stock_symbols, len(headers), start_row, 2, cache_path=calc_cache)
+    except Exception as e:
+        logger.error(f"Error preparing streaming Calculation writes, writing once at the end: {e}")
+
+def stream_row(symbol, row):
+    if calc_writer:
+        calc_writer.add(symbol, row)
+
+# Date of the last bar behind a row: the short history for symbols the
+# two-phase fetch settled on, else the finished download; None for rows that
+# were never fetched this run (journal replays, snapshot and offline rows)
+def data_date(symbol):
+    ticker = f"{symbol}.NS"
+    if two_phase and ticker in two_phase.rejected:
+        return two_phase.short[ticker].index[-1].date()
+    return price_cache.latest_date(ticker)
+
+def add_result(symbol, row):
+    results_by_symbol[symbol] = row
+    store.put_result(symbol, row, run_date)
+    journal.record_result(symbol, row, data_date(symbol))
+    sink.submit('Calculation rows', stream_row, symbol, row)
+
+if not journal.done('calculation'):
+    sink.submit('Calculation writer', open_calc_writer)
+
+# Rows journaled by an earlier attempt and snapshot rows go out first; symbols
+# in the negative cache keep a blank row until their retry date
+for symbol in stock_symbols:
+    if symbol in journal.results:
+        add_result(symbol, journal.results[symbol])
+    elif symbol in fresh_rows:
+        add_result(symbol, fresh_rows[symbol])
+eligible = set(negative_cache.eligible([f"{symbol}.NS" for symbol in stock_symbols
+                                        if symbol not in fresh_rows and symbol not in results_by_symbol]))
 
 # Parallel processing of stock symbols
 with ThreadPoolExecutor(max_workers=10) as executor:  # Reduced to 10 to avoid rate limits
     future_to_symbol = {}
     for symbol in stock_symbols:
+        if f"{symbol}.NS" not in eligible:
+            continue
         future = executor.submit(get_stock_data, f"{symbol}.NS")
         future_to_symbol[future] = symbol
-        time.sleep(0.05)  # Increased delay to avoid rate limits
-        # print(f"Fetching data for {symbol}...")
     for future in as_completed(future_to_symbol):
         try:
             data, symbol = future.result()
             if data:
-                batch_data.append(data)
+                add_result(future_to_symbol[future], data)
             else:
-                print(f"No valid data returned for {symbol}")
+                logger.debug(f"No valid data returned for {symbol}")
         except Exception as e:
             logger.error(f"Error processing result for {future_to_symbol[future]}: {e}")
 
-# Update Calculation sheet
-if batch_data:
+# Offline, symbols without a stored price history keep their last stored row
+if OFFLINE:
+    stored = store.results()
+    for symbol in stock_symbols:
+        if symbol not in results_by_symbol and symbol in stored:
+            results_by_symbol[symbol] = stored[symbol]
+
+# Offline runs leave the negative cache alone: a missing stored history says
+# nothing about the symbol
+if not OFFLINE:
     try:
-        calc_sheet.update(values=batch_data, range_name=f'B{start_row}:P{start_row + len(batch_data) - 1}')
-        logger.info(f"Updated Calculation sheet with {len(batch_data)} rows")
-        
-        time.sleep(3)  # Wait for the update to complete
-        
+        negative_cache.save(len(eligible))
     except Exception as e:
-        logger.error(f"Error updating Calculation sheet: {e}")
+        logger.error(f"Error saving negative cache: {e}")
+    negative_cache.log_report()
+
+# Screens over the downloaded histories; the updated weekly/monthly bars are saved for the next run
+def screen_histories():
+    results = run_screens(rules_path, price_cache.histories(), timeframe_cache)
+    timeframe_cache.save()
+    return results
+
+# Evening run: store the rows and stop before any sheet writes or emails
+if PRECOMPUTE:
+    for symbol, row in results_by_symbol.items():
+        row_date = data_date(symbol) or journal.data_dates.get(symbol)
+        if row_date is None:
+            logger.warning(f"No price history for {symbol} in this run, leaving it out of the snapshot")
+            continue
+        snapshot.add(symbol, row, row_date)
+    if os.path.exists(rules_path):
+        try:
+            snapshot.screens = screen_histories()
+        except Exception as e:
+            logger.error(f"Error evaluating screen rules from {rules_path}: {e}")
+    try:
+        snapshot.save()
+    except Exception as e:
+        logger.error(f"Error saving snapshot: {e}")
+        exit(1)
+    if not OFFLINE:
+        try:
+            sessions.record(session_mode, latest_bar)
+        except OSError as e:
+            logger.error(f"Error recording the processed session: {e}")
+    close_run()
+    exit(0)
+
+# Final consistency pass over today's stored rows: symbols that never
+# completed are blanked and rows past the end of the list cleared
+def finish_calc(rows_by_symbol):
+    if calc_writer:
+        calc_writer.finish(rows_by_symbol)
+    else:
+        calc_rows = order_rows(rows_by_symbol, stock_symbols, len(headers))
+        write_rows_diff(calc_sheet, calc_rows, start_row, 2, cache_path=calc_cache)
+    logger.info(f"Updated Calculation sheet with {len(rows_by_symbol)} rows")
+    journal.mark('calculation')
+    time.sleep(3)  # Wait for the update to complete
+
+def close_calc_writer():
+    if calc_writer:
+        calc_writer.close()
+
+if journal.done('calculation'):
+    logger.info("Calculation sheet was written by an earlier attempt today")
+elif results_by_symbol:
+    sink.submit('Calculation final pass', finish_calc, store.results(run_date))
 else:
+    sink.submit('Calculation writer close', close_calc_writer)
     logger.warning("No data to update in Calculation sheet")
 
+# Screens come from the snapshot when it supplied the rows
+if os.path.exists(rules_path):
+    try:
+        if fresh_rows and snapshot.screens:
+            snapshot.log_screens()
+        else:
+            screen_histories()
+    except Exception as e:
+        logger.error(f"Error evaluating screen rules from {rules_path}: {e}")
+
+# Keep a typed copy of today's results for later queries
+try:
+    append_results('orb_setup', headers, [results_by_symbol[s] for s in stock_symbols if s in results_by_symbol])
+except Exception as e:
+    logger.error(f"Error storing results history: {e}")
+
+# Swing_stock and swing today high break are computed by the sheet from
+# Calculation, so wait for the sink before reading them; offline runs use the
+# copies stored by the last online run
+def read_tab(title):
+    if OFFLINE:
+        return store.tab(title)
+    rows = workbook.worksheet(title).get_all_values()
+    store.put_tab(title, rows)
+    return rows
+
+# A sink still behind after SHEET_SINK_TIMEOUT means the derived tabs may not
+# reflect today's rows: no emails go out and the journal records no delivery,
+# so the next attempt today sends them. The rows are already in the local
+# store, so the run ends cleanly and the workflow's next script still runs
+if not sink.drain():
+    logger.error(f"Sheet sync did not catch up within {SHEET_SINK_TIMEOUT:g}s, skipping the emails; "
+                 f"rerun today to send them")
+    close_run()
+    exit(0)
+
 # Fetch data for email just before preparation
 try:
-    swing_stock_sheet = workbook.worksheet('Swing_stock')
-    swing_high_break_sheet = workbook.worksheet('swing today high break')
-    credential_sheet = workbook.worksheet('credential')
-    swing_stock_data = swing_stock_sheet.get_all_values()
-    swing_high_break_data = swing_high_break_sheet.get_all_values()
-    email_column = credential_sheet.col_values(4)
-    recipients = [email for email in email_column[2:] if email]
+    swing_stock_data = read_tab('Swing_stock')
+    swing_high_break_data = read_tab('swing today high break')
+    recipients = [email for email in stage_results['inputs']['recipients'] if email]
     swing_stock_names = [row[1] for row in swing_stock_data[3:] if row[1]]
     logger.info(f"Retrieved {len(swing_stock_names)} stock names from Swing_stock: {swing_stock_names[:5]}...")
     logger.info(f"Retrieved {len(recipients)} recipient emails from credential sheet")
@@ -217,29 +545,11 @@ except Exception as e:
     logger.error(f"Error fetching sheet data for email: {e}")
     exit(1)
 
-# Display fetched sheet data before email preparation in a professional format
-print("\n" + "-"*60)
-print("Sheet Data Summary (Before Email Preparation)".center(60))
-print("-"*60)
-if swing_stock_data:
-    print("Swing Stock Data:")
-    for i, row in enumerate(swing_stock_data, 1):
-        print(f"Row {i:2d}: {' | '.join(str(val).ljust(15) for val in row)}")
-else:
-    print("No data in Swing_stock sheet")
-if swing_high_break_data:
-    print("\nSwing Today High Break Data:")
-    for i, row in enumerate(swing_high_break_data, 1):
-        print(f"Row {i:2d}: {' | '.join(str(val).ljust(15) for val in row)}")
-else:
-    print("\nNo data in swing today high break sheet")
-if swing_stock_names:
-    print("\nSwing Stock Names (Column B):")
-    for i, name in enumerate(swing_stock_names, 1):
-        print(f"Item {i:2d}: {name.ljust(15)}")
-else:
-    print("\nNo stock names found in Swing_stock column B")
-print("-"*60 + "\n")
+# Summarise the fetched sheet data before email preparation; full dumps only
+# at LOG_LEVEL=DEBUG
+log_rows(logger, "Swing Stock Data", swing_stock_data)
+log_rows(logger, "Swing Today High Break Data", swing_high_break_data)
+log_rows(logger, "Swing Stock Names (Column B)", [[name] for name in swing_stock_names])
 
 # Build HTML table/grid for Swing_stock and swing today high break
 swing_stock_headers = ''.join(f'<th style="padding: 12px; text-align: left; font-weight: 600; background-color: #e9ecef; border: 1px solid #dee2e6; color: #343a40;">{col}</th>' for col in swing_stock_data[0])
@@ -311,17 +621,17 @@ def send_email(recipient_email, html_body):
             msg['From'] = sender
             msg['To'] = recipient_email
             s.sendmail(sender, [recipient_email], msg.as_string())
-            logger.info(f"Email sent to {recipient_email}")
+            logger.debug(f"Email sent to {recipient_email}")
+            journal.record_email(recipient_email)
             return True
     except Exception as e:
-        logger.error(f"Error sending to {recipient_email}: {e}")
+        logger.error(f"Error sending a report email: {e}")
+        logger.debug(f"Failed recipient: {recipient_email}")
         return False
 
 # Prepare and send emails
-messages_to_send = []
-for recipient_email in recipients:
-    recipient_name = recipient_email.split('@')[0].replace('.', ' ').replace('_', ' ').title()
-    html_body = html_body_template.format(
+def render_html(recipient_name):
+    return html_body_template.format(
         recipient_name=recipient_name,
         generated_time=generated_time,
         swing_stock_headers=swing_stock_headers,
@@ -331,29 +641,72 @@ for recipient_email in recipients:
         swing_stock_names_html=swing_stock_names_html,
         export_url=export_url
     )
-    messages_to_send.append((recipient_email, html_body))
 
-# Send emails concurrently
 logger.info("Sending emails with Swing_stock and swing today high break data...")
 emails_sent = 0
-with ThreadPoolExecutor(max_workers=5) as executor:  # Reduced to 5 to avoid Gmail throttling
-    results = executor.map(lambda args: send_email(*args), messages_to_send)
-    emails_sent = sum(1 for success in results if success)
+# Recipients emailed by an earlier attempt today are not sent the report again
+pending = journal.pending(recipients)
+if recipients and not pending:
+    logger.info("Every recipient was already emailed today")
+elif OFFLINE:
+    # Nothing is sent; the report is written out for inspection instead
+    offline_path = state_path('orb_setup', 'offline_email.html')
+    with open(offline_path, 'w') as f:
+        f.write(render_html(BROADCAST_GREETING_NAME))
+    logger.info(f"Offline: {len(recipients)} emails not sent, report written to {offline_path}")
+elif BROADCAST_ENABLED:
+    # One BCC'd message per batch with a generic greeting
+    msg = MIMEText(render_html(BROADCAST_GREETING_NAME), 'html')
+    msg['Subject'] = 'Stock Data Report from Swing_stock and swing today high break'
+    msg['From'] = sender
+    emails_sent = send_broadcast(msg, pending, smtp_server, smtp_port, username, password, sender,
+                                 log_name='orb_setup_delivery', on_sent=journal.record_emails)
+elif MAIL_QUEUE_ENABLED:
+    # Persistent outbox sharded across the configured sender accounts
+    queued = []
+    for recipient_email in pending:
+        msg = MIMEText(render_html(recipient_name(recipient_email)), 'html')
+        msg['Subject'] = 'Stock Data Report from Swing_stock and swing today high break'
+        msg['From'] = sender
+        msg['To'] = recipient_email
+        queued.append((recipient_email, msg))
+    mail_queue = MailQueue()
+    mail_run = f"orb_setup-{datetime.now(ist).date()}"
+    emails_sent = mail_queue.deliver(mail_run, queued)
+    journal.record_emails(mail_queue.sent_recipients(mail_run))
+else:
+    messages_to_send = []
+    for recipient_email in pending:
+        messages_to_send.append((recipient_email, render_html(recipient_name(recipient_email))))
+
+    # Send emails concurrently
+    with ThreadPoolExecutor(max_workers=5) as executor:  # Reduced to 5 to avoid Gmail throttling
+        results = executor.map(lambda args: send_email(*args), messages_to_send)
+        emails_sent = sum(1 for success in results if success)
 
 # Print Swing_stock names
 logger.info(f"Swing_stock stock names: {', '.join(swing_stock_names)}")
-print(f"Swing_stock stock names: {', '.join(swing_stock_names)}")
 
 # Refresh Google Sheet
-response = requests.get(macro_url)
-print("Google Sheet refreshed successfully.")
+if macro.run("Post-email refresh"):
+    logger.info("Google Sheet refreshed successfully.")
 
 # Log completion
 elapsed_time = time.time() - start_time
 logger.info(f"Sent {emails_sent} emails successfully. Process completed in {elapsed_time:.2f} seconds.")
-print(f"Sent {emails_sent} emails successfully. Process completed in {elapsed_time:.2f} seconds.")
-
-print("Time lag: 60 seconds")
-time.sleep(60)  
-requests.get(macro_url)
+sink.close()
+# Every row written and every recipient emailed: a rerun before the next
+# session closes has nothing new to send
+if not OFFLINE and journal.done('calculation') and all(r in journal.emails for r in recipients):
+    try:
+        sessions.record(session_mode, latest_bar)
+    except OSError as e:
+        logger.error(f"Error recording the processed session: {e}")
+close_run()
+
+if not OFFLINE:
+    logger.info("Time lag: 60 seconds")
+    time.sleep(60)
+    macro.run("Final refresh")
+logger.info(f"Google Apps Script macro: {macro.calls} requests sent, {macro.coalesced} duplicate refreshes coalesced")
 
@@ -1,7 +1,6 @@
 from dotenv import load_dotenv
 import os
 import json
-import requests
 import time
 import smtplib
 from email.mime.text import MIMEText
@@ -11,21 +10,45 @@ from email import encoders
 import gspread
 from google.oauth2.service_account import Credentials
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import pytz
 import logging
 import yfinance as yf
 import pandas as pd
 import numpy as np
 from scipy.signal import argrelextrema
-import io
-import csv
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.results_history import append_results
+from shared.screen_rules import load_rules, run_screens
+from shared.sheet_writer import StreamingRowWriter, order_rows, write_rows_diff
+from shared.bhavcopy import use_bhavcopy
+from shared.http_transport import HttpTransport
+from shared.local_store import OFFLINE, SHEET_SINK_TIMEOUT, LocalStore, SheetSink
+from shared.log_setup import setup_logging
+from shared.lookback import LookbackPlan
+from shared.macro import MacroTrigger
+from shared.mail_queue import MAIL_QUEUE_ENABLED, MailQueue
+from shared.mailer import BROADCAST_ENABLED, BROADCAST_BATCH_SIZE, BROADCAST_GREETING_NAME, recipient_name, send_broadcast
+from shared.negative_cache import NegativeCache
+from shared.prefilter import SWING_PREFILTER, TWO_PHASE_FETCH, TwoPhaseFetch
+from shared.price_cache import PriceCache, stored_history
+from shared.run_journal import RunJournal
+from shared.sheet_inputs import SheetInputs
+from shared.sheets_client import authorize
+from shared.snapshot import PRECOMPUTE, Snapshot
+from shared.stages import StagePipeline, StageError
+from shared.state import REPO_ROOT, state_path
+from shared.timeframes import TimeframeCache
+from shared.trading_calendar import SessionLog, TradingCalendar, check_freshness, should_run
+from shared.xlsx_export import build_export
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Set up logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+log_runtime = setup_logging()
 logger = logging.getLogger(__name__)
 
 # Set IST timezone
@@ -35,61 +58,77 @@ ist = pytz.timezone('Asia/Kolkata')
 start_time = time.time()
 logger.info("Starting swing trading stock finder script with new strategy...")
 
-# Step 1: Execute Google Apps Script macro twice with a 4-second pause
+# Weekends and NSE holidays have no session to report on, and a session
+# already processed has no new bar to fetch; offline runs are never scheduled
+# and always go ahead. The evening run reports on today's bar, the morning run
+# on the last completed session
+calendar = TradingCalendar()
+today = datetime.now(ist).date()
+expected_session = today if PRECOMPUTE else calendar.previous_session(today)
+sessions = SessionLog('swing_str2')
+session_mode = 'precompute' if PRECOMPUTE else 'report'
+if not OFFLINE and (not should_run(calendar, 'Swing_Str2', today)
+                    or sessions.covers(session_mode, expected_session)):
+    log_runtime.log_report()
+    exit(0)
+
+# Step 1: Execute Google Apps Script macro twice with a 2-second pause
 macro_url = "https://script.google.com/macros/s/AKfycbykFjLRDhZ9tcu20L0F-7aTirVffIvo6tn811Pn6ONsa06cGV0JnpUsXiYJ_o_kDQ/exec"
-logger.info("Executing first Google Apps Script macro...")
-try:
-    response = requests.get(macro_url)
-    response.raise_for_status()
-    logger.info("First Google Apps Script macro executed successfully.")
-except Exception as e:
-    logger.error(f"Error executing first macro: {e}")
-
-logger.info("Pausing for 2 seconds...")
-time.sleep(2)
-
-logger.info("Executing second Google Apps Script macro...")
-try:
-    response = requests.get(macro_url)
-    response.raise_for_status()
-    logger.info("Second Google Apps Script macro executed successfully.")
-except Exception as e:
-    logger.error(f"Error executing second macro: {e}")
+# Pooled HTTP connections shared by the macro, Yahoo and Sheets requests
+transport = HttpTransport(pool_size=12)
+macro = MacroTrigger(macro_url, transport=transport, enabled=not OFFLINE)
+
+def refresh_macro():
+    logger.info("Executing first Google Apps Script macro...")
+    macro.run("First macro")
+    logger.info("Pausing for 2 seconds...")
+    time.sleep(2)
+    logger.info("Executing second Google Apps Script macro...")
+    macro.run("Second macro")
 
 # Step 2: Google Sheets authentication
-try:
+def authenticate():
     credentials_info = json.loads(os.environ.get('GOOGLE_CREDENTIALS_JSON'))
     creds = Credentials.from_service_account_info(credentials_info, scopes=[
         'https://www.googleapis.com/auth/spreadsheets',
         'https://www.googleapis.com/auth/drive'
     ])
-    client = gspread.authorize(creds)
+    client = authorize(creds, transport=transport)
     logger.info("Google Sheets authentication successful")
-except Exception as e:
-    logger.error(f"Error loading credentials: {e}")
-    exit(1)
+    return client
 
 # Open the Google Spreadsheet
 sheet_id = '1TETP6W6Ee5J7GCMHbSZMLykZlFJOy-qk5JFWN0DYgI4'
-try:
+
+def open_workbook(client):
     workbook = client.open_by_key(sheet_id)
     logger.info("Successfully opened Google Spreadsheet")
-except Exception as e:
-    logger.error(f"Error opening spreadsheet: {e}")
-    exit(1)
+    return workbook
+
+# The run's tables live in the local store; the sheet is mirrored in the background
+store = LocalStore('swing_str2')
+sink = SheetSink(enabled=not OFFLINE and not PRECOMPUTE)
+
+# Completed symbols, stages and emails of today's run, so a restarted run
+# resumes where the last attempt stopped
+run_date = datetime.now(ist).date()
+journal = RunJournal('swing_str2-precompute' if PRECOMPUTE else 'swing_str2-offline' if OFFLINE else 'swing_str2',
+                     run_date)
+
+# Symbols (Sheet1 column B from row 4) and recipients (credential column D from
+# row 3) change rarely, so they come from a revision-checked local copy
+def read_inputs(client):
+    values = SheetInputs(client, sheet_id, {'symbols': 'Sheet1!B4:B', 'recipients': 'credential!D3:D'}).load()
+    store.put_inputs(values)
+    return values
 
 # Get stock symbols from Sheet1 (Column B, starting from row 4)
-try:
-    sheet1 = workbook.worksheet('Sheet1')
-    stock_symbols = [s for s in sheet1.col_values(2)[3:] if s.strip()]
+def read_symbols(inputs):
+    stock_symbols = [s for s in inputs['symbols'] if s.strip()]
     logger.info(f"Retrieved {len(stock_symbols)} stock symbols from Sheet1: {stock_symbols[:5]}...")
-except Exception as e:
-    logger.error(f"Error reading stock symbols from Sheet1: {e}")
-    exit(1)
-
-if not stock_symbols:
-    logger.error("No stock symbols found in Sheet1, Column B, starting from row 4")
-    exit(1)
+    if not stock_symbols:
+        raise ValueError("No stock symbols found in Sheet1, Column B, starting from row 4")
+    return stock_symbols
 
 # Headers for Calculation sheet (updated to start at B2)
 headers = [
@@ -99,17 +138,57 @@ headers = [
 ]
 
 # Create or open Calculation sheet and set headers
+def open_calc_sheet(workbook):
+    try:
+        calc_sheet = workbook.worksheet('Calculation')
+        logger.info("Opened Calculation sheet")
+    except gspread.WorksheetNotFound:
+        calc_sheet = workbook.add_worksheet(title='Calculation', rows=100, cols=12)  # Adjusted to 12 columns
+        logger.info("Created Calculation sheet")
+
+    # Keep row 1 empty and headers in B2:L2; only rewritten when they differ,
+    # and the data rows below are never touched
+    write_rows_diff(calc_sheet, [[""] * 11, headers], 1, 2, cache_path=state_path('swing_str2', 'calculation_headers.json'),
+                    clear_stale=False)
+    logger.info("Set headers in Calculation sheet at B2:L2")
+    return calc_sheet
+
+# Bars detect_upside_break needs to find two pivot highs: `order` bars either
+# side of each and more than `order` bars between them. Pivots are only looked
+# for inside the planned window.
+def upside_break_bars(lookback=24):
+    order = lookback // 2
+    return 3 * order + 2
+
+# Extra declarative screens, evaluated over the already-downloaded history;
+# their weekly/monthly bars persist between runs in the timeframe cache
+rules_path = os.environ.get('SCREEN_RULES', os.path.join(REPO_ROOT, 'screen_rules.json'))
+timeframe_cache = TimeframeCache('swing_str2')
+
+# Bars each Calculation column and screen needs; the daily history covers the longest
+calc_lookbacks = {
+    'Regression(200)': 'regression(close, 200)',
+    'ADX(14)': 'adx(14)',
+    'RSI(14)': 'rsi(14)',
+    'SMA(Volume, 20)': 'sma(volume, 20)',
+    'ATR(14)': 'atr(14)',
+    'Upside break': upside_break_bars(),
+}
 try:
-    calc_sheet = workbook.worksheet('Calculation')
-    logger.info("Opened Calculation sheet")
-except gspread.WorksheetNotFound:
-    calc_sheet = workbook.add_worksheet(title='Calculation', rows=100, cols=12)  # Adjusted to 12 columns
-    logger.info("Created Calculation sheet")
-
-# Clear and set headers in B2:L2 every time
-calc_sheet.update(values=[[""] * 11], range_name='B1:P2000')  # Empty row 1
-calc_sheet.update(values=[headers], range_name='B2:L2')    # Headers from B2
-logger.info("Set headers in Calculation sheet at B2:L2")
+    lookback = LookbackPlan(calc_lookbacks, rules=load_rules(rules_path) if os.path.exists(rules_path) else None)
+except (OSError, ValueError) as e:
+    logger.error(f"Error reading screen rules from {rules_path}, planning the Calculation columns only: {e}")
+    lookback = LookbackPlan(calc_lookbacks)
+lookback.log_report(run_date)
+
+# Daily history is downloaded once per symbol and shared with get_stock_data
+price_cache = PriceCache(start=lookback.start(run_date), session=transport.yahoo_session())
+two_phase = (TwoPhaseFetch(SWING_PREFILTER, session=price_cache.session, full_bars=lookback.bars)
+             if TWO_PHASE_FETCH and not OFFLINE else None)
+if OFFLINE:
+    price_cache.provider = stored_history
+negative_cache = NegativeCache('swing_str2', today=datetime.now(ist).date())
+snapshot = Snapshot('swing_str2', headers)
 
 # Manual RSI calculation
 def calculate_rsi(close, period=14):
@@ -178,13 +257,31 @@ def detect_upside_break(high, low, close, lookback=24, slope_factor=1.0):
     very_close = not recent_break and close.iloc[-1] < trend_value and (trend_value - close.iloc[-1]) < 0.5 * atr
     return recent_break, very_close
 
+# Row for a symbol that failed the volume/RSI prefilter on its short history;
+# the regression, trendline break and ADX cells are left blank
+def prefiltered_row(symbol, hist):
+    latest_close = float(hist['Close'].iloc[-1])
+    rsi_14 = calculate_rsi(hist['Close'])
+    latest_volume = int(hist['Volume'].iloc[-1])
+    sma_vol_20 = float(hist['Volume'].rolling(window=20).mean().iloc[-1])
+    vol_gt_1_5_sma = "Yes" if latest_volume > 1.5 * sma_vol_20 else "No"
+    return [symbol[:-3], f"NSE:{symbol[:-3]}", latest_close, "", "",
+            "", "", "", rsi_14, vol_gt_1_5_sma, "No"]
+
 # Function to fetch and calculate stock data
 def get_stock_data(symbol):
     try:
-        stock = yf.Ticker(symbol)
-        hist = stock.history(period="1y", interval="1d", auto_adjust=False, prepost=False)
+        if two_phase and symbol in two_phase.rejected:
+            return prefiltered_row(symbol, two_phase.short[symbol]), symbol
+        # Histories fetched deeper to seed the timeframe cache are cut to the
+        # planned window so every row is computed over the same span
+        hist = price_cache.history(symbol).iloc[-lookback.bars:]
         
-        if hist.empty or len(hist) < 200:
+        if hist.empty:
+            negative_cache.record_error(symbol, 'no data', 'empty history, possibly delisted or renamed')
+            return None, symbol
+        if len(hist) < 200:
+            negative_cache.record_short_history(symbol, len(hist))
             return None, symbol
         
         latest_close = float(hist['Close'].iloc[-1])
@@ -197,6 +294,7 @@ def get_stock_data(symbol):
         
         if pd.isna(regression_200) or pd.isna(sma_vol_20):
             logger.warning(f"Missing data for {symbol}")
+            negative_cache.record_error(symbol, 'missing data', 'indicator inputs are NaN')
             return None, symbol
 
         close_gt_regression = "Yes" if latest_close > regression_200 else "No"
@@ -211,75 +309,312 @@ def get_stock_data(symbol):
             vol_gt_1_5_sma == "Yes"
         ]) else "No"
 
+        negative_cache.clear(symbol)
         return [symbol[:-3], f"NSE:{symbol[:-3]}", latest_close, regression_200, close_gt_regression,
                 upside_break, close_to_break, adx_14, rsi_14, vol_gt_1_5_sma, all_conditions_met], symbol
     except Exception as e:
         logger.error(f"Error fetching data for {symbol}: {e}")
+        negative_cache.record_error(symbol, 'error', e)
         return None, symbol
 
-# Test with INTERARCH.NS
-logger.info("Testing data fetch with INTERARCH.NS...")
-test_data, _ = get_stock_data("INTERARCH.NS")
-if test_data:
-    logger.info(f"Test fetch successful: {test_data}")
+# Connectivity probe with INTERARCH.NS, kept out of the price cache so the probe symbol never
+# joins the screened histories or the negative cache
+def test_fetch():
+    logger.info("Testing data fetch with INTERARCH.NS...")
+    try:
+        hist = yf.Ticker("INTERARCH.NS", session=transport.yahoo_session()).history(period="5d", interval="1d")
+    except Exception as e:
+        logger.error(f"Test fetch failed for INTERARCH.NS: {e}")
+        return
+    if hist.empty:
+        logger.error("Test fetch failed for INTERARCH.NS. Check yfinance connectivity or API status.")
+    else:
+        logger.info(f"Test fetch successful: INTERARCH.NS closed at {float(hist['Close'].iloc[-1]):.2f} "
+                    f"on {hist.index[-1].date()}")
+
+# Rows precomputed last evening that are still current; only the others are fetched
+def load_snapshot():
+    return snapshot.load(datetime.now(ist).date(), session=transport.yahoo_session())
+
+def prefetch_prices(stock_symbols, fresh_rows=None):
+    stale = [symbol for symbol in stock_symbols if symbol not in (fresh_rows or {}) and symbol not in journal.results]
+    symbols = negative_cache.eligible([f"{symbol}.NS" for symbol in stale])
+    bhavcopy = None if OFFLINE else use_bhavcopy(price_cache, symbols)
+    if two_phase:
+        symbols = two_phase.run(symbols)
+        two_phase.log_report()
+    # Symbols whose weekly/monthly bars are too short are fetched from further back once
+    seeding = {} if OFFLINE else lookback.seed_starts(symbols, timeframe_cache, run_date)
+    price_cache.starts.update(seeding)
+    price_cache.prefetch(symbols, max_workers=12, pacing=0)
+    if bhavcopy:
+        logger.info(f"Bhavcopy: {bhavcopy.appended} histories extended, {bhavcopy.fallbacks} fetched from Yahoo")
+    # The evening run reports on today's bar, the morning run on the last session
+    histories = price_cache.histories()
+    timeframe_cache.mark_seeded([s for s, start in seeding.items()
+                                 if s in histories and price_cache.fetched_from.get(s) == start],
+                                lookback.timeframe_needs)
+    if two_phase:
+        histories.update((s, two_phase.short[s]) for s in two_phase.rejected)
+    # Latest bar behind any row of this run, recorded once the run completes;
+    # a partial bar of a forced run during market hours does not count
+    global latest_bar
+    latest_bar = max([h.index[-1].date() for h in histories.values()]
+                     + [date.fromisoformat(d) for d in snapshot.dates.values()]
+                     + list(journal.data_dates.values()), default=None)
+    if latest_bar:
+        latest_bar = min(latest_bar, expected_session)
+    stale = check_freshness(histories, expected_session)
+    return bool(histories) and len(stale) == len(histories)  # No new bar anywhere
+
+# Startup runs as a dependency graph so the macro refresh, Sheets auth,
+# symbol read and price downloads overlap instead of running back to back
+pipeline = StagePipeline(max_workers=6)
+if OFFLINE:
+    # Inputs from the store and prices from .state/prices/; nothing else to start
+    pipeline.add('inputs', store.inputs)
+    pipeline.add('symbols', read_symbols, deps=['inputs'])
+    pipeline.add('price_prefetch', prefetch_prices, deps=['symbols'])
+elif PRECOMPUTE:
+    pipeline.add('auth', authenticate)
+    pipeline.add('inputs', read_inputs, deps=['auth'])
+    pipeline.add('symbols', read_symbols, deps=['inputs'])
+    # Evening run: only the downloads and indicator math, for the morning snapshot
+    pipeline.add('price_prefetch', prefetch_prices, deps=['symbols'])
 else:
-    logger.error("Test fetch failed for INTERARCH.NS. Check yfinance connectivity or API status.")
-
-# Batch update data for Calculation sheet
-batch_data = []
+    pipeline.add('auth', authenticate)
+    pipeline.add('inputs', read_inputs, deps=['auth'])
+    pipeline.add('symbols', read_symbols, deps=['inputs'])
+    if not journal.done('macro_refresh'):
+        pipeline.add('macro_refresh', refresh_macro)
+    pipeline.add('workbook', open_workbook, deps=['auth'])
+    pipeline.add('calc_sheet', open_calc_sheet, deps=['workbook'])
+    if not journal.done('test_fetch'):
+        pipeline.add('test_fetch', test_fetch)
+    pipeline.add('snapshot', load_snapshot)
+    pipeline.add('price_prefetch', prefetch_prices, deps=['symbols', 'snapshot'])
+try:
+    stage_results = pipeline.run()
+except StageError as e:
+    logger.error(f"Error during startup: {e}")
+    exit(1)
+for name in ('macro_refresh', 'test_fetch'):
+    if name in stage_results:
+        journal.mark(name)
+client = stage_results.get('auth')
+workbook = stage_results.get('workbook')
+stock_symbols = stage_results['symbols']
+calc_sheet = stage_results.get('calc_sheet')
+fresh_rows = stage_results.get('snapshot', {})
+
+# Closes the sink and journal and logs the run's reports; every exit after
+# startup goes through here
+def close_run():
+    sink.close()
+    journal.close()
+    pipeline.log_report()
+    sink.log_report()
+    store.log_report()
+    if client:
+        client.quota.log_report()
+    transport.log_report()
+    log_runtime.log_report()
+
+# Evening run before the day's bars are published: every row would carry the
+# previous session's date, which the morning run recomputes anyway
+if PRECOMPUTE and stage_results['price_prefetch']:
+    logger.info(f"No history has a bar for {run_date} yet, nothing to precompute")
+    close_run()
+    exit(0)
+
+# Calculation rows go to the local store as symbols complete. The sink streams
+# them to their fixed positions in the sheet (Sheet1 symbol order) in chunks,
+# so downstream tabs fill in while the slowest downloads are still running;
+# only cells that changed are sent
+results_by_symbol = {}
 start_row = 4
+calc_cache = state_path('swing_str2', 'calculation_rows.json')
+calc_writer = None
+
+def open_calc_writer():
+    global calc_writer
+    try:
+        calc_writer = StreamingRowWriter(calc_sheet, stock_symbols, len(headers), start_row, 2, cache_path=calc_cache)
+    except Exception as e:
+        logger.error(f"Error preparing streaming Calculation writes, writing once at the end: {e}")
+
+def stream_row(symbol, row):
+    if calc_writer:
+        calc_writer.add(symbol, row)
+
+# Date of the last bar behind a row: the short history for symbols the
+# two-phase fetch settled on, else the finished download; None for rows that
+# were never fetched this run (journal replays, snapshot and offline rows)
+def data_date(symbol):
+    ticker = f"{symbol}.NS"
+    if two_phase and ticker in two_phase.rejected:
+        return two_phase.short[ticker].index[-1].date()
+    return price_cache.latest_date(ticker)
+
+def add_result(symbol, row):
+    results_by_symbol[symbol] = row
+    store.put_result(symbol, row, run_date)
+    journal.record_result(symbol, row, data_date(symbol))
+    sink.submit('Calculation rows', stream_row, symbol, row)
+
+if not journal.done('calculation'):
+    sink.submit('Calculation writer', open_calc_writer)
+
+# Rows journaled by an earlier attempt and snapshot rows go out first; symbols
+# in the negative cache keep a blank row until their retry date
+for symbol in stock_symbols:
+    if symbol in journal.results:
+        add_result(symbol, journal.results[symbol])
+    elif symbol in fresh_rows:
+        add_result(symbol, fresh_rows[symbol])
+eligible = set(negative_cache.eligible([f"{symbol}.NS" for symbol in stock_symbols
+                                        if symbol not in fresh_rows and symbol not in results_by_symbol]))
 
 with ThreadPoolExecutor(max_workers=12) as executor:
     future_to_symbol = {}
     for symbol in stock_symbols:
+        if f"{symbol}.NS" not in eligible:
+            continue
         future = executor.submit(get_stock_data, f"{symbol}.NS")
         future_to_symbol[future] = symbol
     for future in as_completed(future_to_symbol):
         try:
             data, symbol = future.result()
             if data:
-                batch_data.append(data)
+                add_result(future_to_symbol[future], data)
             else:
-                print(f"No valid data returned for {symbol}")
+                logger.debug(f"No valid data returned for {symbol}")
         except Exception as e:
-            print(f"Error processing result for {future_to_symbol[future]}: {e}")
+            logger.error(f"Error processing result for {future_to_symbol[future]}: {e}")
+
+# Offline, symbols without a stored price history keep their last stored row
+if OFFLINE:
+    stored = store.results()
+    for symbol in stock_symbols:
+        if symbol not in results_by_symbol and symbol in stored:
+            results_by_symbol[symbol] = stored[symbol]
 
-if batch_data:
+# Offline runs leave the negative cache alone: a missing stored history says
+# nothing about the symbol
+if not OFFLINE:
+    try:
+        negative_cache.save(len(eligible))
+    except Exception as e:
+        logger.error(f"Error saving negative cache: {e}")
+    negative_cache.log_report()
+
+# Screens over the downloaded histories; the updated weekly/monthly bars are saved for the next run
+def screen_histories():
+    results = run_screens(rules_path, price_cache.histories(), timeframe_cache)
+    timeframe_cache.save()
+    return results
+
+# Evening run: store the rows and stop before any sheet writes or emails
+if PRECOMPUTE:
+    for symbol, row in results_by_symbol.items():
+        row_date = data_date(symbol) or journal.data_dates.get(symbol)
+        if row_date is None:
+            logger.warning(f"No price history for {symbol} in this run, leaving it out of the snapshot")
+            continue
+        snapshot.add(symbol, row, row_date)
+    if os.path.exists(rules_path):
+        try:
+            snapshot.screens = screen_histories()
+        except Exception as e:
+            logger.error(f"Error evaluating screen rules from {rules_path}: {e}")
     try:
-        calc_sheet.update(values=batch_data, range_name=f'B{start_row}:L{start_row + len(batch_data) - 1}')
-        logger.info(f"Updated Calculation sheet with {len(batch_data)} rows")
-        time.sleep(3)
+        snapshot.save()
     except Exception as e:
-        logger.error(f"Error updating Calculation sheet: {e}")
+        logger.error(f"Error saving snapshot: {e}")
+        exit(1)
+    if not OFFLINE:
+        try:
+            sessions.record(session_mode, latest_bar)
+        except OSError as e:
+            logger.error(f"Error recording the processed session: {e}")
+    close_run()
+    exit(0)
+
+# Final consistency pass over today's stored rows: symbols that never
+# completed are blanked and rows past the end of the list cleared
+def finish_calc(rows_by_symbol):
+    if calc_writer:
+        calc_writer.finish(rows_by_symbol)
+    else:
+        calc_rows = order_rows(rows_by_symbol, stock_symbols, len(headers))
+        write_rows_diff(calc_sheet, calc_rows, start_row, 2, cache_path=calc_cache)
+    logger.info(f"Updated Calculation sheet with {len(rows_by_symbol)} rows")
+    journal.mark('calculation')
+    time.sleep(3)  # Wait for the update to complete
+
+def close_calc_writer():
+    if calc_writer:
+        calc_writer.close()
+
+if journal.done('calculation'):
+    logger.info("Calculation sheet was written by an earlier attempt today")
+elif results_by_symbol:
+    sink.submit('Calculation final pass', finish_calc, store.results(run_date))
 else:
+    sink.submit('Calculation writer close', close_calc_writer)
     logger.warning("No data to update in Calculation sheet")
 
+# Screens come from the snapshot when it supplied the rows
+if os.path.exists(rules_path):
+    try:
+        if fresh_rows and snapshot.screens:
+            snapshot.log_screens()
+        else:
+            screen_histories()
+    except Exception as e:
+        logger.error(f"Error evaluating screen rules from {rules_path}: {e}")
 
-requests.get(macro_url)
+# Keep a typed copy of today's results for later queries
+try:
+    append_results('swing_str2', headers, [results_by_symbol[s] for s in stock_symbols if s in results_by_symbol])
+except Exception as e:
+    logger.error(f"Error storing results history: {e}")
+
+# The refresh and swing_stock read below depend on the Calculation rows
+# reaching the sheet. A sink still behind after SHEET_SINK_TIMEOUT means the
+# derived tabs may not reflect today's rows: no emails go out and the journal
+# records no delivery, so the next attempt today sends them. The rows are
+# already in the local store, so the run ends cleanly
+if not sink.drain():
+    logger.error(f"Sheet sync did not catch up within {SHEET_SINK_TIMEOUT:g}s, skipping the emails; "
+                 f"rerun today to send them")
+    close_run()
+    exit(0)
+
+macro.run("Post-update refresh")
 # Wait until 9:25 IST to refresh Google Sheet
 current_time_ist = datetime.now(ist)
 target_time_ist_1 = current_time_ist.replace(hour=9, minute=25, second=0, microsecond=0)
-if current_time_ist < target_time_ist_1:
+if current_time_ist < target_time_ist_1 and not OFFLINE:
     wait_seconds = (target_time_ist_1 - current_time_ist).total_seconds()
-    print(f"Waiting {wait_seconds:.0f} seconds until 9:25 AM IST to refresh Google Sheet...")
-    for i in range(int(wait_seconds), 0, -1):
-        print(f"Waiting... {i} seconds remaining", end='\r')
-        time.sleep(1)
+    logger.info(f"Waiting {wait_seconds:.0f} seconds until 9:25 AM IST to refresh Google Sheet...")
+    time.sleep(wait_seconds)
+
+# swing_stock is computed by the sheet; offline runs use the copy stored by
+# the last online run
+def read_tab(title):
+    if OFFLINE:
+        return store.tab(title)
+    rows = workbook.worksheet(title).get_all_values()
+    store.put_tab(title, rows)
+    return rows
 
 # Fetch data from swing_stock just before sending email
 try:
-    swing_stock_sheet = workbook.worksheet('swing_stock')
-    swing_stock_data = swing_stock_sheet.get_all_values()
-    credential_sheet = workbook.worksheet('credential')
-    
-    # Get all values from column D (index 3)
-    email_column = credential_sheet.col_values(4)  # Fourth column (index 3)
-    
-    # Filter out empty strings and get emails starting from row 3 (index 2)
-    recipients = []
-    for i, email in enumerate(email_column):
-        if i >= 2 and email and email.strip():  # Start from row 3 (index 2)
-            recipients.append(email.strip())
+    swing_stock_data = read_tab('swing_stock')
+
+    # Column D of the credential sheet from row 3, filtered for empty strings
+    recipients = [email.strip() for email in stage_results['inputs']['recipients'] if email and email.strip()]
     
     if not recipients:
         logger.warning("No valid recipient emails found in credential sheet after filtering")
@@ -290,64 +625,54 @@ try:
             met_stocks.append(row[2])  # Using column B (index 1) for stock names
     
     logger.info(f"Retrieved {len(met_stocks)} stocks meeting all conditions from swing_stock: {met_stocks[:5]}...")
-    logger.info(f"Retrieved {len(recipients)} recipient emails from credential sheet: {recipients}")
+    logger.info(f"Retrieved {len(recipients)} recipient emails from credential sheet")
+    logger.debug(f"Recipients: {recipients}")
     
 except gspread.exceptions.WorksheetNotFound:
     logger.error("Credential sheet not found")
     exit(1)
 except Exception as e:
     logger.error(f"Error fetching sheet data for email: {e}")
-    logger.error(f"Email column content: {email_column}")
     exit(1)
 
-# Manage a dedicated spreadsheet for swing_stock exports
-export_spreadsheet_id = os.environ.get('SWING_STOCK_EXPORT_SHEET_ID')
-export_spreadsheet = None
-
-try:
+# Publish swing_stock through the dedicated Swing_Stock_Export spreadsheet
+# (shared with anyone holding the link) and return its XLSX export URL.
+# Only used when the local export is too large to attach.
+def publish_export_link(rows):
+    export_spreadsheet_id = os.environ.get('SWING_STOCK_EXPORT_SHEET_ID')
     if export_spreadsheet_id:
-        # Try to open existing spreadsheet
         export_spreadsheet = client.open_by_key(export_spreadsheet_id)
         logger.info(f"Opened existing swing_stock export spreadsheet: {export_spreadsheet.title}")
     else:
-        # Create new spreadsheet if ID not set
         export_spreadsheet = client.create("Swing_Stock_Export")
         os.environ['SWING_STOCK_EXPORT_SHEET_ID'] = export_spreadsheet.id
         logger.info(f"Created new swing_stock export spreadsheet: {export_spreadsheet.title}")
-        
+
     # Ensure only one sheet exists
     temp_sheet = export_spreadsheet.sheet1
     temp_sheet.update_title('swing_stock')
     for ws in export_spreadsheet.worksheets():
         if ws.title != 'swing_stock':
             export_spreadsheet.del_worksheet(ws)
-    
-    # Update with swing_stock data
-    temp_sheet.update(swing_stock_data)
-    logger.info("Updated swing_stock sheet with latest data")
-    
-    # Set sharing permissions to "Anyone with the link"
+    temp_sheet.update(rows)
     export_spreadsheet.share('', perm_type='anyone', role='reader')
-    
-    # Generate export URL
-    export_url = f"https://docs.google.com/spreadsheets/d/{export_spreadsheet.id}/export?format=xlsx"
-    logger.info(f"Export URL for swing_stock sheet: {export_url}")
-    
-    # Prepare CSV data as fallback
-    csv_buffer = io.StringIO()
-    writer = csv.writer(csv_buffer)
-    writer.writerows(swing_stock_data)
-    csv_data = csv_buffer.getvalue()
-    csv_buffer.close()
-    
+    return f"https://docs.google.com/spreadsheets/d/{export_spreadsheet.id}/export?format=xlsx"
+
+# Build the swing_stock export locally from the rows already fetched and attach
+# it; the Drive round trips are only made when it is too large to attach
+export_url = None
+try:
+    export_name, export_type, export_data = build_export(swing_stock_data, state_path('swing_str2', 'swing_stock'),
+                                                         sheet_name='swing_stock')
 except Exception as e:
-    logger.error(f"Error managing swing_stock export spreadsheet.. {e}")
-    logger.info("Falling back to CSV attachment")
-    export_url = None  # Disable export URL
-    csv_data = io.StringIO()
-    writer = csv.writer(csv_data)
-    writer.writerows(swing_stock_data)
-    csv_data = csv_data.getvalue()
+    logger.error(f"Error building swing_stock export: {e}")
+    export_name, export_type, export_data = None, None, None
+if export_data is None and not OFFLINE:
+    try:
+        export_url = publish_export_link(swing_stock_data)
+        logger.info(f"Export URL for swing_stock sheet: {export_url}")
+    except Exception as e:
+        logger.error(f"Error managing swing_stock export spreadsheet: {e}")
 
 # Create HTML content for swing_stock sheet
 swing_stock_headers = ''.join(f'<th style="padding: 12px; text-align: left; font-weight: 600; background-color: #2c3e50; color: #ffffff; border: 1px solid #34495e;">{col}</th>' for col in swing_stock_data[0])
@@ -407,26 +732,31 @@ username = os.environ.get('SMTP_USERNAME')
 password = os.environ.get('SMTP_PASSWORD')
 
 # Validate SMTP credentials
-if not username or not password:
+if not OFFLINE and (not username or not password):
     logger.error("SMTP credentials not found in environment variables")
     exit(1)
     
-sender = '"SwingScan STR_2" <' + username + '>'
+sender = f'"SwingScan STR_2" <{username}>'
 
-def send_email(recipient_email, html_body, csv_data=None):
-    try:
-        msg = MIMEMultipart()
-        msg['Subject'] = 'Swing Stock Alert Report'
-        msg['From'] = sender
+def build_message(recipient_email, html_body):
+    msg = MIMEMultipart()
+    msg['Subject'] = 'Swing Stock Alert Report'
+    msg['From'] = sender
+    if recipient_email:
         msg['To'] = recipient_email
-        msg.attach(MIMEText(html_body, 'html'))
-        
-        if csv_data:
-            part = MIMEBase('text', 'csv')
-            part.set_payload(csv_data)
-            encoders.encode_base64(part)
-            part.add_header('Content-Disposition', 'attachment; filename="swing_stock.csv"')
-            msg.attach(part)
+    msg.attach(MIMEText(html_body, 'html'))
+    
+    if export_data:
+        part = MIMEBase(*export_type)
+        part.set_payload(export_data)
+        encoders.encode_base64(part)
+        part.add_header('Content-Disposition', f'attachment; filename="{export_name}"')
+        msg.attach(part)
+    return msg
+
+def send_email(recipient_email, html_body):
+    try:
+        msg = build_message(recipient_email, html_body)
         
         with smtplib.SMTP(smtp_server, smtp_port) as s:
             s.ehlo()
@@ -434,18 +764,22 @@ def send_email(recipient_email, html_body, csv_data=None):
             s.ehlo()
             s.login(username, password)
             s.send_message(msg)
-            logger.info(f"Email sent to {recipient_email}")
+            logger.debug(f"Email sent to {recipient_email}")
+            journal.record_email(recipient_email)
             return True
     except Exception as e:
-        logger.error(f"Error sending to {recipient_email}: {e}")
+        logger.error(f"Error sending a report email: {e}")
+        logger.debug(f"Failed recipient: {recipient_email}")
         return False
 
-# Prepare personalized messages
-messages_to_send = []
-for recipient_email in recipients:
-    recipient_name = recipient_email.split('@')[0].replace('.', ' ').replace('_', ' ').title()
-    download_link = f'<p><a href="{export_url}" class="download-btn">Download swing_stock Sheet (Excel)</a></p>' if export_url else '<p>Swing stock data attached as CSV.</p>'
-    html_body = html_body_template.format(
+def render_html(recipient_name):
+    if export_url:
+        download_link = f'<p><a href="{export_url}" class="download-btn">Download swing_stock Sheet (Excel)</a></p>'
+    elif export_data:
+        download_link = f'<p>Swing stock data attached as {export_name}.</p>'
+    else:
+        download_link = ''
+    return html_body_template.format(
         recipient_name=recipient_name,
         generated_time=generated_time,
         swing_stock_headers=swing_stock_headers,
@@ -453,46 +787,78 @@ for recipient_email in recipients:
         met_stocks_html=met_stocks_html,
         download_link=download_link
     )
-    messages_to_send.append((recipient_email, html_body, csv_data if not export_url else None))
 
-# Send emails with swing_stock data using ThreadPoolExecutor
-logger.info(f"Attempting to send {len(messages_to_send)} emails...")
 emails_sent = 0
-
-with ThreadPoolExecutor(max_workers=6) as executor:
-    futures = []
-    for recipient_email, html_body, csv_attachment in messages_to_send:
-        future = executor.submit(send_email, recipient_email, html_body, csv_attachment)
-        futures.append(future)
-    
-    for future in as_completed(futures):
-        try:
-            if future.result():
-                emails_sent += 1
-        except Exception as e:
-            logger.error(f"Error in email sending future: {e}")
+# Recipients emailed by an earlier attempt today are not sent the report again
+pending = journal.pending(recipients)
+if recipients and not pending:
+    logger.info("Every recipient was already emailed today")
+elif OFFLINE:
+    # Nothing is sent; the report is written out for inspection instead
+    offline_path = state_path('swing_str2', 'offline_email.html')
+    with open(offline_path, 'w') as f:
+        f.write(render_html(BROADCAST_GREETING_NAME))
+    logger.info(f"Offline: {len(recipients)} emails not sent, report written to {offline_path}")
+elif BROADCAST_ENABLED:
+    # One BCC'd message per batch with a generic greeting
+    logger.info(f"Broadcasting report to {len(pending)} recipients in batches of {BROADCAST_BATCH_SIZE}...")
+    msg = build_message(None, render_html(BROADCAST_GREETING_NAME))
+    emails_sent = send_broadcast(msg, pending, smtp_server, smtp_port, username, password, sender,
+                                 log_name='swing_str2_delivery', on_sent=journal.record_emails)
+elif MAIL_QUEUE_ENABLED:
+    # Persistent outbox sharded across the configured sender accounts
+    queued = [(recipient_email, build_message(recipient_email, render_html(recipient_name(recipient_email))))
+              for recipient_email in pending]
+    mail_queue = MailQueue()
+    mail_run = f"swing_str2-{datetime.now(ist).date()}"
+    emails_sent = mail_queue.deliver(mail_run, queued)
+    journal.record_emails(mail_queue.sent_recipients(mail_run))
+else:
+    # Prepare personalized messages
+    messages_to_send = []
+    for recipient_email in pending:
+        html_body = render_html(recipient_name(recipient_email))
+        messages_to_send.append((recipient_email, html_body))
+
+    # Send emails with swing_stock data using ThreadPoolExecutor
+    logger.info(f"Attempting to send {len(messages_to_send)} emails...")
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        futures = []
+        for recipient_email, html_body in messages_to_send:
+            future = executor.submit(send_email, recipient_email, html_body)
+            futures.append(future)
+        
+        for future in as_completed(futures):
+            try:
+                if future.result():
+                    emails_sent += 1
+            except Exception as e:
+                logger.error(f"Error in email sending future: {e}")
 
 logger.info(f"Stocks meeting all conditions: {', '.join(met_stocks)}")
-print(f"Stocks meeting all conditions: {', '.join(met_stocks)}")
 
 # Refresh the Google Sheet
-try:
-    response = requests.get(macro_url)
-    response.raise_for_status()
-    print("Google Sheet refreshed successfully.")
-except Exception as e:
-    logger.error(f"Error refreshing Google Sheet: {e}")
+if macro.run("Post-email refresh"):
+    logger.info("Google Sheet refreshed successfully.")
 
 elapsed_time = time.time() - start_time
 logger.info(f"Sent {emails_sent} emails successfully. Process completed in {elapsed_time:.2f} seconds.")
-print(f"Sent {emails_sent} emails successfully. Process completed in {elapsed_time:.2f} seconds.")
-
-print("Time lag: 15 seconds")
-time.sleep(12)
-
-# Final refresh
-try:
-    requests.get(macro_url)
-    print("Final Google Sheet refresh completed.")
-except Exception as e:
-    logger.error(f"Error with final refresh: {e}")
\ No newline at end of file
+sink.close()
+# Every row written and every recipient emailed: a rerun before the next
+# session closes has nothing new to send
+if not OFFLINE and journal.done('calculation') and all(r in journal.emails for r in recipients):
+    try:
+        sessions.record(session_mode, latest_bar)
+    except OSError as e:
+        logger.error(f"Error recording the processed session: {e}")
+close_run()
+
+if not OFFLINE:
+    logger.info("Time lag: 15 seconds")
+    time.sleep(12)
+
+    # Final refresh
+    if macro.run("Final refresh"):
+        logger.info("Final Google Sheet refresh completed.")
+logger.info(f"Google Apps Script macro: {macro.calls} requests sent, {macro.coalesced} duplicate refreshes coalesced")
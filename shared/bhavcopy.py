@@ -0,0 +1,206 @@
+import io
+import os
+import re
+import csv
+import zipfile
+import logging
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import pandas as pd
+import pytz
+import requests
+
+from shared.state import state_path
+
+logger = logging.getLogger(__name__)
+
+ist = pytz.timezone('Asia/Kolkata')
+
+# Bulk end-of-day source: one NSE bhavcopy replaces the per-symbol Yahoo fan-out.
+# BHAVCOPY_DIR is searched for the newest file (or the one for BHAVCOPY_DATE);
+# BHAVCOPY_URL is a download template such as
+# https://nsearchives.nseindia.com/content/cm/BhavCopy_NSE_CM_0_0_0_{date:%Y%m%d}_F_0000.csv.zip
+BHAVCOPY_DIR = os.environ.get('BHAVCOPY_DIR')
+BHAVCOPY_URL = os.environ.get('BHAVCOPY_URL')
+BHAVCOPY_DATE = os.environ.get('BHAVCOPY_DATE')
+EQUITY_SERIES = {'EQ', 'BE', 'BZ'}
+
+Bar = namedtuple('Bar', ['date', 'open', 'high', 'low', 'close', 'volume', 'prev_close'])
+
+# Column names in the legacy bhavcopy and the UDiFF format NSE switched to in 2024
+COLUMNS = {
+    'legacy': {'symbol': 'SYMBOL', 'series': 'SERIES', 'open': 'OPEN', 'high': 'HIGH', 'low': 'LOW',
+               'close': 'CLOSE', 'volume': 'TOTTRDQTY', 'prev_close': 'PREVCLOSE', 'date': 'TIMESTAMP'},
+    'udiff': {'symbol': 'TckrSymb', 'series': 'SctySrs', 'open': 'OpnPric', 'high': 'HghPric', 'low': 'LwPric',
+              'close': 'ClsPric', 'volume': 'TtlTradgVol', 'prev_close': 'PrvsClsgPric', 'date': 'TradDt'},
+}
+
+
+def _parse_date(value):
+    for fmt in ('%Y-%m-%d', '%d-%b-%Y', '%d-%m-%Y', '%Y%m%d'):
+        try:
+            return datetime.strptime(value.strip(), fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised bhavcopy date {value!r}")
+
+
+# Stream the CSV row by row, keeping only equity rows for the wanted symbols
+# (NSE codes without the .NS suffix); returns {"CODE.NS": Bar}
+def parse_bhavcopy(text_stream, wanted=None):
+    reader = csv.reader(text_stream)
+    header = [h.strip() for h in next(reader)]
+    layout = next((cols for cols in COLUMNS.values() if cols['symbol'] in header), None)
+    if layout is None:
+        raise ValueError(f"Unrecognised bhavcopy header: {header[:8]}")
+    pos = {key: header.index(name) for key, name in layout.items()}
+    bars = {}
+    for row in reader:
+        if len(row) < len(header):
+            continue
+        symbol = row[pos['symbol']].strip()
+        if row[pos['series']].strip() not in EQUITY_SERIES or (wanted is not None and symbol not in wanted):
+            continue
+        bars[f"{symbol}.NS"] = Bar(_parse_date(row[pos['date']]), float(row[pos['open']]), float(row[pos['high']]),
+                                   float(row[pos['low']]), float(row[pos['close']]), int(float(row[pos['volume']])),
+                                   float(row[pos['prev_close']]))
+    return bars
+
+
+# Text stream over a bhavcopy (path or downloaded bytes, zipped or not); the
+# archive is closed with the stream
+@contextmanager
+def _open_text(name, raw):
+    if name.endswith('.zip'):
+        with zipfile.ZipFile(io.BytesIO(raw) if isinstance(raw, bytes) else raw) as archive:
+            member = next(n for n in archive.namelist() if n.lower().endswith('.csv'))
+            with io.TextIOWrapper(archive.open(member), encoding='utf-8', newline='') as stream:
+                yield stream
+    elif isinstance(raw, bytes):
+        yield io.StringIO(raw.decode('utf-8'))
+    else:
+        with open(raw, newline='', encoding='utf-8') as stream:
+            yield stream
+
+
+def _file_date(name):
+    match = re.search(r'(\d{8})', name) or re.search(r'(\d{2}[A-Z]{3}\d{4})', name)
+    if not match:
+        return None
+    value = match.group(1)
+    return datetime.strptime(value, '%Y%m%d' if value.isdigit() else '%d%b%Y').date()
+
+
+# Read the bhavcopy for `date` (default: newest available) from BHAVCOPY_DIR or BHAVCOPY_URL
+def load_bhavcopy(wanted=None, date=None, directory=BHAVCOPY_DIR, url=BHAVCOPY_URL):
+    if BHAVCOPY_DATE and date is None:
+        date = _parse_date(BHAVCOPY_DATE)
+    if directory:
+        files = [(d, n) for n in os.listdir(directory) if (d := _file_date(n)) and (date is None or d == date)]
+        if files:
+            _, name = max(files)
+            path = os.path.join(directory, name)
+            with _open_text(name, path) as stream:
+                return parse_bhavcopy(stream, wanted)
+    if url:
+        day = date or datetime.now(ist).date()
+        # Walk back over weekends/holidays until a published file is found
+        for _ in range(7):
+            full_url = url.format(date=day)
+            response = requests.get(full_url, headers={'User-Agent': 'Mozilla/5.0'}, timeout=(5, 60))
+            if response.status_code == 200:
+                with _open_text(full_url, response.content) as stream:
+                    return parse_bhavcopy(stream, wanted)
+            if date is not None:
+                break
+            day -= timedelta(days=1)
+    return {}
+
+
+# Daily history provider for PriceCache: loads each symbol's stored history,
+# appends today's bhavcopy bar when it continues the series (its previous close
+# matches our last close) and falls back to Yahoo otherwise. Symbols whose
+# PriceCache start (`starts`, e.g. a weekly/monthly seed) reaches further back
+# than the stored history also go to Yahoo, which fetches from that start.
+SEED_SLACK_DAYS = 7  # weekends and holiday runs before the first stored bar
+
+
+class BhavcopyProvider:
+    def __init__(self, bars, fallback, period_days=366, starts=None):
+        self.bars = bars
+        self.fallback = fallback
+        self.period_days = period_days
+        self.starts = starts if starts is not None else {}
+        self.appended = 0
+        self.fallbacks = 0
+
+    def _path(self, symbol):
+        return state_path('prices', f"{symbol}.parquet")
+
+    def _load(self, symbol):
+        path = self._path(symbol)
+        if not os.path.exists(path):
+            return None
+        try:
+            return pd.read_parquet(path)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable stored history for {symbol}: {e}")
+            return None
+
+    def _save(self, symbol, hist):
+        if hist is None or hist.empty:
+            return
+        try:
+            hist.to_parquet(self._path(symbol))
+        except Exception as e:
+            logger.warning(f"Could not store history for {symbol}: {e}")
+
+    def _append(self, hist, bar):
+        index = pd.DatetimeIndex([pd.Timestamp(bar.date).tz_localize(hist.index.tz or ist)], name=hist.index.name)
+        row = pd.DataFrame({'Open': bar.open, 'High': bar.high, 'Low': bar.low, 'Close': bar.close,
+                            'Adj Close': bar.close, 'Volume': bar.volume, 'Dividends': 0.0, 'Stock Splits': 0.0},
+                           index=index)
+        hist = pd.concat([hist, row[[c for c in hist.columns if c in row.columns]]])
+        return hist[hist.index >= hist.index[-1] - pd.Timedelta(days=self.period_days)]
+
+    def __call__(self, symbol):
+        bar = self.bars.get(symbol)
+        hist = self._load(symbol)
+        start = self.starts.get(symbol)
+        if start and hist is not None and not hist.empty and \
+                hist.index[0].date() > start + timedelta(days=SEED_SLACK_DAYS):
+            hist = None  # Too shallow for the requested start
+        if bar is not None and hist is not None and not hist.empty:
+            last_date = hist.index[-1].date()
+            if last_date == bar.date:
+                return hist
+            if last_date < bar.date and abs(float(hist['Close'].iloc[-1]) - bar.prev_close) <= 0.01 * max(bar.prev_close, 1):
+                hist = self._append(hist, bar)
+                self._save(symbol, hist)
+                self.appended += 1
+                return hist
+        hist = self.fallback(symbol)
+        self.fallbacks += 1
+        self._save(symbol, hist)
+        return hist
+
+
+# Switch a PriceCache to the bhavcopy when one is configured
+def use_bhavcopy(price_cache, symbols):
+    if not (BHAVCOPY_DIR or BHAVCOPY_URL):
+        return None
+    try:
+        bars = load_bhavcopy(wanted={s[:-3] if s.endswith('.NS') else s for s in symbols})
+    except Exception as e:
+        logger.error(f"Error loading bhavcopy, using Yahoo for every symbol: {e}")
+        return None
+    if not bars:
+        logger.warning("No bhavcopy found, using Yahoo for every symbol")
+        return None
+    # The seed starts are filled in after this, so the provider shares the dict
+    provider = BhavcopyProvider(bars, price_cache.download_yahoo, starts=price_cache.starts)
+    price_cache.provider = provider
+    logger.info(f"Loaded bhavcopy bars for {len(bars)} of {len(symbols)} symbols "
+                f"(date {next(iter(bars.values())).date})")
+    return provider
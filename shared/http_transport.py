@@ -0,0 +1,133 @@
+import os
+import threading
+import logging
+from collections import defaultdict
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+logger = logging.getLogger(__name__)
+
+# One pooled, keep-alive HTTP transport per run shared by the Apps Script
+# macro calls, the Yahoo price downloads and the Sheets client, so each host's
+# TLS connections are set up once and reused across phases
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', '60'))
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', '3'))
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# Hosts whose 429/5xx answers are retried by their own client (the Sheets
+# quota client); only connection and read failures are retried here
+SELF_RETRYING_PREFIXES = ('https://sheets.googleapis.com', 'https://www.googleapis.com')
+# Apps Script web apps run the macro on every GET and often take longer than
+# the default read timeout; a read timeout or 5xx may mean it is still
+# running, so only connection failures (nothing sent yet) are retried, under
+# a read timeout that covers the macro's real runtime
+MACRO_PREFIXES = ('https://script.google.com',)
+MACRO_READ_TIMEOUT = float(os.environ.get('MACRO_READ_TIMEOUT', '300'))
+
+
+class HttpTransport:
+    def __init__(self, pool_size=10, connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT,
+                 retries=HTTP_RETRIES, backoff=0.5):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.macro_timeout = (connect_timeout, MACRO_READ_TIMEOUT)
+        self.retries = retries
+        self.backoff = backoff
+        self.sessions = []
+        self._lock = threading.Lock()
+        self._latency = defaultdict(lambda: {'responses': 0, 'seconds': 0.0, 'max': 0.0, 'errors': 0})
+        self._yahoo = None
+        self.session = self.configure(requests.Session())
+
+    def _adapter(self, retry_status, retry_read=True):
+        retry = Retry(total=self.retries, read=None if retry_read else 0, other=None if retry_read else 0,
+                      backoff_factor=self.backoff, respect_retry_after_header=True,
+                      status_forcelist=RETRY_STATUS if retry_status else (), raise_on_status=False)
+        return HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=retry)
+
+    # Mount the pooled adapters on a session (e.g. an AuthorizedSession) and
+    # record its response latencies; returns the session
+    def configure(self, session):
+        adapter = self._adapter(retry_status=True)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        google_adapter = self._adapter(retry_status=False)
+        for prefix in SELF_RETRYING_PREFIXES:
+            session.mount(prefix, google_adapter)
+        macro_adapter = self._adapter(retry_status=False, retry_read=False)
+        for prefix in MACRO_PREFIXES:
+            session.mount(prefix, macro_adapter)
+        session.hooks['response'].append(self._record)
+        self.sessions.append(session)
+        return session
+
+    def _record(self, response, *args, **kwargs):
+        host = urlsplit(response.url).hostname
+        seconds = response.elapsed.total_seconds()
+        with self._lock:
+            stats = self._latency[host]
+            stats['responses'] += 1
+            stats['seconds'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            if response.status_code >= 400:
+                stats['errors'] += 1
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.get(url, **kwargs)
+
+    # Session for google-auth/gspread with the same pooling and latency records
+    def authorized_session(self, credentials):
+        from google.auth.transport.requests import AuthorizedSession
+        return self.configure(AuthorizedSession(credentials))
+
+    # The shared session for yfinance, or None when the installed yfinance only
+    # accepts its own (curl_cffi) sessions and must keep managing one itself
+    def yahoo_session(self):
+        if self._yahoo is None:
+            import yfinance as yf
+            try:
+                yf.Ticker('^NSEI', session=self.session)
+                self._yahoo = self.session
+            except Exception as e:
+                logger.info(f"yfinance keeps its own HTTP session: {e}")
+                self._yahoo = False
+        return self._yahoo or None
+
+    # Per host: connections opened and requests sent through the pools
+    def pool_stats(self):
+        stats = defaultdict(lambda: {'connections': 0, 'requests': 0})
+        adapters = {id(a): a for s in self.sessions for a in s.adapters.values()}
+        for adapter in adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                stats[pool.host]['connections'] += pool.num_connections
+                stats[pool.host]['requests'] += pool.num_requests
+        return stats
+
+    def report(self):
+        pools = self.pool_stats()
+        with self._lock:
+            latency = {host: dict(s) for host, s in self._latency.items()}
+        out = {}
+        for host in sorted(set(latency) | set(pools)):
+            lat = latency.get(host, {'responses': 0, 'seconds': 0.0, 'max': 0.0, 'errors': 0})
+            pool = pools.get(host, {'connections': 0, 'requests': 0})
+            out[host] = {
+                'responses': lat['responses'],
+                'errors': lat['errors'],
+                'mean_seconds': round(lat['seconds'] / lat['responses'], 3) if lat['responses'] else None,
+                'max_seconds': round(lat['max'], 3),
+                'connections': pool['connections'],
+                'reused': max(0, pool['requests'] - pool['connections']),
+            }
+        return out
+
+    def log_report(self):
+        for host, r in self.report().items():
+            mean = f"{r['mean_seconds']:.3f}s" if r['mean_seconds'] is not None else "n/a"
+            logger.info(f"HTTP {host}: {r['responses']} responses ({r['errors']} errors), mean {mean}, "
+                        f"max {r['max_seconds']:.3f}s; {r['connections']} connections opened, {r['reused']} reused")
@@ -0,0 +1,193 @@
+import os
+import sys
+import json
+import time
+import queue
+import sqlite3
+import threading
+import logging
+from collections import Counter
+
+from shared.state import state_path
+
+logger = logging.getLogger(__name__)
+
+# Each script keeps its tables in a local SQLite database
+# (.state/store/<script>.sqlite3): the symbol and recipient inputs, the
+# Calculation rows and copies of the tabs the sheet derives from them. The run
+# reads and writes the store; the Google Sheet is a mirror that a SheetSink
+# updates on a background thread. OFFLINE=1 (or --offline) never contacts
+# Google or SMTP and serves every table from the last mirrored copy.
+OFFLINE = os.environ.get('OFFLINE', '').lower() in ('1', 'true', 'yes') or '--offline' in sys.argv
+# How long the run waits for the sink before reading tabs the sheet derives
+SHEET_SINK_TIMEOUT = float(os.environ.get('SHEET_SINK_TIMEOUT', '300'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inputs (
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (name, position)
+);
+CREATE TABLE IF NOT EXISTS results (
+    symbol TEXT PRIMARY KEY,
+    row TEXT NOT NULL,
+    run_date TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tabs (
+    tab TEXT PRIMARY KEY,
+    rows TEXT NOT NULL,
+    fetched REAL NOT NULL
+);
+"""
+
+
+class LocalStore:
+    def __init__(self, name, path=None):
+        self.name = name
+        self.path = path or state_path('store', f"{name}.sqlite3")
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self.writes = 0
+        self.seconds = 0.0
+
+    def _write(self, statements):
+        started = time.perf_counter()
+        with self._lock, self._db:
+            for sql, params in statements:
+                self._db.execute(sql, params)
+            self.writes += 1
+            self.seconds += time.perf_counter() - started
+
+    # First-column values per input name, as loaded by SheetInputs
+    def put_inputs(self, values):
+        statements = []
+        for name, column in values.items():
+            statements.append(("DELETE FROM inputs WHERE name = ?", (name,)))
+            statements.extend(("INSERT INTO inputs (name, position, value) VALUES (?, ?, ?)", (name, i, value))
+                              for i, value in enumerate(column))
+        self._write(statements)
+
+    def inputs(self):
+        with self._lock:
+            rows = self._db.execute("SELECT name, value FROM inputs ORDER BY name, position").fetchall()
+        if not rows:
+            raise LookupError(f"No inputs stored in {self.path}; run once with Google access first")
+        values = {}
+        for name, value in rows:
+            values.setdefault(name, []).append(value)
+        logger.info(f"Loaded inputs ({', '.join(f'{n}: {len(v)}' for n, v in values.items())}) from {self.path}")
+        return values
+
+    def put_result(self, symbol, row, run_date):
+        payload = json.dumps(list(row), default=lambda v: v.item())  # NumPy scalars
+        self._write([("INSERT OR REPLACE INTO results (symbol, row, run_date, updated) VALUES (?, ?, ?, ?)",
+                      (symbol, payload, run_date.isoformat(), time.time()))])
+
+    # Calculation rows (symbol -> row) written on `run_date`, or the latest
+    # stored row of every symbol
+    def results(self, run_date=None):
+        query = "SELECT symbol, row FROM results"
+        with self._lock:
+            if run_date is None:
+                rows = self._db.execute(query).fetchall()
+            else:
+                rows = self._db.execute(query + " WHERE run_date = ?", (run_date.isoformat(),)).fetchall()
+        return {symbol: json.loads(row) for symbol, row in rows}
+
+    # Copy of a tab the sheet computes (e.g. Swing_stock), kept for offline runs
+    def put_tab(self, tab, rows):
+        self._write([("INSERT OR REPLACE INTO tabs (tab, rows, fetched) VALUES (?, ?, ?)",
+                      (tab, json.dumps(rows), time.time()))])
+
+    def tab(self, tab):
+        with self._lock:
+            found = self._db.execute("SELECT rows, fetched FROM tabs WHERE tab = ?", (tab,)).fetchone()
+        if found is None:
+            raise LookupError(f"No copy of '{tab}' stored in {self.path}; run once with Google access first")
+        rows, fetched = found
+        logger.info(f"Using the stored copy of '{tab}' from {time.strftime('%Y-%m-%d %H:%M', time.localtime(fetched))}")
+        return json.loads(rows)
+
+    def log_report(self):
+        logger.info(f"Local store {self.path}: {self.writes} transactions in {self.seconds:.3f}s")
+
+
+# Runs sheet writes on one background thread in submission order, so the
+# screening loop never waits on Sheets latency or quota. drain() is the
+# barrier before reading anything the sheet computes from those writes. A
+# disabled sink (offline runs) drops every job.
+class SheetSink:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.queue = queue.Queue()
+        self.jobs = Counter()
+        self.errors = Counter()
+        self.skipped = 0
+        self.busy = 0.0
+        self.max_depth = 0
+        self._thread = None
+        if enabled:
+            self._thread = threading.Thread(target=self._run, name='sheet-sink', daemon=True)
+            self._thread.start()
+
+    def submit(self, label, fn, *args):
+        if not self.enabled:
+            self.skipped += 1
+            return
+        self.queue.put((label, fn, args))
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            label, fn, args = item
+            started = time.time()
+            try:
+                fn(*args)
+                self.jobs[label] += 1
+            except Exception as e:
+                self.errors[label] += 1
+                logger.error(f"Sheet sync '{label}' failed: {e}")
+            finally:
+                self.busy += time.time() - started
+                self.queue.task_done()
+
+    # Wait until every submitted job has run; False when `timeout` ran out
+    def drain(self, timeout=SHEET_SINK_TIMEOUT):
+        if not self.enabled:
+            return True
+        started = time.time()
+        deadline = started + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    logger.warning(f"Sheet sync still has {self.queue.unfinished_tasks} jobs after {timeout:g}s")
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        logger.info(f"Sheet sync caught up after waiting {time.time() - started:.2f}s")
+        return True
+
+    def close(self):
+        if self._thread is not None:
+            self.drain()
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def log_report(self):
+        if not self.enabled:
+            logger.info(f"Sheet sync disabled for this run: {self.skipped} jobs dropped")
+            return
+        logger.info(f"Sheet sync: {sum(self.jobs.values())} jobs in {self.busy:.2f}s on the sink thread, "
+                    f"{sum(self.errors.values())} failed, at most {self.max_depth} queued")
+        for label, count in sorted(self.errors.items()):
+            logger.info(f"  {count} failed '{label}' job(s)")
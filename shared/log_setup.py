@@ -0,0 +1,122 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+logger = logging.getLogger(__name__)
+
+# Worker threads only put records on a queue; a listener thread formats and
+# writes them. LOG_FORMAT=json emits one JSON object per line.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+# Rows of a sheet shown at INFO level; the full sheet is only dumped at DEBUG
+SHEET_DUMP_ROWS = int(os.environ.get('SHEET_DUMP_ROWS', '10'))
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _TimedQueueHandler(QueueHandler):
+    def __init__(self, log_queue, stats):
+        super().__init__(log_queue)
+        self.stats = stats
+
+    def emit(self, record):
+        started = time.perf_counter()
+        super().emit(record)
+        self.stats.add('enqueue', time.perf_counter() - started)
+
+
+class _TimedStreamHandler(logging.StreamHandler):
+    def __init__(self, stream, stats):
+        super().__init__(stream)
+        self.stats = stats
+
+    def emit(self, record):
+        started = time.perf_counter()
+        super().emit(record)
+        self.stats.add('write', time.perf_counter() - started)
+
+
+class _LogStats:
+    def __init__(self):
+        self.seconds = {'enqueue': 0.0, 'write': 0.0}
+        self.records = 0
+        self._lock = threading.Lock()
+
+    def add(self, kind, seconds):
+        with self._lock:
+            self.seconds[kind] += seconds
+            if kind == 'write':
+                self.records += 1
+
+
+class QueuedLogging:
+    def __init__(self, level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None):
+        self.stats = _LogStats()
+        self.queue = queue.SimpleQueue()
+        handler = _TimedStreamHandler(stream or sys.stderr, self.stats)
+        handler.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+        self.listener = QueueListener(self.queue, handler, respect_handler_level=False)
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(_TimedQueueHandler(self.queue, self.stats))
+        root.setLevel(level)
+        self.listener.start()
+        self._running = True
+        atexit.register(self.stop)
+
+    # Drain the queue and stop the listener thread; safe to call twice
+    def stop(self):
+        if self._running:
+            self._running = False
+            self.listener.stop()
+
+    def log_report(self):
+        if self._running:
+            # Drain what is queued so the counts cover every earlier record
+            self.listener.stop()
+            self.listener.start()
+        seconds = self.stats.seconds
+        logger.info(f"Logging: {self.stats.records} records, {seconds['enqueue']:.3f}s on calling threads, "
+                    f"{seconds['write']:.3f}s formatting and writing on the listener thread")
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    return QueuedLogging(level, fmt)
+
+
+# Log a sheet's contents: a size summary and the first `limit` rows at INFO,
+# every row at DEBUG
+def log_rows(log, title, rows, limit=SHEET_DUMP_ROWS):
+    if not rows:
+        log.info(f"{title}: no data")
+        return
+    width = max(len(row) for row in rows)
+    full = log.isEnabledFor(logging.DEBUG)
+    shown = rows if full else rows[:limit]
+    lines = [f"Row {i:2d}: {' | '.join(str(val).ljust(15) for val in row)}" for i, row in enumerate(shown, 1)]
+    more = '' if len(shown) == len(rows) else f"\n... {len(rows) - len(shown)} more rows (LOG_LEVEL=DEBUG shows all)"
+    log.log(logging.DEBUG if full else logging.INFO,
+            f"{title}: {len(rows)} rows x {width} columns\n" + '\n'.join(lines) + more)
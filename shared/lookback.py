@@ -0,0 +1,79 @@
+import os
+import math
+import logging
+from datetime import timedelta
+
+from shared.screen_rules import RuleSet
+
+logger = logging.getLogger(__name__)
+
+# Each script declares the indicators behind its Calculation columns, either as
+# a screen_rules expression ("adx(14)") or as a number of bars, and the daily
+# history is fetched from the date that covers the longest of them instead of a
+# fixed "1y". EWM-based indicators declare enough warm-up for their seed to
+# weigh less than EWM_TOLERANCE (see shared.screen_rules). Screen rules add
+# their daily lookbacks to the plan; their weekly()/monthly() terms are served
+# from the persisted timeframe cache, and a symbol whose cached bars are too
+# short is fetched once from far enough back to seed them.
+# Sessions per year on NSE, for turning bars into calendar days
+SESSIONS_PER_YEAR = 245
+# Bars fetched beyond the plan to absorb unplanned holidays and a missing latest bar
+LOOKBACK_MARGIN_BARS = int(os.environ.get('LOOKBACK_MARGIN_BARS', '10'))
+# Calendar days per weekly/monthly bar
+TIMEFRAME_CALENDAR_DAYS = {'weekly': 7, 'monthly': 31}
+
+
+class LookbackPlan:
+    def __init__(self, requirements, rules=None, margin_bars=LOOKBACK_MARGIN_BARS):
+        expressions = {name: need for name, need in requirements.items() if isinstance(need, str)}
+        self.needs = {name: int(need) for name, need in requirements.items() if not isinstance(need, str)}
+        self.needs.update(RuleSet(expressions).lookback())
+        self.timeframe_needs = {}  # timeframe -> bars
+        if rules:
+            rule_set = RuleSet(rules)
+            self.needs.update({f"screen {name}": bars for name, bars in rule_set.lookback(expand_timeframes=False).items()})
+            for needs in rule_set.timeframe_lookback().values():
+                for timeframe, bars in needs.items():
+                    self.timeframe_needs[timeframe] = max(self.timeframe_needs.get(timeframe, 0), bars)
+        self.margin_bars = margin_bars
+
+    # Bars to fetch: the longest requirement plus the margin
+    @property
+    def bars(self):
+        return max(self.needs.values()) + self.margin_bars
+
+    @property
+    def calendar_days(self):
+        return math.ceil(self.bars * 365 / SESSIONS_PER_YEAR)
+
+    # First date to fetch for a run on `today`
+    def start(self, today):
+        return today - timedelta(days=self.calendar_days)
+
+    # Calendar days that cover the weekly/monthly lookbacks, as daily history
+    @property
+    def seed_days(self):
+        return max([(bars + 1) * TIMEFRAME_CALENDAR_DAYS[tf] for tf, bars in self.timeframe_needs.items()]
+                   + [self.calendar_days])
+
+    # Symbol -> first date to fetch, for the `symbols` whose weekly/monthly
+    # bars in `timeframe_cache` are too short for the screens
+    def seed_starts(self, symbols, timeframe_cache, today):
+        if not self.timeframe_needs:
+            return {}
+        start = today - timedelta(days=self.seed_days)
+        short = [s for s in symbols if timeframe_cache.needs_seed(s, self.timeframe_needs)]
+        if short:
+            logger.info(f"{len(short)} symbols fetch daily history from {start} to seed their weekly/monthly bars")
+        return dict.fromkeys(short, start)
+
+    def log_report(self, today):
+        longest = max(self.needs, key=self.needs.get)
+        logger.info(f"Lookback plan: {self.bars} bars ({longest} needs {self.needs[longest]}), "
+                    f"history from {self.start(today)} ({self.calendar_days} calendar days)")
+        for name, bars in sorted(self.needs.items(), key=lambda item: -item[1]):
+            logger.info(f"  {name}: {bars} bars")
+        for timeframe, bars in sorted(self.timeframe_needs.items()):
+            logger.info(f"  {timeframe} screens: {bars} {timeframe} bars "
+                        f"(about {bars * TIMEFRAME_CALENDAR_DAYS[timeframe]} calendar days of daily history, "
+                        f"kept in the timeframe cache)")
@@ -0,0 +1,71 @@
+import time
+import threading
+import logging
+from concurrent.futures import Future
+import requests
+
+from shared.http_transport import MACRO_READ_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+# Google Apps Script macro trigger. Calls made while a request is already in
+# flight, or within `min_interval` seconds of the last one finishing, join that
+# request instead of refreshing the sheet again. Requests go through the
+# run's shared HttpTransport when one is given; a disabled trigger (offline
+# runs) never sends anything.
+class MacroTrigger:
+    def __init__(self, url, min_interval=1.0, transport=None, enabled=True):
+        self.url = url
+        self.enabled = enabled
+        self.min_interval = min_interval
+        self.transport = transport
+        self.calls = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._inflight = None
+        self._last_finished = 0.0
+        self._last_ok = False
+
+    def _request(self):
+        if self.transport is not None:
+            response = self.transport.get(self.url, timeout=self.transport.macro_timeout)
+        else:
+            response = requests.get(self.url, timeout=(5, MACRO_READ_TIMEOUT))
+        response.raise_for_status()
+
+    def run(self, label="macro"):
+        if not self.enabled:
+            logger.info(f"{label}: offline, Google Apps Script macro skipped")
+            return False
+        with self._lock:
+            if self._inflight is not None:
+                future, owner = self._inflight, False
+            elif time.time() - self._last_finished < self.min_interval:
+                self.coalesced += 1
+                logger.info(f"{label}: reusing Google Apps Script refresh from {time.time() - self._last_finished:.1f}s ago")
+                return self._last_ok
+            else:
+                future, owner = Future(), True
+                self._inflight = future
+        if not owner:
+            with self._lock:
+                self.coalesced += 1
+            logger.info(f"{label}: joined in-flight Google Apps Script refresh")
+            return future.result()
+
+        ok = False
+        try:
+            self.calls += 1
+            self._request()
+            ok = True
+            logger.info(f"{label}: Google Apps Script macro executed successfully.")
+        except Exception as e:
+            logger.error(f"{label}: Error executing macro: {e}")
+        finally:
+            with self._lock:
+                self._inflight = None
+                self._last_finished = time.time()
+                self._last_ok = ok
+            future.set_result(ok)
+        return ok
@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import sqlite3
+import smtplib
+import threading
+import logging
+import zlib
+
+from shared.state import state_path
+
+logger = logging.getLogger(__name__)
+
+# Persistent outbound queue: set MAIL_QUEUE=1 to route personalised emails through it
+MAIL_QUEUE_ENABLED = os.environ.get('MAIL_QUEUE', '').lower() in ('1', 'true', 'yes')
+
+
+# Sender accounts come from SMTP_ACCOUNTS (a JSON list of objects with
+# username/password and optional host/port/starttls/per_minute), falling back
+# to the single SMTP_USERNAME/SMTP_PASSWORD Gmail account
+def load_accounts():
+    raw = os.environ.get('SMTP_ACCOUNTS')
+    if raw:
+        accounts = json.loads(raw)
+    else:
+        accounts = [{'username': os.environ.get('SMTP_USERNAME'), 'password': os.environ.get('SMTP_PASSWORD')}]
+    for account in accounts:
+        account.setdefault('host', 'smtp.gmail.com')
+        account.setdefault('port', 587)
+        account.setdefault('starttls', True)
+        account.setdefault('per_minute', 20)
+    return accounts
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    message TEXT NOT NULL,
+    account INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    created REAL NOT NULL,
+    sent_at REAL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, account, next_attempt);
+"""
+
+
+class MailQueue:
+    def __init__(self, db_path=None, accounts=None, max_attempts=5, backoff=30, max_age_hours=6):
+        self.db_path = db_path or state_path('mail', 'outbox.sqlite3')
+        self.accounts = accounts or load_accounts()
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_age = max_age_hours * 3600
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        # Rows left mid-send by a crashed run are retried; stale reports are dropped
+        with self._db:
+            self._db.execute("UPDATE outbox SET status = 'pending' WHERE status = 'sending'")
+            self._db.execute("UPDATE outbox SET status = 'expired' WHERE status = 'pending' AND created < ?",
+                             (time.time() - self.max_age,))
+        self.stats = {i: {'sent': 0, 'failed': 0, 'busy': 0.0} for i in range(len(self.accounts))}
+
+    def _shard(self, recipient):
+        return zlib.crc32(recipient.lower().encode()) % len(self.accounts)
+
+    # Queue one rendered message per recipient, sharded across sender accounts
+    def enqueue(self, run, recipient, message):
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO outbox (run, recipient, sender, message, account, next_attempt, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (run, recipient, message['From'], message.as_string(), self._shard(recipient), now, now))
+
+    def _claim(self, account):
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT id, recipient, sender, message, attempts FROM outbox "
+                "WHERE status = 'pending' AND account = ? AND next_attempt <= ? ORDER BY id LIMIT 1",
+                (account, time.time())).fetchone()
+            if row:
+                self._db.execute("UPDATE outbox SET status = 'sending' WHERE id = ?", (row[0],))
+            return row
+
+    # Earliest retry time for this account, or for any account when
+    # `account` is None (failed messages can move over to us later)
+    def _next_due(self, account=None):
+        query = "SELECT MIN(next_attempt) FROM outbox WHERE status IN ('pending', 'sending')"
+        with self._lock:
+            if account is None:
+                return self._db.execute(query).fetchone()[0]
+            return self._db.execute(query + " AND account = ?", (account,)).fetchone()[0]
+
+    def _mark_sent(self, row_id):
+        with self._lock, self._db:
+            self._db.execute("UPDATE outbox SET status = 'sent', sent_at = ? WHERE id = ?", (time.time(), row_id))
+
+    # Failed messages back off exponentially and move to the next account so
+    # one throttled sender does not hold its whole shard back
+    def _mark_failed(self, row_id, account, attempts, error):
+        attempts += 1
+        status = 'dead' if attempts >= self.max_attempts else 'pending'
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, account = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                (status, attempts, (account + 1) % len(self.accounts),
+                 time.time() + self.backoff * (2 ** (attempts - 1)), str(error), row_id))
+
+    def _connect(self, account):
+        config = self.accounts[account]
+        session = smtplib.SMTP(config['host'], config['port'], timeout=30)
+        if config['starttls']:
+            session.starttls()
+        if config.get('username') and config.get('password'):
+            session.login(config['username'], config['password'])
+        return session
+
+    def _worker(self, account, deadline):
+        interval = 60.0 / max(1, self.accounts[account]['per_minute'])
+        session = None
+        last_send = 0.0
+        try:
+            while time.time() < deadline:
+                row = self._claim(account)
+                if row is None:
+                    next_due = self._next_due(account)
+                    if next_due is None:
+                        if self._next_due() is None or self._next_due() > deadline:
+                            break
+                        time.sleep(0.5)
+                        continue
+                    if next_due > deadline:
+                        break
+                    time.sleep(max(0.0, min(next_due, deadline) - time.time()))
+                    continue
+                row_id, recipient, sender, message, attempts = row
+                time.sleep(max(0.0, last_send + interval - time.time()))
+                started = time.time()
+                try:
+                    if session is None:
+                        session = self._connect(account)
+                    session.sendmail(sender, [recipient], message)
+                    self._mark_sent(row_id)
+                    self.stats[account]['sent'] += 1
+                    logger.debug(f"Email sent to {recipient} via account {account + 1}")
+                except Exception as e:
+                    self._mark_failed(row_id, account, attempts, e)
+                    self.stats[account]['failed'] += 1
+                    logger.error(f"Error sending a queued email via account {account + 1}: {e}")
+                    logger.debug(f"Failed recipient: {recipient}")
+                    if session is not None:
+                        try:
+                            session.close()
+                        except Exception:
+                            pass
+                        session = None
+                last_send = time.time()
+                self.stats[account]['busy'] += last_send - started
+        finally:
+            if session is not None:
+                try:
+                    session.quit()
+                except Exception:
+                    pass
+
+    # Deliver everything that is due, one worker per account, waiting for
+    # backoff retries until `timeout` seconds have passed
+    def process(self, timeout=300):
+        deadline = time.time() + timeout
+        workers = [threading.Thread(target=self._worker, args=(i, deadline)) for i in range(len(self.accounts))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.log_report()
+
+    # Queue a run's messages and deliver them; returns how many of the run's
+    # messages have been sent so far (including ones retried from a crash).
+    # Recipients already queued for `run` by an earlier attempt are not queued again.
+    def deliver(self, run, messages, timeout=300):
+        with self._lock:
+            queued = {r for (r,) in self._db.execute("SELECT recipient FROM outbox WHERE run = ?", (run,))}
+        for recipient, message in messages:
+            if recipient not in queued:
+                self.enqueue(run, recipient, message)
+        self.process(timeout=timeout)
+        return self.counts(run).get('sent', 0)
+
+    def counts(self, run=None):
+        query = "SELECT status, COUNT(*) FROM outbox" + (" WHERE run = ?" if run else "") + " GROUP BY status"
+        with self._lock:
+            return dict(self._db.execute(query, (run,) if run else ()).fetchall())
+
+    def sent_recipients(self, run):
+        with self._lock:
+            return [r for (r,) in self._db.execute("SELECT recipient FROM outbox WHERE run = ? AND status = 'sent'", (run,))]
+
+    def log_report(self):
+        for account, stats in self.stats.items():
+            rate = stats['sent'] / stats['busy'] if stats['busy'] else 0.0
+            logger.info(f"Mail account {account + 1} ({self.accounts[account].get('username')}): "
+                        f"{stats['sent']} sent, {stats['failed']} failed, {rate:.2f} msg/s while sending")
+        logger.info(f"Outbox status: {self.counts()}")
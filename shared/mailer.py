@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import queue
+import smtplib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from shared.state import state_path
+
+logger = logging.getLogger(__name__)
+
+# Broadcast mode: one BCC'd message per batch of recipients instead of one per address
+BROADCAST_ENABLED = os.environ.get('EMAIL_BROADCAST', '').lower() in ('1', 'true', 'yes')
+BROADCAST_BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', '50'))
+BROADCAST_GREETING_NAME = os.environ.get('EMAIL_BROADCAST_GREETING', 'Subscriber')
+
+
+def recipient_name(recipient_email):
+    return recipient_email.split('@')[0].replace('.', ' ').replace('_', ' ').title()
+
+
+def batched(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+# Append one line per recipient so a run's deliveries can be audited afterwards
+def log_deliveries(log_name, batch_no, recipients, status, error=None, refused=None):
+    refused = refused or {}
+    with open(state_path('mail', f'{log_name}.jsonl'), 'a') as f:
+        for recipient in recipients:
+            failed = recipient in refused
+            f.write(json.dumps({
+                'time': datetime.now().isoformat(timespec='seconds'),
+                'batch': batch_no,
+                'recipient': recipient,
+                'status': 'refused' if failed else status,
+                'error': str(refused[recipient]) if failed else error,
+            }) + '\n')
+
+
+def _quit_quietly(session):
+    if session is None:
+        return
+    try:
+        session.quit()
+    except Exception as e:
+        logger.debug(f"SMTP QUIT failed: {e}")
+
+
+# Send `message` (a MIME message without per-recipient headers) to every
+# address in BCC batches of `batch_size`. A batch is retried with backoff only
+# while nothing has been accepted (connect, login, refused recipients, DATA);
+# once sendmail returns it counts as delivered and later errors are only
+# logged. Returns the number of recipients the server accepted. `on_sent` is
+# called with each batch's accepted recipients.
+def send_broadcast(message, recipients, smtp_server, smtp_port, username, password, sender,
+                   batch_size=BROADCAST_BATCH_SIZE, retries=3, retry_delay=5, log_name='delivery_log', on_sent=None):
+    if 'To' not in message:
+        message['To'] = 'undisclosed-recipients:;'
+    payload = message.as_string()
+    delivered = 0
+    batches = batched(list(recipients), max(1, batch_size))
+    for batch_no, batch in enumerate(batches, 1):
+        for attempt in range(retries):
+            session = None
+            try:
+                session = smtplib.SMTP(smtp_server, smtp_port)
+                session.starttls()
+                session.login(username, password)
+                refused = session.sendmail(sender, batch, payload)
+            except Exception as e:
+                _quit_quietly(session)
+                reason = "all recipients refused" if isinstance(e, smtplib.SMTPRecipientsRefused) else e
+                logger.error(f"Broadcast batch {batch_no}/{len(batches)} attempt {attempt + 1} failed: {reason}")
+                if attempt < retries - 1:
+                    time.sleep(retry_delay * (2 ** attempt))
+                elif isinstance(e, smtplib.SMTPRecipientsRefused):
+                    log_deliveries(log_name, batch_no, batch, 'failed', refused=e.recipients)
+                else:
+                    log_deliveries(log_name, batch_no, batch, 'failed', error=str(e))
+                continue
+            # Accepted by the server: nothing below may resend the batch
+            _quit_quietly(session)
+            accepted = [r for r in batch if r not in refused]
+            delivered += len(accepted)
+            try:
+                log_deliveries(log_name, batch_no, batch, 'sent', refused=refused)
+                if on_sent:
+                    on_sent(accepted)
+            except Exception as e:
+                logger.error(f"Broadcast batch {batch_no}/{len(batches)} was sent but not recorded: {e}")
+            logger.info(f"Broadcast batch {batch_no}/{len(batches)} sent to {len(accepted)} recipients")
+            break
+    logger.info(f"Broadcast delivered to {delivered}/{len(recipients)} recipients in {len(batches)} messages")
+    return delivered
+
+
+# Authenticated SMTP sessions opened ahead of time (e.g. during a scheduled
+# wait) and shared by the sending threads. warm() opens missing sessions and
+# replaces ones the server has dropped; sendmail() reconnects once if a
+# session died while idle.
+class SmtpPool:
+    def __init__(self, smtp_server, smtp_port, username, password, size=5):
+        self.smtp_server = smtp_server
+        self.smtp_port = smtp_port
+        self.username = username
+        self.password = password
+        self.size = size
+        self._idle = queue.Queue()
+
+    def _connect(self):
+        session = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=30)
+        session.starttls()
+        session.login(self.username, self.password)
+        return session
+
+    def _check(self, session):
+        if session is not None:
+            try:
+                if session.noop()[0] == 250:
+                    return session
+            except Exception:
+                pass
+            self._quit(session)
+        return self._connect()
+
+    @staticmethod
+    def _quit(session):
+        try:
+            session.quit()
+        except Exception:
+            pass
+
+    def warm(self):
+        sessions = []
+        while not self._idle.empty():
+            sessions.append(self._idle.get_nowait())
+        sessions += [None] * (self.size - len(sessions))
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            for future in [executor.submit(self._check, s) for s in sessions]:
+                try:
+                    self._idle.put(future.result())
+                except Exception as e:
+                    logger.warning(f"Could not open SMTP session: {e}")
+        logger.info(f"{self._idle.qsize()} SMTP sessions ready in {time.time() - started:.2f}s")
+        return self._idle.qsize()
+
+    def sendmail(self, sender, recipients, message):
+        try:
+            session = self._idle.get_nowait()
+        except queue.Empty:
+            session = self._connect()
+        try:
+            try:
+                session.sendmail(sender, recipients, message)
+            except smtplib.SMTPServerDisconnected:
+                self._quit(session)
+                session = None
+                session = self._connect()
+                session.sendmail(sender, recipients, message)
+        finally:
+            if session is not None:
+                self._idle.put(session)
+
+    def close(self):
+        while not self._idle.empty():
+            self._quit(self._idle.get_nowait())
@@ -0,0 +1,115 @@
+import os
+import json
+import math
+import threading
+import logging
+from datetime import date, timedelta
+
+from shared.state import state_path
+
+logger = logging.getLogger(__name__)
+
+# Symbols that returned no usable history are remembered in
+# .state/negative_cache/ and not requested again until their retry date.
+# Errors and empty histories back off exponentially (1, 2, 4 ... days up to
+# NEGATIVE_CACHE_MAX_DAYS); short histories retry once enough trading days
+# have passed to reach the required bar count.
+NEGATIVE_CACHE_ENABLED = os.environ.get('NEGATIVE_CACHE', '1').lower() not in ('0', 'false', 'no')
+NEGATIVE_CACHE_MAX_DAYS = int(os.environ.get('NEGATIVE_CACHE_MAX_DAYS', '30'))
+# When more than this share of the run's symbols fail with errors it looks like
+# a Yahoo outage rather than bad symbols, and the new error entries are dropped
+OUTAGE_FRACTION = 0.5
+
+
+class NegativeCache:
+    def __init__(self, name, today=None, min_bars=200, max_days=NEGATIVE_CACHE_MAX_DAYS, path=None):
+        self.today = today or date.today()
+        self.min_bars = min_bars
+        self.max_days = max_days
+        self.path = path or state_path('negative_cache', f"{name}.json")
+        self.entries = self._load()
+        # Entries as loaded, restored for symbols whose errors an outage explains
+        self.loaded = dict(self.entries)
+        self.skipped = {}     # symbol -> entry, for symbols skipped this run
+        self.new_errors = set()
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if not NEGATIVE_CACHE_ENABLED:
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable negative cache {self.path}: {e}")
+            return {}
+
+    # Symbols to fetch today; the rest are remembered in self.skipped
+    def eligible(self, symbols):
+        out = []
+        for symbol in symbols:
+            entry = self.entries.get(symbol)
+            if entry and date.fromisoformat(entry['retry_after']) > self.today:
+                self.skipped[symbol] = entry
+            else:
+                out.append(symbol)
+        return out
+
+    def _put(self, symbol, reason, detail, retry_after):
+        with self._lock:
+            previous = self.entries.get(symbol, {})
+            self.entries[symbol] = {
+                'reason': reason,
+                'detail': detail,
+                'failures': previous.get('failures', 0) + 1,
+                'first_seen': previous.get('first_seen', self.today.isoformat()),
+                'retry_after': retry_after.isoformat(),
+            }
+
+    def _backoff(self, symbol):
+        failures = self.entries.get(symbol, {}).get('failures', 0)
+        return self.today + timedelta(days=min(2 ** failures, self.max_days))
+
+    def record_error(self, symbol, reason, detail=''):
+        if reason == 'error':
+            self.new_errors.add(symbol)
+        self._put(symbol, reason, str(detail)[:200], self._backoff(symbol))
+
+    # Retry when the listing should have min_bars sessions (five per week)
+    def record_short_history(self, symbol, bars):
+        missing = self.min_bars - bars
+        days = min(max(1, math.ceil(missing * 7 / 5)), 366)
+        self._put(symbol, 'short history', f"{bars} of {self.min_bars} bars", self.today + timedelta(days=days))
+
+    def clear(self, symbol):
+        with self._lock:
+            self.entries.pop(symbol, None)
+
+    def save(self, attempted):
+        if not NEGATIVE_CACHE_ENABLED:
+            return
+        if attempted and len(self.new_errors) > max(5, OUTAGE_FRACTION * attempted):
+            logger.warning(f"{len(self.new_errors)} of {attempted} symbols failed with errors; "
+                           f"not caching them as bad symbols")
+            for symbol in self.new_errors:
+                if symbol in self.loaded:
+                    self.entries[symbol] = self.loaded[symbol]
+                else:
+                    self.entries.pop(symbol, None)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def report_lines(self):
+        return [f"{symbol}: {entry['reason']} ({entry['detail']}), retry after {entry['retry_after']}"
+                for symbol, entry in sorted(self.skipped.items())]
+
+    def log_report(self):
+        if not self.skipped:
+            return
+        logger.info(f"Skipped {len(self.skipped)} symbols from the negative cache:")
+        for line in self.report_lines():
+            logger.info(f"  {line}")
@@ -0,0 +1,207 @@
+import csv
+import logging
+from collections import namedtuple
+from datetime import datetime
+import numpy as np
+import pytz
+
+logger = logging.getLogger(__name__)
+
+ist = pytz.timezone('Asia/Kolkata')
+
+BAR_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+Alert = namedtuple('Alert', ['symbol', 'ts', 'level', 'price'])
+
+
+# Fixed-size minute-bar store for one symbol backed by flat NumPy arrays.
+# Appending a bar with the same timestamp as the newest one replaces it, so the
+# still-forming minute can be re-polled without growing the buffer.
+class BarRing:
+    def __init__(self, capacity=400):
+        self.capacity = capacity
+        self.ts = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros((capacity, len(BAR_FIELDS)), dtype=np.float64)
+        self.count = 0
+        self.head = 0  # slot the next new bar goes into
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def last_ts(self):
+        return int(self.ts[(self.head - 1) % self.capacity]) if self.count else None
+
+    def append(self, ts, bar):
+        if self.count and ts == self.last_ts:
+            self.values[(self.head - 1) % self.capacity] = bar
+            return False
+        if self.count and ts < self.last_ts:
+            return False  # late duplicate of an older minute
+        self.ts[self.head] = ts
+        self.values[self.head] = bar
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        return True
+
+    # Oldest-to-newest copy of the last n bars
+    def last(self, n=None):
+        n = self.count if n is None else min(n, self.count)
+        idx = (np.arange(self.head - n, self.head)) % self.capacity
+        return self.ts[idx], self.values[idx]
+
+
+# Opening range and breakout state for one symbol, updated bar by bar
+class OpeningRange:
+    def __init__(self, open_ts, or_minutes):
+        self.open_ts = open_ts
+        self.end_ts = open_ts + or_minutes * 60
+        self.high = -np.inf
+        self.low = np.inf
+        self.complete = False
+        self.broken = False
+
+    # Returns the breakout price the first time a post-range bar trades above the range high
+    def update(self, ts, bar):
+        if ts < self.open_ts:
+            return None
+        if ts < self.end_ts:
+            self.high = max(self.high, bar[1])
+            self.low = min(self.low, bar[2])
+            return None
+        self.complete = np.isfinite(self.high)
+        if self.complete and not self.broken and bar[1] > self.high:
+            self.broken = True
+            return bar[3]
+        return None
+
+
+# Polls minute bars for a watchlist, keeps them in ring buffers and raises an
+# Alert as soon as a symbol trades above its opening-range high
+class OrbEngine:
+    def __init__(self, symbols, source, session_date, or_minutes=5, on_alert=None, capacity=400):
+        self.symbols = list(symbols)
+        self.source = source
+        open_dt = ist.localize(datetime.combine(session_date, datetime.min.time()).replace(hour=9, minute=15))
+        self.open_ts = int(open_dt.timestamp())
+        self.rings = {s: BarRing(capacity) for s in self.symbols}
+        self.ranges = {s: OpeningRange(self.open_ts, or_minutes) for s in self.symbols}
+        self.on_alert = on_alert
+        self.alerts = []
+
+    def step(self):
+        new_alerts = []
+        for symbol, bars in self.source.poll(self.symbols).items():
+            ring = self.rings.get(symbol)
+            if ring is None:
+                continue
+            for ts, bar in bars:
+                if ring.last_ts is not None and ts < ring.last_ts:
+                    continue
+                ring.append(ts, bar)
+                price = self.ranges[symbol].update(ts, bar)
+                if price is not None:
+                    alert = Alert(symbol, int(ts), float(self.ranges[symbol].high), float(price))
+                    new_alerts.append(alert)
+        self.alerts.extend(new_alerts)
+        if new_alerts and self.on_alert:
+            self.on_alert(new_alerts)
+        return new_alerts
+
+    def summary(self):
+        return {s: (r.high, r.low, r.broken) for s, r in self.ranges.items() if r.complete}
+
+
+# Live source: one yfinance download per batch of symbols per poll. Only bars
+# newer than what was already returned are handed back (plus the newest one,
+# which may still be forming).
+class YahooMinuteSource:
+    def __init__(self, batch_size=50, session=None):
+        self.batch_size = batch_size
+        self.session = session
+        self.seen = {}
+
+    def _frame_bars(self, frame):
+        frame = frame.dropna(subset=['Close'])
+        ts = frame.index.tz_convert('UTC').asi8 // 10**9
+        values = frame[['Open', 'High', 'Low', 'Close', 'Volume']].to_numpy(dtype=np.float64)
+        return list(zip(ts.tolist(), values))
+
+    def poll(self, symbols):
+        import yfinance as yf
+        bars = {}
+        for i in range(0, len(symbols), self.batch_size):
+            batch = symbols[i:i + self.batch_size]
+            try:
+                data = yf.download(batch, period='1d', interval='1m', group_by='ticker',
+                                   progress=False, threads=True, prepost=False, session=self.session)
+            except Exception as e:
+                logger.error(f"Minute bar download failed for {len(batch)} symbols: {e}")
+                continue
+            for symbol in batch:
+                try:
+                    frame = data[symbol] if hasattr(data.columns, 'levels') else data
+                    symbol_bars = self._frame_bars(frame)
+                except Exception:
+                    continue
+                last = self.seen.get(symbol)
+                if last is not None:
+                    symbol_bars = [b for b in symbol_bars if b[0] >= last]
+                if symbol_bars:
+                    self.seen[symbol] = symbol_bars[-1][0]
+                    bars[symbol] = symbol_bars
+        return bars
+
+
+# Replays a recorded tape (CSV: symbol,ts,open,high,low,close,volume); each
+# poll advances the clock by `step` seconds and returns the bars it passed
+class TapeReplayer:
+    def __init__(self, path, step=60):
+        self.step = step
+        self.bars = {}
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                bar = np.array([float(row[k]) for k in BAR_FIELDS])
+                self.bars.setdefault(row['symbol'], []).append((int(row['ts']), bar))
+        for bars in self.bars.values():
+            bars.sort(key=lambda b: b[0])
+        all_ts = [b[0] for bars in self.bars.values() for b in bars]
+        self.clock = min(all_ts) if all_ts else 0
+        self.end = max(all_ts) if all_ts else 0
+        self.cursor = {s: 0 for s in self.bars}
+
+    @property
+    def exhausted(self):
+        return self.clock > self.end
+
+    def poll(self, symbols):
+        out = {}
+        for symbol in symbols:
+            bars = self.bars.get(symbol, [])
+            start = self.cursor.get(symbol, 0)
+            end = start
+            while end < len(bars) and bars[end][0] <= self.clock:
+                end += 1
+            if end > start:
+                out[symbol] = bars[start:end]
+                self.cursor[symbol] = end
+        self.clock += self.step
+        return out
+
+
+# Wraps a live source and appends every polled bar to a tape for later replay
+class TapeRecorder:
+    def __init__(self, source, path):
+        self.source = source
+        self.path = path
+
+    def poll(self, symbols):
+        bars = self.source.poll(symbols)
+        with open(self.path, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if f.tell() == 0:
+                writer.writerow(('symbol', 'ts') + BAR_FIELDS)
+            for symbol, symbol_bars in bars.items():
+                for ts, bar in symbol_bars:
+                    writer.writerow([symbol, ts] + [float(v) for v in bar])
+        return bars
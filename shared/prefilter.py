@@ -0,0 +1,74 @@
+import os
+import logging
+import yfinance as yf
+
+from shared.screen_rules import IndicatorPanel, RuleSet
+
+logger = logging.getLogger(__name__)
+
+# Two-phase fetch: a short window for every symbol is screened on the
+# conditions that only need recent bars, and the full 1y history is then
+# downloaded only for the symbols that pass
+TWO_PHASE_FETCH = os.environ.get('TWO_PHASE_FETCH', '').lower() in ('1', 'true', 'yes')
+
+# ORB_setup: Close > Open, Volume > 1.5 * SMA(Volume, 20), RSI(14) > 40
+ORB_PREFILTER = "close > open and volume > 1.5 * sma(volume, 20) and rsi(14) > 40"
+# Swing_Str2: the volume and RSI gates
+SWING_PREFILTER = "volume > 1.5 * sma(volume, 20) and rsi(14) > 40"
+
+# SMA(Volume, 20) needs 20 bars and RSI(14) 15 closes; the 14-bar rolling
+# means make the latest values identical to those from the full history
+MIN_BARS = 21
+# Approximate size of one daily bar in Yahoo's chart response, for reporting
+BYTES_PER_BAR = 90
+FULL_PERIOD_BARS = 248
+
+
+class TwoPhaseFetch:
+    def __init__(self, rule, period="1mo", batch_size=100, min_bars=MIN_BARS, session=None, full_bars=FULL_PERIOD_BARS):
+        self.rule_set = RuleSet({'prefilter': rule})
+        self.session = session
+        self.period = period
+        self.batch_size = batch_size
+        self.min_bars = min_bars
+        self.full_bars = full_bars
+        self.short = {}      # symbol -> short-window history
+        self.rejected = set()
+        self.survivors = []
+
+    def _download(self, symbols):
+        for i in range(0, len(symbols), self.batch_size):
+            batch = symbols[i:i + self.batch_size]
+            try:
+                data = yf.download(batch, period=self.period, interval="1d", group_by='ticker', auto_adjust=False,
+                                   prepost=False, progress=False, threads=True, session=self.session)
+            except Exception as e:
+                logger.error(f"Short-window download failed for {len(batch)} symbols: {e}")
+                continue
+            for symbol in batch:
+                try:
+                    frame = data[symbol] if hasattr(data.columns, 'levels') else data
+                    frame = frame.dropna(subset=['Close'])
+                except Exception:
+                    continue
+                if not frame.empty:
+                    self.short[symbol] = frame
+
+    # Phase one; returns the symbols that need the full history. Symbols whose
+    # short window is missing or too short to decide on are kept.
+    def run(self, symbols):
+        self._download(list(symbols))
+        decidable = {s: h for s, h in self.short.items() if len(h) >= self.min_bars}
+        panel = IndicatorPanel.from_histories(decidable)
+        passed = dict(zip(panel.symbols, self.rule_set.evaluate(panel)['prefilter'])) if panel.symbols else {}
+        self.rejected = {s for s, hit in passed.items() if not hit}
+        self.survivors = [s for s in symbols if s not in self.rejected]
+        return self.survivors
+
+    def log_report(self):
+        short_bars = sum(len(h) for h in self.short.values())
+        saved_bars = sum(self.full_bars - len(self.short[s]) for s in self.rejected)
+        saved = (saved_bars - short_bars) * BYTES_PER_BAR
+        logger.info(f"Two-phase fetch: {len(self.survivors)} of {len(self.survivors) + len(self.rejected)} symbols "
+                    f"passed the short-window prefilter; about {saved / 1024:.0f} KiB of history not downloaded "
+                    f"({saved_bars} full-history bars skipped, {short_bars} short-window bars fetched)")
@@ -0,0 +1,99 @@
+import os
+import time
+import threading
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+import pandas as pd
+import yfinance as yf
+
+from shared.state import state_path
+
+logger = logging.getLogger(__name__)
+
+
+# Daily price history shared by the prefetch stage and get_stock_data. Each
+# symbol is downloaded at most once per run; concurrent callers wait for the
+# same download and errors are re-raised to every caller. A provider (such as
+# shared.bhavcopy.BhavcopyProvider) can replace the Yahoo download per symbol.
+# `session` is the requests session yfinance should use (see HttpTransport).
+# `start` (a date, see shared.lookback.LookbackPlan) replaces `period` when
+# set; `starts` overrides it per symbol and `fetched_from` records the start
+# each Yahoo download used.
+class PriceCache:
+    def __init__(self, period="1y", interval="1d", session=None, start=None):
+        self.period = period
+        self.start = start
+        self.starts = {}
+        self.fetched_from = {}
+        self.interval = interval
+        self.session = session
+        self.provider = None
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def download_yahoo(self, symbol):
+        stock = yf.Ticker(symbol, session=self.session)
+        start = self.starts.get(symbol, self.start)
+        self.fetched_from[symbol] = start
+        window = {'start': start} if start else {'period': self.period}
+        return stock.history(interval=self.interval, auto_adjust=False, prepost=False, **window)
+
+    def _download(self, symbol):
+        if self.provider is not None:
+            return self.provider(symbol)
+        return self.download_yahoo(symbol)
+
+    def history(self, symbol):
+        with self._lock:
+            future = self._futures.get(symbol)
+            owner = future is None
+            if owner:
+                future = self._futures[symbol] = Future()
+        if owner:
+            try:
+                future.set_result(self._download(symbol))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+    # Successfully downloaded, non-empty histories keyed by symbol
+    def histories(self):
+        with self._lock:
+            futures = dict(self._futures)
+        out = {}
+        for symbol, future in futures.items():
+            if future.done() and future.exception() is None and not future.result().empty:
+                out[symbol] = future.result()
+        return out
+
+    # Date of the last bar of a finished download, without starting or
+    # waiting for one; None when the symbol was not (successfully) fetched
+    def latest_date(self, symbol):
+        with self._lock:
+            future = self._futures.get(symbol)
+        if future is None or not future.done() or future.exception() is not None or future.result().empty:
+            return None
+        return future.result().index[-1].date()
+
+    def _prefetch_one(self, symbol):
+        try:
+            self.history(symbol)
+        except Exception:
+            pass  # Reported by get_stock_data when the result is used
+
+    def prefetch(self, symbols, max_workers=10, pacing=0.05):
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for symbol in symbols:
+                executor.submit(self._prefetch_one, symbol)
+                time.sleep(pacing)
+        logger.info(f"Prefetched price history for {len(symbols)} symbols in {time.time() - started:.2f}s")
+
+
+# Provider for offline runs: the daily histories kept in .state/prices/ (see
+# shared.bhavcopy) instead of a download; an empty frame when none is stored
+def stored_history(symbol):
+    path = state_path('prices', f"{symbol}.parquet")
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    return pd.read_parquet(path)
@@ -0,0 +1,108 @@
+import argparse
+import numbers
+import os
+import re
+import logging
+from datetime import datetime
+import pytz
+import pandas as pd
+
+from shared.state import state_path
+
+logger = logging.getLogger(__name__)
+
+ist = pytz.timezone('Asia/Kolkata')
+
+
+# "Volume > 1.5 * SMA_Vol20" -> "volume_gt_1_5_sma_vol20"
+def column_name(header):
+    name = header.lower().replace('>', ' gt ').replace('<', ' lt ')
+    return re.sub(r'[^a-z0-9]+', '_', name).strip('_')
+
+
+def history_dir(screen):
+    return os.path.dirname(state_path('history', screen, 'x'))
+
+
+# Turn the sheet rows (floats mixed with "Yes"/"No" strings) into typed columns:
+# Yes/No flags become bools, numbers float64/int64, everything else strings
+def to_frame(headers, rows):
+    frame = pd.DataFrame([list(r) for r in rows], columns=[column_name(h) for h in headers])
+    for col in frame.columns:
+        values = frame[col]
+        if values.isin(["Yes", "No"]).all():
+            frame[col] = values.eq("Yes")
+        elif values.isin(["Yes", "No", ""]).all() and values.ne("").any():
+            frame[col] = values.map({"Yes": True, "No": False, "": None}).astype('boolean')
+        elif all(isinstance(v, numbers.Real) and not isinstance(v, bool) for v in values):
+            if all(isinstance(v, numbers.Integral) for v in values):
+                frame[col] = values.astype('int64')
+            else:
+                frame[col] = values.astype('float64')
+        elif values.ne("").any() and all(v == "" or (isinstance(v, numbers.Real) and not isinstance(v, bool))
+                                         for v in values):
+            # Numbers with blank cells (e.g. indicators skipped by the prefilter)
+            frame[col] = pd.to_numeric(values.replace("", float("nan"))).astype('float64')
+        else:
+            frame[col] = values.astype(str)
+    return frame
+
+
+# Store one run's results under date=YYYY-MM-DD; a rerun on the same day replaces it
+def append_results(screen, headers, rows, run_date=None):
+    if not rows:
+        return None
+    run_date = run_date or datetime.now(ist).date()
+    frame = to_frame(headers, rows)
+    path = state_path('history', screen, f"date={run_date.isoformat()}", 'results.parquet')
+    frame.to_parquet(path, index=False)
+    logger.info(f"Stored {len(frame)} {screen} results for {run_date} in {path}")
+    return path
+
+
+# Load stored results, pruning partitions by date and reading only the needed columns
+def load_history(screen, days=None, columns=None, symbols=None):
+    base = history_dir(screen)
+    partitions = sorted(d for d in os.listdir(base) if d.startswith('date=')) if os.path.isdir(base) else []
+    if days is not None:
+        partitions = partitions[-days:]
+    if not partitions:
+        return pd.DataFrame()
+    frames = []
+    for partition in partitions:
+        frame = pd.read_parquet(os.path.join(base, partition, 'results.parquet'), columns=columns)
+        if symbols is not None and 'nse_symbol' in frame.columns:
+            frame = frame[frame['nse_symbol'].isin(symbols)]
+        frame.insert(0, 'date', pd.Timestamp(partition[len('date='):]))
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+
+# Symbols whose flag was set on at least `min_days` of the last `last_days` stored runs
+def symbols_meeting(screen, flag='all_conditions_met', min_days=3, last_days=5):
+    frame = load_history(screen, days=last_days, columns=['stock', flag])
+    if frame.empty:
+        return pd.Series(dtype='int64')
+    hits = frame[frame[flag]].groupby('stock').size()
+    return hits[hits >= min_days].sort_values(ascending=False)
+
+
+# Time series of one stored column (e.g. "adx_14") for a single stock
+def indicator_history(screen, stock, column, days=None):
+    frame = load_history(screen, days=days, columns=['stock', column])
+    if frame.empty:
+        return pd.Series(dtype='float64')
+    return frame[frame['stock'] == stock].set_index('date')[column]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Query stored screen results")
+    parser.add_argument('screen', help="orb_setup or swing_str2")
+    parser.add_argument('--meeting', nargs=2, type=int, metavar=('MIN_DAYS', 'LAST_DAYS'),
+                        help="symbols meeting all conditions MIN_DAYS of the last LAST_DAYS runs")
+    parser.add_argument('--history', nargs=2, metavar=('STOCK', 'COLUMN'), help="history of one column for a stock")
+    args = parser.parse_args()
+    if args.meeting:
+        print(symbols_meeting(args.screen, min_days=args.meeting[0], last_days=args.meeting[1]).to_string())
+    if args.history:
+        print(indicator_history(args.screen, *args.history).to_string())
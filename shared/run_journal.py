@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import threading
+import logging
+from datetime import date, timedelta
+
+from shared.state import state_path
+
+logger = logging.getLogger(__name__)
+
+# Append-only journal of one script's run day in
+# .state/journal/<script>/<YYYY-MM-DD>.jsonl: a line per completed symbol,
+# finished stage and delivered email. A run restarted on the same day (after a
+# crash, a runner timeout or a Sheets 429) replays it and skips whatever was
+# already done. RESUME=0 starts the day over.
+RESUME = os.environ.get('RESUME', '1').lower() not in ('0', 'false', 'no')
+JOURNAL_KEEP_DAYS = int(os.environ.get('JOURNAL_KEEP_DAYS', '7'))
+
+
+class RunJournal:
+    def __init__(self, name, run_date, resume=RESUME, path=None):
+        self.name = name
+        self.run_date = run_date
+        self.path = path or state_path('journal', name, f"{run_date.isoformat()}.jsonl")
+        self.results = {}
+        self.data_dates = {}
+        self.stages = set()
+        self.emails = set()
+        self.resumed = False
+        self._lock = threading.Lock()
+        if resume:
+            self._replay()
+        self._prune(run_date)
+        self._file = open(self.path, 'a' if resume else 'w')
+        if self._file.tell() and not self._ends_with_newline():
+            self._file.write('\n')  # Terminate the line a crash cut short
+
+    def _replay(self):
+        try:
+            with open(self.path) as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # Last line cut short by the crash
+            if entry['type'] == 'result':
+                self.results[entry['symbol']] = entry['row']
+                if entry.get('data_date'):
+                    self.data_dates[entry['symbol']] = date.fromisoformat(entry['data_date'])
+            elif entry['type'] == 'stage':
+                self.stages.add(entry['name'])
+            elif entry['type'] == 'email':
+                self.emails.add(entry['recipient'])
+        self.resumed = bool(self.results or self.stages or self.emails)
+        if self.resumed:
+            logger.info(f"Resuming {self.name} for {self.run_date}: {len(self.results)} symbols, "
+                        f"stages {sorted(self.stages)} and {len(self.emails)} emails already done")
+
+    def _ends_with_newline(self):
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def _prune(self, run_date):
+        directory = os.path.dirname(self.path)
+        oldest = (run_date - timedelta(days=JOURNAL_KEEP_DAYS)).isoformat()
+        for name in os.listdir(directory):
+            if name.endswith('.jsonl') and name[:-len('.jsonl')] < oldest:
+                os.remove(os.path.join(directory, name))
+
+    # Each entry is flushed on its own so a killed process loses at most the
+    # line being written
+    def _append(self, entry):
+        entry['time'] = time.time()
+        line = json.dumps(entry, default=lambda v: v.item()) + '\n'  # NumPy scalars
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    # `data_date` is the date of the last bar the row was computed from, kept
+    # so a resumed evening run can date replayed rows without refetching
+    def record_result(self, symbol, row, data_date=None):
+        if symbol in self.results:
+            return
+        self.results[symbol] = list(row)
+        entry = {'type': 'result', 'symbol': symbol, 'row': list(row)}
+        if data_date:
+            self.data_dates[symbol] = data_date
+            entry['data_date'] = data_date.isoformat()
+        self._append(entry)
+
+    def done(self, stage):
+        return stage in self.stages
+
+    def mark(self, stage):
+        if stage not in self.stages:
+            self.stages.add(stage)
+            self._append({'type': 'stage', 'name': stage})
+
+    def record_email(self, recipient):
+        with self._lock:
+            if recipient in self.emails:
+                return
+            self.emails.add(recipient)
+        self._append({'type': 'email', 'recipient': recipient})
+
+    def record_emails(self, recipients):
+        for recipient in recipients:
+            self.record_email(recipient)
+
+    # Recipients that have not been sent today's report yet
+    def pending(self, recipients):
+        skipped = [r for r in recipients if r in self.emails]
+        if skipped:
+            logger.info(f"Skipping {len(skipped)} recipients already emailed in an earlier attempt")
+        return [r for r in recipients if r not in self.emails]
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,375 @@
+import os
+import ast
+import json
+import math
+import logging
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from shared.timeframes import TIMEFRAMES, TimeframeCache, periods
+
+logger = logging.getLogger(__name__)
+
+EPS = np.finfo(float).eps
+FIELDS = ('open', 'high', 'low', 'close', 'volume')
+# Weight an EWM may still give its seed bar for its latest value to count as
+# converged; sets how many bars of warm-up ema/adx declare
+EWM_TOLERANCE = float(os.environ.get('EWM_TOLERANCE', '1e-4'))
+
+
+# Daily OHLCV for many symbols as 2D arrays (symbols x bars). Each symbol's
+# bars are right-aligned so column -1 is its latest bar, matching the
+# per-symbol pandas calculations; shorter histories are NaN-padded on the left.
+class IndicatorPanel:
+    def __init__(self, symbols, last_dates, fields, histories=None, timeframe_cache=None):
+        self.symbols = list(symbols)
+        self.last_dates = last_dates
+        self.fields = fields
+        self.histories = histories or {}
+        self.timeframe_cache = timeframe_cache or TimeframeCache()
+        self._timeframes = {}
+
+    @classmethod
+    def from_histories(cls, histories, bars=None, timeframe_cache=None):
+        histories = {s: h for s, h in histories.items() if h is not None and not h.empty}
+        symbols = sorted(histories)
+        width = max([len(histories[s]) for s in symbols] + [0])
+        if bars:
+            width = min(width, bars)
+        fields = {f: np.full((len(symbols), width), np.nan) for f in FIELDS}
+        for i, symbol in enumerate(symbols):
+            hist = histories[symbol].iloc[-width:] if width else histories[symbol].iloc[:0]
+            for field in FIELDS:
+                values = hist[field.title()].to_numpy(dtype=np.float64)
+                fields[field][i, width - len(values):] = values
+        last_dates = [histories[s].index[-1] for s in symbols]
+        return cls(symbols, last_dates, fields, histories, timeframe_cache)
+
+    # Weekly/monthly panel built from the daily histories on first use, plus a
+    # (symbols x daily bars) index of the higher-timeframe column each daily
+    # bar falls into (-1 where there is none)
+    def timeframe(self, name):
+        if name not in self._timeframes:
+            resampled = {s: self.timeframe_cache.get(s, self.histories[s], name) for s in self.symbols}
+            panel = IndicatorPanel.from_histories(resampled)
+            width = panel.fields['close'].shape[1]
+            daily_width = self.fields['close'].shape[1]
+            mapping = np.full((len(self.symbols), daily_width), -1, dtype=np.int64)
+            for i, symbol in enumerate(self.symbols):
+                daily_index = self.histories[symbol].index[-daily_width:] if daily_width else self.histories[symbol].index[:0]
+                position = resampled[symbol].index.get_indexer(periods(daily_index, TIMEFRAMES[name]))
+                columns = np.where(position >= 0, width - len(resampled[symbol]) + position, -1)
+                mapping[i, daily_width - len(columns):] = columns
+            self._timeframes[name] = (panel, mapping)
+        return self._timeframes[name]
+
+
+# --- vectorised indicators (axis 1 is time) matching the scripts' pandas versions ---
+
+def rolling_mean(x, n, min_periods=None):
+    min_periods = n if min_periods is None else min_periods
+    valid = ~np.isnan(x)
+    csum = np.cumsum(np.where(valid, x, 0.0), axis=1)
+    ccount = np.cumsum(valid, axis=1)
+    csum = np.concatenate([np.zeros((x.shape[0], 1)), csum], axis=1)
+    ccount = np.concatenate([np.zeros((x.shape[0], 1)), ccount], axis=1)
+    start = np.maximum(np.arange(x.shape[1]) + 1 - n, 0)
+    total = csum[:, 1:] - csum[:, start]
+    count = ccount[:, 1:] - ccount[:, start]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out = total / count
+    return np.where(count >= min_periods, out, np.nan)
+
+
+def ewm(x, span):
+    alpha = 2.0 / (span + 1.0)
+    out = np.full_like(x, np.nan)
+    prev = np.full(x.shape[0], np.nan)
+    for t in range(x.shape[1]):
+        cur = x[:, t]
+        prev = np.where(np.isnan(prev), cur, np.where(np.isnan(cur), prev, alpha * cur + (1 - alpha) * prev))
+        out[:, t] = prev
+    return out
+
+
+def shift(x, n=1):
+    out = np.full_like(x, np.nan)
+    if n < x.shape[1]:
+        out[:, n:] = x[:, :x.shape[1] - n]
+    return out
+
+
+def true_range(high, low, close):
+    prev_close = shift(close)
+    return np.fmax(np.fmax(high - low, np.abs(high - prev_close)), np.abs(low - prev_close))
+
+
+def rsi(close, period=14):
+    delta = close - shift(close)
+    gain = np.where(delta > 0, delta, np.where(np.isnan(close), np.nan, 0.0))
+    loss = np.where(delta < 0, -delta, np.where(np.isnan(close), np.nan, 0.0))
+    avg_gain = rolling_mean(gain, period, min_periods=1)
+    avg_loss = rolling_mean(loss, period, min_periods=1)
+    rs = avg_gain / np.where(avg_loss == 0, EPS, avg_loss)
+    return 100 - (100 / (1 + rs))
+
+
+def adx(high, low, close, period=14):
+    up = high - shift(high)
+    down = shift(low) - low
+    dm_plus = np.where((up > down) & (up > 0), up, 0.0)
+    dm_minus = np.where((down > up) & (down > 0), down, 0.0)
+    atr = ewm(true_range(high, low, close), period)
+    atr = np.where(atr == 0, EPS, atr)
+    di_plus = 100 * ewm(dm_plus, period) / atr
+    di_minus = 100 * ewm(dm_minus, period) / atr
+    di_sum = di_plus + di_minus
+    dx = 100 * np.abs(di_plus - di_minus) / np.where(di_sum == 0, EPS, di_sum)
+    return ewm(dx, period)
+
+
+def atr(high, low, close, period=14):
+    return rolling_mean(true_range(high, low, close), period, min_periods=1)
+
+
+# End point of the least-squares line over the last n bars, via rolling sums
+def regression(y, n=200):
+    k = np.arange(y.shape[1], dtype=np.float64)
+    valid = ~np.isnan(y)
+    y0 = np.where(valid, y, 0.0)
+
+    def window_sum(v):
+        c = np.concatenate([np.zeros((v.shape[0], 1)), np.cumsum(v, axis=1)], axis=1)
+        out = np.full(v.shape, np.nan)
+        out[:, n - 1:] = c[:, n:] - c[:, :-n]
+        return out
+
+    sum_y = window_sum(y0)
+    sum_ky = window_sum(y0 * k)
+    count = window_sum(valid.astype(np.float64))
+    first = k - (n - 1)
+    sum_xy = sum_ky - first * sum_y  # x runs 0..n-1 inside each window
+    sum_x = n * (n - 1) / 2.0
+    sum_xx = (n - 1) * n * (2 * n - 1) / 6.0
+    slope = (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x ** 2)
+    intercept = (sum_y - slope * sum_x) / n
+    return np.where(count == n, slope * (n - 1) + intercept, np.nan)
+
+
+def rolling_extreme(x, n, fn):
+    out = np.full_like(x, np.nan)
+    if x.shape[1] >= n:
+        out[:, n - 1:] = fn(sliding_window_view(x, n, axis=1), axis=2)
+    return out
+
+
+# Functions usable in rules; each receives the panel first so price-based
+# indicators (rsi/adx/atr) can default to its OHLC fields
+FUNCTIONS = {
+    'sma': lambda p, x, n: rolling_mean(x, int(n)),
+    'ema': lambda p, x, n: ewm(x, int(n)),
+    'shift': lambda p, x, n=1: shift(x, int(n)),
+    'highest': lambda p, x, n: rolling_extreme(x, int(n), np.max),
+    'lowest': lambda p, x, n: rolling_extreme(x, int(n), np.min),
+    'regression': lambda p, x, n=200: regression(x, int(n)),
+    'abs': lambda p, x: np.abs(x),
+    'rsi': lambda p, *a: rsi(a[0], int(a[1])) if len(a) == 2 else rsi(p.fields['close'], int(a[0]) if a else 14),
+    'adx': lambda p, n=14: adx(p.fields['high'], p.fields['low'], p.fields['close'], int(n)),
+    'atr': lambda p, n=14: atr(p.fields['high'], p.fields['low'], p.fields['close'], int(n)),
+}
+
+
+
+# Bars until the seed's weight (1 - alpha)^k drops below `tolerance`
+def ewm_warmup(span, tolerance=EWM_TOLERANCE):
+    alpha = 2.0 / (span + 1.0)
+    return int(math.ceil(math.log(tolerance) / math.log(1 - alpha)))
+
+
+# Bars each function needs from its input series to produce its latest value
+LOOKBACK = {
+    'sma': lambda n: int(n),
+    'ema': lambda n: ewm_warmup(n),
+    'shift': lambda n=1: int(n) + 1,
+    'highest': lambda n: int(n),
+    'lowest': lambda n: int(n),
+    'regression': lambda n=200: int(n),
+    'abs': lambda: 1,
+    'rsi': lambda n=14: int(n) + 1,
+    'adx': lambda n=14: 2 * ewm_warmup(n) + 1,  # EWM of DX, itself built from EWMs of the true range and DMs
+    'atr': lambda n=14: int(n) + 1,
+}
+# Daily bars per weekly/monthly bar
+TIMEFRAME_BARS = {'weekly': 5, 'monthly': 21}
+
+
+# Daily bars an expression needs for its latest value. With
+# expand_timeframes=False a weekly()/monthly() term only needs the latest
+# daily bar (its own bars come from the timeframe cache).
+def lookback(node, expand_timeframes=True):
+    if isinstance(node, ast.Constant):
+        return 0
+    if isinstance(node, ast.Name):
+        return 1
+    if isinstance(node, ast.Call):
+        if node.func.id in TIMEFRAMES:
+            if not expand_timeframes:
+                return 1
+            per_bar = TIMEFRAME_BARS[node.func.id]
+            return lookback(node.args[0]) * per_bar + per_bar  # plus the unfinished current period
+        series = [lookback(arg, expand_timeframes) for arg in node.args if not isinstance(arg, ast.Constant)]
+        constants = [arg.value for arg in node.args if isinstance(arg, ast.Constant)]
+        return max(series or [1]) + LOOKBACK[node.func.id](*constants) - 1
+    return max([lookback(child, expand_timeframes) for child in ast.iter_child_nodes(node)] or [0])
+
+
+# Weekly/monthly bars the expression's timeframe terms need, per timeframe
+def timeframe_lookback(node):
+    needs = {}
+    for child in ast.walk(node):
+        if isinstance(child, ast.Call) and child.func.id in TIMEFRAMES:
+            bars = lookback(child.args[0]) + 1  # plus the unfinished current period
+            needs[child.func.id] = max(needs.get(child.func.id, 0), bars)
+    return needs
+
+
+BINARY_OPS = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide}
+COMPARE_OPS = {ast.Gt: np.greater, ast.GtE: np.greater_equal, ast.Lt: np.less,
+               ast.LtE: np.less_equal, ast.Eq: np.equal, ast.NotEq: np.not_equal}
+
+
+class RuleError(ValueError):
+    pass
+
+
+# Screens written as expressions, e.g.
+#   close > sma(close, 200) and adx(14) > 25 and volume > 1.5 * sma(volume, 20)
+#   weekly(close > sma(close, 30)) and monthly(close > ema(close, 10))
+# Every rule is parsed once; evaluation walks the expression trees over a
+# panel and caches each distinct sub-expression, so indicators shared between
+# rules are computed a single time per run.
+class RuleSet:
+    def __init__(self, rules):
+        self.rules = {}
+        for name, expression in rules.items():
+            try:
+                tree = ast.parse(expression, mode='eval').body
+            except SyntaxError as e:
+                raise RuleError(f"Rule '{name}' does not parse: {e}") from None
+            self._validate(name, tree)
+            self.rules[name] = tree
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def _validate(self, name, node):
+        allowed = (ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.BinOp, ast.Compare,
+                   ast.Call, ast.Name, ast.Load, ast.Constant) + tuple(BINARY_OPS) + tuple(COMPARE_OPS)
+        call_names = {id(c.func) for c in ast.walk(node) if isinstance(c, ast.Call)}
+        for child in ast.walk(node):
+            if not isinstance(child, allowed):
+                raise RuleError(f"Rule '{name}': unsupported syntax {type(child).__name__}")
+            if isinstance(child, ast.Call) and (not isinstance(child.func, ast.Name) or
+                                                child.func.id not in FUNCTIONS and child.func.id not in TIMEFRAMES):
+                raise RuleError(f"Rule '{name}': unknown function {ast.unparse(child.func)}")
+            if isinstance(child, ast.Name) and id(child) not in call_names and child.id not in FIELDS:
+                raise RuleError(f"Rule '{name}': unknown field '{child.id}'")
+
+    def _eval(self, node, panel, cache):
+        key = ast.dump(node)
+        if key in cache:
+            self.cache_hits += 1
+            return cache[key]
+        self.cache_misses += 1
+        if isinstance(node, ast.Constant):
+            value = node.value
+        elif isinstance(node, ast.Name):
+            value = panel.fields[node.id]
+        elif isinstance(node, ast.BinOp):
+            with np.errstate(invalid='ignore', divide='ignore'):
+                value = BINARY_OPS[type(node.op)](self._eval(node.left, panel, cache), self._eval(node.right, panel, cache))
+        elif isinstance(node, ast.UnaryOp):
+            operand = self._eval(node.operand, panel, cache)
+            value = np.logical_not(operand) if isinstance(node.op, ast.Not) else -operand
+        elif isinstance(node, ast.BoolOp):
+            combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            value = self._eval(node.values[0], panel, cache)
+            for child in node.values[1:]:
+                value = combine(value, self._eval(child, panel, cache))
+        elif isinstance(node, ast.Compare):
+            left = self._eval(node.left, panel, cache)
+            value = True
+            for op, comparator in zip(node.ops, node.comparators):
+                right = self._eval(comparator, panel, cache)
+                with np.errstate(invalid='ignore'):
+                    value = np.logical_and(value, COMPARE_OPS[type(op)](left, right))
+                left = right
+        elif node.func.id in TIMEFRAMES:
+            # weekly(expr) / monthly(expr): evaluate on the resampled panel and
+            # give every daily bar the value of the period it belongs to
+            sub_panel, mapping = panel.timeframe(node.func.id)
+            sub_cache = cache.setdefault(f"timeframe:{node.func.id}", {})
+            sub_value = np.broadcast_to(self._eval(node.args[0], sub_panel, sub_cache), sub_panel.fields['close'].shape)
+            if sub_value.shape[1] == 0:
+                value = np.full(mapping.shape, np.nan)
+            else:
+                value = np.take_along_axis(sub_value, np.clip(mapping, 0, None), axis=1)
+            value = np.where(mapping >= 0, value, False if value.dtype == bool else np.nan)
+        else:  # ast.Call
+            args = [self._eval(arg, panel, cache) for arg in node.args]
+            value = FUNCTIONS[node.func.id](panel, *args)
+        cache[key] = value
+        return value
+
+    # Daily bars each rule needs for its latest value; see lookback()
+    def lookback(self, expand_timeframes=True):
+        return {name: lookback(tree, expand_timeframes) for name, tree in self.rules.items()}
+
+    # Weekly/monthly bars each rule needs, per timeframe
+    def timeframe_lookback(self):
+        return {name: timeframe_lookback(tree) for name, tree in self.rules.items()}
+
+    # Boolean mask per rule over the whole panel (symbols x bars)
+    def evaluate_history(self, panel):
+        cache = {}
+        masks = {}
+        for name, tree in self.rules.items():
+            mask = np.broadcast_to(self._eval(tree, panel, cache), panel.fields['close'].shape)
+            masks[name] = np.asarray(mask, dtype=bool)
+        return masks
+
+    # Boolean mask per rule for the latest bar of every symbol
+    def evaluate(self, panel):
+        if not panel.symbols:
+            return {name: np.zeros(0, dtype=bool) for name in self.rules}
+        return {name: mask[:, -1] for name, mask in self.evaluate_history(panel).items()}
+
+    def matches(self, panel):
+        return {name: [s for s, hit in zip(panel.symbols, mask) if hit] for name, mask in self.evaluate(panel).items()}
+
+
+def load_rules(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+# Run every rule file screen over the already-fetched histories and log the hits
+# (a persisted `timeframe_cache` keeps weekly/monthly bars beyond the daily window)
+def run_screens(rules_path, histories, timeframe_cache=None):
+    rule_set = RuleSet(load_rules(rules_path))
+    panel = IndicatorPanel.from_histories(histories, timeframe_cache=timeframe_cache)
+    results = rule_set.matches(panel)
+    width = panel.fields['close'].shape[1]
+    for name, bars in rule_set.lookback(expand_timeframes=False).items():
+        if bars > width:
+            logger.warning(f"Screen '{name}' needs {bars} daily bars for converged values; the histories have {width}")
+    for name, needs in rule_set.timeframe_lookback().items():
+        for timeframe, bars in needs.items():
+            available = panel.timeframe(timeframe)[0].fields['close'].shape[1] if panel.symbols else 0
+            if bars > available:
+                logger.warning(f"Screen '{name}' needs {bars} {timeframe} bars for converged values; "
+                               f"the {timeframe} histories have {available}")
+    for name, symbols in results.items():
+        logger.info(f"Screen '{name}': {len(symbols)} of {len(panel.symbols)} symbols match {symbols[:10]}")
+    logger.info(f"Evaluated {len(results)} screens with {rule_set.cache_misses} distinct sub-expressions "
+                f"({rule_set.cache_hits} shared)")
+    return results
@@ -0,0 +1,92 @@
+import os
+import json
+import time
+import zlib
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from shared.state import state_path
+
+logger = logging.getLogger(__name__)
+
+# Slowly changing sheet inputs (the symbol list, the recipient list) are kept
+# in .state/inputs/. With SHEET_INPUTS_CHECKSUM_CELL pointing at a checksum
+# cell maintained in the sheet (for example
+# =COUNTA(Sheet1!B4:B)&"-"&SUMPRODUCT(LEN(Sheet1!B4:B))&"-"&COUNTA(credential!D3:D))
+# they are only re-read when it changes. Without one the ranges are read on
+# every run (the Drive modifiedTime is no use: each run's own writes bump it)
+# and the stored copy only stands in when Sheets is slow or failing.
+SHEET_INPUTS_CHECKSUM_CELL = os.environ.get('SHEET_INPUTS_CHECKSUM_CELL')
+SHEET_INPUTS_TIMEOUT = float(os.environ.get('SHEET_INPUTS_TIMEOUT', '5'))
+
+
+# First-column values of each range, keyed like `ranges`, e.g.
+# SheetInputs(client, sheet_id, {'symbols': 'Sheet1!B4:B'}).load()['symbols']
+class SheetInputs:
+    def __init__(self, client, spreadsheet_id, ranges, checksum_cell=SHEET_INPUTS_CHECKSUM_CELL,
+                 timeout=SHEET_INPUTS_TIMEOUT, path=None):
+        self.client = client
+        self.spreadsheet_id = spreadsheet_id
+        self.ranges = dict(ranges)
+        self.checksum_cell = checksum_cell
+        self.timeout = timeout
+        key = zlib.crc32(json.dumps(self.ranges, sort_keys=True).encode())
+        self.path = path or state_path('inputs', f"{spreadsheet_id}-{key:08x}.json")
+        self.source = None  # 'cache', 'sheet' or 'stale-cache' after load()
+
+    def _read_cache(self):
+        try:
+            with open(self.path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cached.get('ranges') != self.ranges:
+            return None
+        return cached
+
+    def _write_cache(self, revision, values):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'ranges': self.ranges, 'revision': revision, 'values': values, 'fetched_at': time.time()}, f)
+        os.replace(tmp, self.path)
+
+    # Checksum cell value, or None when no cell is configured
+    def revision(self):
+        if not self.checksum_cell:
+            return None
+        response = self.client.http_client.values_get(self.spreadsheet_id, self.checksum_cell)
+        return f"cell:{response.get('values', [['']])[0][0]}"
+
+    def _fetch(self):
+        names = list(self.ranges)
+        response = self.client.http_client.values_batch_get(self.spreadsheet_id, [self.ranges[n] for n in names])
+        return {name: [row[0] if row else '' for row in value_range.get('values', [])]
+                for name, value_range in zip(names, response['valueRanges'])}
+
+    def _refresh(self, cached):
+        revision = self.revision()
+        if cached and revision is not None and cached['revision'] == revision:
+            return cached['values'], 'cache'
+        values = self._fetch()
+        self._write_cache(revision, values)
+        return values, 'sheet'
+
+    def load(self):
+        cached = self._read_cache()
+        if cached is None:
+            values, self.source = self._refresh(None)
+        else:
+            # Do not let a slow Sheets response hold up the run when a copy exists
+            executor = ThreadPoolExecutor(max_workers=1)
+            future = executor.submit(self._refresh, cached)
+            executor.shutdown(wait=False)
+            try:
+                values, self.source = future.result(timeout=self.timeout)
+            except FutureTimeout:
+                logger.warning(f"Sheets did not answer within {self.timeout:g}s, using cached inputs")
+                values, self.source = cached['values'], 'stale-cache'
+            except Exception as e:
+                logger.warning(f"Could not validate cached inputs ({e}), using cached copy")
+                values, self.source = cached['values'], 'stale-cache'
+        logger.info(f"Loaded sheet inputs ({', '.join(f'{n}: {len(v)}' for n, v in values.items())}) from {self.source}")
+        return values
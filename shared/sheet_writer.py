@@ -0,0 +1,285 @@
+import json
+import os
+import time
+import zlib
+import threading
+import logging
+from gspread.utils import rowcol_to_a1, ValueInputOption, ValueRenderOption
+
+logger = logging.getLogger(__name__)
+
+# Streaming Calculation writes flush after this many completed rows or seconds
+STREAM_CHUNK_ROWS = int(os.environ.get('CALC_STREAM_CHUNK_ROWS', '25'))
+STREAM_FLUSH_SECONDS = float(os.environ.get('CALC_STREAM_FLUSH_SECONDS', '5'))
+
+
+# Normalise a cell so values we wrote (floats/ints) compare equal to what the
+# sheet hands back with UNFORMATTED_VALUE rendering
+def _cell_key(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return str(value).upper()
+    if isinstance(value, (int, float)):
+        return float(value)
+    return str(value)
+
+
+def _pad(rows, width):
+    return [list(row) + [""] * (width - len(row)) for row in rows]
+
+
+# Fingerprint of a row as the sheet would compare it, so only hashes of what
+# was sent need to be kept
+def _row_hash(row):
+    return zlib.crc32(json.dumps([_cell_key(value) for value in row]).encode())
+
+
+def _load_cached_rows(cache_path, geometry):
+    if not cache_path or not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable sheet cache {cache_path}: {e}")
+        return None
+    if cached.get('geometry') != geometry:
+        return None
+    return cached.get('rows', [])
+
+
+def _save_cached_rows(cache_path, geometry, rows):
+    if not cache_path:
+        return
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        # Row by row, so `rows` can be a generator
+        f.write('{"geometry": ' + json.dumps(geometry) + ', "rows": [')
+        for i, row in enumerate(rows):
+            f.write((', ' if i else '') + json.dumps(row, default=float))
+        f.write(']}')
+    os.replace(tmp_path, cache_path)
+
+
+# Order result rows by the symbol list so every symbol keeps a fixed row;
+# symbols without data get a blank row instead of shifting everything below
+def order_rows(results_by_symbol, symbols, width):
+    return [list(results_by_symbol.get(symbol) or [""] * width) for symbol in symbols]
+
+
+# Compute the changed cell ranges between two row blocks. Each changed row
+# contributes the span between its first and last changed column; vertically
+# adjacent rows with the same span are merged into one rectangle.
+def diff_ranges(old_rows, new_rows, start_row, first_col):
+    width = max([len(r) for r in new_rows] + [len(r) for r in old_rows] + [1])
+    old_rows = _pad(old_rows, width)
+    new_rows = _pad(new_rows, width)
+
+    spans = []
+    for i, row in enumerate(new_rows):
+        old = old_rows[i] if i < len(old_rows) else [""] * width
+        changed = [j for j in range(width) if _cell_key(row[j]) != _cell_key(old[j])]
+        if changed:
+            spans.append((i, changed[0], changed[-1]))
+
+    ranges = []
+    for i, lo, hi in spans:
+        if ranges and ranges[-1]['last'] == i - 1 and ranges[-1]['lo'] == lo and ranges[-1]['hi'] == hi:
+            ranges[-1]['last'] = i
+        else:
+            ranges.append({'first': i, 'last': i, 'lo': lo, 'hi': hi})
+
+    updates = []
+    for r in ranges:
+        a1 = (rowcol_to_a1(start_row + r['first'], first_col + r['lo']) + ':' +
+              rowcol_to_a1(start_row + r['last'], first_col + r['hi']))
+        values = [new_rows[i][r['lo']:r['hi'] + 1] for i in range(r['first'], r['last'] + 1)]
+        updates.append({'range': a1, 'values': values})
+
+    stale_clear = None
+    if len(old_rows) > len(new_rows):
+        stale_clear = (rowcol_to_a1(start_row + len(new_rows), first_col) + ':' +
+                       rowcol_to_a1(start_row + len(old_rows) - 1, first_col + width - 1))
+    return updates, stale_clear
+
+
+# Previous block contents: local cache first, otherwise a single read of the
+# columns down to the end of the sheet, or of `max_rows` rows for a block of
+# fixed height
+def read_previous_rows(sheet, start_row, first_col, width, cache_path=None, max_rows=None):
+    geometry = [sheet.spreadsheet.id, sheet.title, start_row, first_col, width]
+    cached = _load_cached_rows(cache_path, geometry)
+    if cached is not None:
+        return cached[:max_rows] if max_rows else cached
+    top_left = rowcol_to_a1(start_row, first_col)
+    bottom_right = rowcol_to_a1(start_row + (max_rows or 1) - 1, first_col + width - 1)
+    if not max_rows:
+        bottom_right = bottom_right.rstrip('0123456789')
+    try:
+        rows = sheet.get(f"{top_left}:{bottom_right}", value_render_option=ValueRenderOption.unformatted)
+        logger.info(f"Read {len(rows)} existing rows from {sheet.title} for diffing")
+        return _pad(rows, width)
+    except Exception as e:
+        logger.warning(f"Could not read existing rows from {sheet.title}, rewriting block: {e}")
+        return []
+
+
+# Write only the cells that differ from the previous run and clear rows that
+# fell off the end of the block. A fixed block (clear_stale=False, e.g. the
+# header rows above the data) only reads and diffs its own rows and never
+# clears anything below them. Returns the number of cells sent.
+def write_rows_diff(sheet, rows, start_row, first_col, cache_path=None, clear_stale=True):
+    width = max([len(r) for r in rows] + [1])
+    rows = _pad(rows, width)
+    geometry = [sheet.spreadsheet.id, sheet.title, start_row, first_col, width]
+    old_rows = read_previous_rows(sheet, start_row, first_col, width, cache_path,
+                                  max_rows=None if clear_stale else len(rows))
+
+    updates, stale_clear = diff_ranges(old_rows, rows, start_row, first_col)
+    if not clear_stale:
+        stale_clear = None
+    cells_sent = sum(len(u['values']) * len(u['values'][0]) for u in updates)
+    if updates:
+        sheet.batch_update(updates, value_input_option=ValueInputOption.raw)
+    if stale_clear:
+        sheet.batch_clear([stale_clear])
+    logger.info(f"{sheet.title}: wrote {len(updates)} changed ranges ({cells_sent} of {len(rows) * width} cells)"
+                + (f", cleared stale rows {stale_clear}" if stale_clear else ""))
+
+    _save_cached_rows(cache_path, geometry, json.loads(json.dumps(rows, default=float)))
+    return cells_sent
+
+
+# Writes result rows to their fixed positions while the fetch is still running.
+# Completed rows are buffered and flushed as one batch_update of the changed
+# rows once `chunk_rows` are pending or the oldest has waited `flush_seconds`
+# (a background thread covers the slow tail). Only a hash per row of what the
+# sheet holds is kept, so memory is the pending chunk plus one integer per
+# symbol. finish() is the consistency pass: it walks the final block row by
+# row against those hashes, blanks symbols that never completed, clears rows
+# past the end and saves the cache.
+class StreamingRowWriter:
+    def __init__(self, sheet, symbols, width, start_row, first_col, cache_path=None,
+                 chunk_rows=STREAM_CHUNK_ROWS, flush_seconds=STREAM_FLUSH_SECONDS):
+        self.sheet = sheet
+        self.symbols = list(symbols)
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.width = width
+        self.start_row = start_row
+        self.first_col = first_col
+        self.cache_path = cache_path
+        self.chunk_rows = chunk_rows
+        self.flush_seconds = flush_seconds
+        self.geometry = [sheet.spreadsheet.id, sheet.title, start_row, first_col, width]
+        old_rows = _pad(read_previous_rows(sheet, start_row, first_col, width, cache_path), width)
+        # The cache stops describing the sheet once the first chunk lands; drop it
+        # until finish() so an interrupted run re-reads the block next time
+        if cache_path and os.path.exists(cache_path):
+            os.remove(cache_path)
+        # Hashes of what the sheet holds as far as we know; diffs are taken against them
+        blank = _row_hash([""] * width)
+        self.sent = [_row_hash(row) for row in old_rows] + [blank] * (len(self.symbols) - len(old_rows))
+        self.old_length = len(old_rows)
+        del old_rows
+        self.pending = {}
+        self.oldest_pending = None
+        self.flushes = 0
+        self.cells_sent = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_on_timer, daemon=True)
+        self._flusher.start()
+
+    # Write the rows (index -> row) whose hash differs from what was sent, one
+    # range per run of adjacent rows
+    def _send(self, rows):
+        updates = []
+        hashes = {}
+        for i in sorted(rows):
+            row_hash = _row_hash(rows[i])
+            if row_hash == self.sent[i]:
+                continue
+            if updates and updates[-1]['last'] == i - 1:
+                updates[-1]['values'].append(rows[i])
+                updates[-1]['last'] = i
+            else:
+                updates.append({'first': i, 'last': i, 'values': [rows[i]]})
+            hashes[i] = row_hash
+        updates = [{'range': rowcol_to_a1(self.start_row + u['first'], self.first_col) + ':' +
+                             rowcol_to_a1(self.start_row + u['last'], self.first_col + self.width - 1),
+                    'values': u['values']} for u in updates]
+        if updates:
+            self.sheet.batch_update(updates, value_input_option=ValueInputOption.raw)
+            self.cells_sent += sum(len(u['values']) * self.width for u in updates)
+        for i, row_hash in hashes.items():
+            self.sent[i] = row_hash
+        return updates
+
+    def _flush_locked(self):
+        if not self.pending:
+            return
+        pending = self.pending
+        self.pending = {}
+        self.oldest_pending = None
+        updates = self._send(pending)
+        rows = len(pending)
+        self.flushes += 1
+        logger.info(f"{self.sheet.title}: streamed {rows} completed rows in {len(updates)} ranges")
+
+    def _flush_on_timer(self):
+        while not self._stop.wait(min(1.0, self.flush_seconds)):
+            with self._lock:
+                if self.oldest_pending is not None and time.monotonic() - self.oldest_pending >= self.flush_seconds:
+                    try:
+                        self._flush_locked()
+                    except Exception as e:
+                        logger.warning(f"Streaming write to {self.sheet.title} failed, left for the final pass: {e}")
+
+    def add(self, symbol, row):
+        i = self.index.get(symbol)
+        if i is None:
+            return
+        with self._lock:
+            self.pending[i] = _pad([row], self.width)[0]
+            if self.oldest_pending is None:
+                self.oldest_pending = time.monotonic()
+            if len(self.pending) >= self.chunk_rows:
+                try:
+                    self._flush_locked()
+                except Exception as e:
+                    logger.warning(f"Streaming write to {self.sheet.title} failed, left for the final pass: {e}")
+
+    # Stop the timer thread, dropping anything still pending
+    def close(self):
+        self._stop.set()
+        self._flusher.join()
+        with self._lock:
+            self.pending = {}
+
+    # Final rows in symbol order, one at a time
+    def _final_rows(self, results_by_symbol):
+        for symbol in self.symbols:
+            yield _pad([results_by_symbol.get(symbol) or []], self.width)[0]
+
+    def finish(self, results_by_symbol):
+        self.close()
+        with self._lock:
+            updates = []
+            chunk = {}
+            for i, row in enumerate(self._final_rows(results_by_symbol)):
+                chunk[i] = row
+                if len(chunk) >= self.chunk_rows:
+                    updates += self._send(chunk)
+                    chunk = {}
+            updates += self._send(chunk)
+            stale_clear = None
+            if self.old_length > len(self.symbols):
+                stale_clear = (rowcol_to_a1(self.start_row + len(self.symbols), self.first_col) + ':' +
+                               rowcol_to_a1(self.start_row + self.old_length - 1, self.first_col + self.width - 1))
+                self.sheet.batch_clear([stale_clear])
+        logger.info(f"{self.sheet.title}: {self.flushes} streamed chunks, final pass wrote {len(updates)} ranges; "
+                    f"{self.cells_sent} of {len(self.symbols) * self.width} cells sent"
+                    + (f", cleared stale rows {stale_clear}" if stale_clear else ""))
+        _save_cached_rows(self.cache_path, self.geometry, self._final_rows(results_by_symbol))
+        return self.cells_sent
@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import argparse
+import threading
+import logging
+from collections import Counter, deque
+from functools import partial
+import gspread
+from gspread.exceptions import APIError
+from gspread.http_client import HTTPClient
+
+logger = logging.getLogger(__name__)
+
+# Per-minute Sheets API budget for one run. The API's default per-user limits
+# are 60 reads and 60 writes a minute; both can be raised via the environment.
+SHEETS_READS_PER_MINUTE = int(os.environ.get('SHEETS_READS_PER_MINUTE', '60'))
+SHEETS_WRITES_PER_MINUTE = int(os.environ.get('SHEETS_WRITES_PER_MINUTE', '60'))
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+# Sliding one-minute window of request timestamps; acquire() waits for a free
+# slot instead of letting the API answer 429
+class QuotaWindow:
+    def __init__(self, limit, period=60.0, clock=time.monotonic, sleep=time.sleep):
+        self.limit = limit
+        self.period = period
+        self.clock = clock
+        self.sleep = sleep
+        self.sent = deque()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self.sent and now - self.sent[0] >= self.period:
+            self.sent.popleft()
+
+    def headroom(self):
+        with self._lock:
+            self._expire(self.clock())
+            return self.limit - len(self.sent)
+
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._expire(now)
+                if len(self.sent) < self.limit:
+                    self.sent.append(now)
+                    return waited
+                delay = self.period - (now - self.sent[0])
+            self.sleep(delay)
+            waited += delay
+
+
+# Read/write accounting shared by every gspread call in a run
+class SheetsQuota:
+    def __init__(self, reads_per_minute=SHEETS_READS_PER_MINUTE, writes_per_minute=SHEETS_WRITES_PER_MINUTE,
+                 max_retries=5, backoff=2.0, max_backoff=64.0, clock=time.monotonic, sleep=time.sleep):
+        self.windows = {
+            'read': QuotaWindow(reads_per_minute, clock=clock, sleep=sleep),
+            'write': QuotaWindow(writes_per_minute, clock=clock, sleep=sleep),
+        }
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self.requests = Counter()
+        self.retries = Counter()
+        self.errors = Counter()
+        self.waited = 0.0
+
+    @staticmethod
+    def classify(method):
+        return 'read' if method.lower() == 'get' else 'write'
+
+    def acquire(self, kind):
+        waited = self.windows[kind].acquire()
+        with self._lock:
+            self.requests[kind] += 1
+            self.waited += waited
+
+    def retry_delay(self, attempt, error):
+        retry_after = error.response.headers.get('Retry-After') if error.response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return min(self.backoff * 2 ** attempt, self.max_backoff)
+
+    def record_retry(self, kind, code):
+        with self._lock:
+            self.retries[(kind, code)] += 1
+
+    def record_error(self, kind, code):
+        with self._lock:
+            self.errors[(kind, code)] += 1
+
+    def report(self):
+        return {
+            'reads': self.requests['read'],
+            'writes': self.requests['write'],
+            'retries': sum(self.retries.values()),
+            'errors': sum(self.errors.values()),
+            'throttled_seconds': round(self.waited, 2),
+        }
+
+    def log_report(self):
+        r = self.report()
+        logger.info(f"Sheets API usage: {r['reads']} reads, {r['writes']} writes, {r['retries']} retries, "
+                    f"{r['errors']} errors, {r['throttled_seconds']}s waiting for quota")
+        for (kind, code), count in sorted(self.retries.items()):
+            logger.info(f"  retried {count} {kind} request(s) after HTTP {code}")
+
+
+# gspread HTTP client that charges every request against a SheetsQuota and
+# retries 429/5xx responses with exponential backoff (honouring Retry-After)
+class QuotaHTTPClient(HTTPClient):
+    def __init__(self, auth, session=None, quota=None):
+        super().__init__(auth, session)
+        self.quota = quota or SheetsQuota()
+
+    def request(self, method, endpoint, *args, **kwargs):
+        kind = self.quota.classify(method)
+        attempt = 0
+        while True:
+            self.quota.acquire(kind)
+            try:
+                return super().request(method, endpoint, *args, **kwargs)
+            except APIError as e:
+                if e.code not in RETRY_STATUS or attempt >= self.quota.max_retries:
+                    self.quota.record_error(kind, e.code)
+                    raise
+                self.quota.record_retry(kind, e.code)
+                delay = self.quota.retry_delay(attempt, e)
+                logger.warning(f"Sheets {kind} got HTTP {e.code}, retrying in {delay:.0f}s")
+                self.quota.sleep(delay)
+                attempt += 1
+
+
+# Drop-in for gspread.authorize; the returned client carries its quota as .quota.
+# With a transport, requests share its pooled session and timeouts.
+def authorize(credentials, quota=None, session=None, transport=None):
+    quota = quota or SheetsQuota()
+    if transport is not None and session is None:
+        session = transport.authorized_session(credentials)
+    client = gspread.authorize(credentials, http_client=partial(QuotaHTTPClient, quota=quota), session=session)
+    if transport is not None:
+        client.set_timeout(transport.timeout)
+    client.quota = quota
+    return client
+
+
+# Collects value writes for one worksheet and sends them as a single
+# batch_clear plus one batch_update per value input option when the block
+# exits, instead of one request per update() call
+class CoalescedWrites:
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self.clears = []
+        self.updates = {}
+
+    def batch_clear(self, ranges):
+        self.clears.extend(ranges)
+
+    def update(self, range_name, values, value_input_option='RAW'):
+        self.updates.setdefault(value_input_option, []).append({'range': range_name, 'values': values})
+
+    def flush(self):
+        if self.clears:
+            self.worksheet.batch_clear(self.clears)
+        for option, data in self.updates.items():
+            self.worksheet.batch_update(data, value_input_option=option)
+        self.clears, self.updates = [], {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        return False
+
+
+# Fake requests session standing in for the Sheets API: it answers every call
+# with an empty JSON body but returns 429 once more than the allowed number of
+# reads or writes land inside one minute, like the real quota does
+class QuotaEnforcingSession:
+    def __init__(self, reads_per_minute=60, writes_per_minute=60, clock=time.monotonic, fail_every=0):
+        self.limits = {'read': reads_per_minute, 'write': writes_per_minute}
+        self.clock = clock
+        self.fail_every = fail_every
+        self.calls = Counter()
+        self.rejected = Counter()
+        self.history = {'read': deque(), 'write': deque()}
+
+    def request(self, method, url, **kwargs):
+        import requests
+        kind = SheetsQuota.classify(method)
+        now = self.clock()
+        window = self.history[kind]
+        while window and now - window[0] >= 60:
+            window.popleft()
+        self.calls[kind] += 1
+        response = requests.Response()
+        response.url = url
+        if len(window) >= self.limits[kind]:
+            self.rejected[kind] += 1
+            status, body = 429, {'error': {'code': 429, 'message': 'Quota exceeded', 'status': 'RESOURCE_EXHAUSTED'}}
+        elif self.fail_every and sum(self.calls.values()) % self.fail_every == 0:
+            window.append(now)
+            status, body = 503, {'error': {'code': 503, 'message': 'Backend error', 'status': 'UNAVAILABLE'}}
+        else:
+            window.append(now)
+            status, body = 200, {}
+        response.status_code = status
+        response._content = json.dumps(body).encode()
+        return response
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 0)
+
+
+# Push a burst of reads and writes through the quota-aware client against the
+# fake backend on a virtual clock and report what it had to do
+def simulate(reads, writes, quota_reads, quota_writes, backend_reads, backend_writes, fail_every=0):
+    clock = VirtualClock()
+    session = QuotaEnforcingSession(backend_reads, backend_writes, clock=clock, fail_every=fail_every)
+    quota = SheetsQuota(quota_reads, quota_writes, clock=clock, sleep=clock.sleep)
+    http = QuotaHTTPClient(None, session=session, quota=quota)
+    url = 'https://sheets.googleapis.com/v4/spreadsheets/fake'
+    for i in range(max(reads, writes)):
+        if i < reads:
+            http.request('get', url + '/values/A1')
+        if i < writes:
+            http.request('post', url + '/values:batchUpdate', json={})
+    return {**quota.report(), 'elapsed_seconds': clock.now, 'backend_rejected': dict(session.rejected)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exercise the Sheets quota client against a fake quota-enforcing backend")
+    parser.add_argument('--reads', type=int, default=150)
+    parser.add_argument('--writes', type=int, default=150)
+    parser.add_argument('--quota-reads', type=int, default=SHEETS_READS_PER_MINUTE)
+    parser.add_argument('--quota-writes', type=int, default=SHEETS_WRITES_PER_MINUTE)
+    parser.add_argument('--backend-reads', type=int, default=60)
+    parser.add_argument('--backend-writes', type=int, default=60)
+    parser.add_argument('--fail-every', type=int, default=0, help="make every Nth request a 503")
+    args = parser.parse_args()
+    print(json.dumps(simulate(args.reads, args.writes, args.quota_reads, args.quota_writes,
+                              args.backend_reads, args.backend_writes, args.fail_every), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import os
+import sys
+import gzip
+import json
+import time
+import zlib
+import logging
+from datetime import datetime
+import yfinance as yf
+
+from shared.state import state_path
+from shared.trading_calendar import TradingCalendar
+
+logger = logging.getLogger(__name__)
+
+# The evening run (RUN_MODE=precompute or --precompute) fetches the final daily
+# bars, computes every Calculation row and stores them in
+# .state/snapshots/<script>.json.gz. The morning run serves the rows whose data
+# date is the last completed session and recomputes only the rest.
+SNAPSHOT_VERSION = 1
+PRECOMPUTE = os.environ.get('RUN_MODE', '').lower() == 'precompute' or '--precompute' in sys.argv
+SNAPSHOT_ENABLED = os.environ.get('SNAPSHOT', '1').lower() not in ('0', 'false', 'no')
+# Index whose latest daily bar gives the last completed session
+SNAPSHOT_REFERENCE = os.environ.get('SNAPSHOT_REFERENCE', '^NSEI')
+
+
+# Date of the last completed session before `today`, from the reference
+# index's daily bars (over the script's shared HTTP session when given); the
+# calendar's previous session when that cannot be fetched
+def last_session_date(today, reference=SNAPSHOT_REFERENCE, session=None):
+    try:
+        hist = yf.Ticker(reference, session=session).history(period="10d", interval="1d")
+        dates = [d.date() for d in hist.index if d.date() < today]
+        if dates:
+            return max(dates)
+    except Exception as e:
+        logger.warning(f"Could not read the last session from {reference}: {e}")
+    return TradingCalendar().previous_session(today)
+
+
+class Snapshot:
+    def __init__(self, name, headers, path=None):
+        self.name = name
+        # Rows are only reused by a script writing the same columns
+        self.layout = f"{zlib.crc32(json.dumps(headers).encode()):08x}"
+        self.path = path or state_path('snapshots', f"{name}.json.gz")
+        self.rows = {}
+        self.dates = {}
+        self.screens = {}
+        self.created_at = None
+
+    def add(self, symbol, row, data_date):
+        self.rows[symbol] = list(row)
+        self.dates[symbol] = data_date.isoformat()
+
+    def save(self):
+        payload = {
+            'version': SNAPSHOT_VERSION,
+            'name': self.name,
+            'layout': self.layout,
+            'created_at': time.time(),
+            'data_date': max(self.dates.values(), default=None),
+            'rows': self.rows,
+            'dates': self.dates,
+            'screens': self.screens,
+        }
+        tmp = self.path + '.tmp'
+        with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+            json.dump(payload, f, separators=(',', ':'), default=lambda v: v.item())  # NumPy scalars
+        os.replace(tmp, self.path)
+        logger.info(f"Saved snapshot of {len(self.rows)} rows for {payload['data_date']} to {self.path} "
+                    f"({os.path.getsize(self.path) / 1024:.1f} KiB)")
+
+    # Rows (symbol -> row) whose data date is the last completed session
+    # before `today`; an empty dict when there is no usable snapshot
+    def load(self, today, session=None):
+        if not SNAPSHOT_ENABLED:
+            return {}
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                payload = json.load(f)
+        except FileNotFoundError:
+            logger.info("No precomputed snapshot, computing every row")
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable snapshot {self.path}: {e}")
+            return {}
+        if payload.get('version') != SNAPSHOT_VERSION or payload.get('layout') != self.layout:
+            logger.info(f"Snapshot {self.path} was written for another version or column layout, ignoring it")
+            return {}
+        self.created_at = datetime.fromtimestamp(payload['created_at'])
+        self.screens = payload.get('screens') or {}
+        expected = last_session_date(today, session=session).isoformat()
+        fresh = {s: row for s, row in payload['rows'].items() if payload['dates'].get(s, '') >= expected}
+        self.rows = fresh
+        self.dates = {s: payload['dates'][s] for s in fresh}
+        logger.info(f"Snapshot from {self.created_at:%Y-%m-%d %H:%M} (data for {payload['data_date']}): "
+                    f"{len(fresh)} of {len(payload['rows'])} rows are fresh for the {expected} session")
+        return fresh
+
+    def log_screens(self):
+        for name, symbols in self.screens.items():
+            logger.info(f"Screen '{name}' (snapshot): {len(symbols)} symbols match {symbols[:10]}")
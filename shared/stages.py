@@ -0,0 +1,100 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+logger = logging.getLogger(__name__)
+
+
+class StageError(Exception):
+    def __init__(self, stage, error):
+        super().__init__(f"Stage '{stage}' failed: {error}")
+        self.stage = stage
+        self.error = error
+
+
+# Runs named stages as a dependency graph: a stage starts as soon as all of its
+# dependencies have finished, so independent stages overlap. Each stage
+# function receives the results of its dependencies as positional arguments.
+class StagePipeline:
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.stages = {}
+        self.results = {}
+        self.timings = {}
+        self.run_started = None
+
+    def add(self, name, fn, deps=()):
+        if name in self.stages:
+            raise ValueError(f"Stage '{name}' already defined")
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'")
+        self.stages[name] = (fn, tuple(deps))
+        return self
+
+    def _run_stage(self, name):
+        fn, deps = self.stages[name]
+        started = time.time()
+        try:
+            return fn(*[self.results[dep] for dep in deps])
+        finally:
+            self.timings[name] = (started - self.run_started, time.time() - self.run_started)
+
+    # Run every stage; raises StageError for the first failure after letting
+    # already-running stages finish. Stages depending on a failure never start.
+    def run(self):
+        self.run_started = time.time()
+        pending = dict(self.stages)
+        running = {}
+        failure = None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                if failure is None:
+                    for name, (fn, deps) in list(pending.items()):
+                        if all(dep in self.results for dep in deps):
+                            running[executor.submit(self._run_stage, name)] = name
+                            del pending[name]
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                        logger.info(f"Stage '{name}' finished in {self.duration(name):.2f}s")
+                    except Exception as e:
+                        logger.error(f"Stage '{name}' failed: {e}")
+                        if failure is None:
+                            failure = StageError(name, e)
+        if failure is not None:
+            raise failure
+        return self.results
+
+    def duration(self, name):
+        start, end = self.timings[name]
+        return end - start
+
+    # Walk back from the last stage to finish, always through the dependency
+    # that finished last: that chain is what bounded the wall time
+    def critical_path(self):
+        if not self.timings:
+            return []
+        name = max(self.timings, key=lambda n: self.timings[n][1])
+        path = [name]
+        while True:
+            deps = [d for d in self.stages[name][1] if d in self.timings]
+            if not deps:
+                break
+            name = max(deps, key=lambda n: self.timings[n][1])
+            path.append(name)
+        return list(reversed(path))
+
+    def log_report(self):
+        if not self.timings:
+            return
+        wall = max(end for _, end in self.timings.values())
+        busy = sum(self.duration(name) for name in self.timings)
+        path = self.critical_path()
+        logger.info(f"Pipeline wall time {wall:.2f}s for {busy:.2f}s of stage work "
+                    f"({busy - wall:.2f}s overlapped)")
+        logger.info("Critical path: " + " -> ".join(f"{name} ({self.duration(name):.2f}s)" for name in path))
@@ -0,0 +1,12 @@
+import os
+
+# Local state (caches, journals, snapshots) lives outside the Google Sheet so
+# consecutive runs can reuse it. CI restores this directory with actions/cache.
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATE_DIR = os.environ.get('STOCK_REPORT_STATE_DIR', os.path.join(REPO_ROOT, '.state'))
+
+
+def state_path(*parts):
+    path = os.path.join(STATE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
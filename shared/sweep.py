@@ -0,0 +1,197 @@
+import os
+import re
+import ast
+import csv
+import glob
+import json
+import time
+import logging
+import argparse
+import itertools
+import numpy as np
+import pandas as pd
+
+from shared.screen_rules import IndicatorPanel, RuleSet
+from shared.state import state_path
+
+logger = logging.getLogger(__name__)
+
+# A sweep file holds a screen template whose {placeholders} are indicator
+# periods and thresholds, the values to try for each and the forward-return
+# horizons (in bars) to score every combination on, e.g.
+#   {"template": "adx({adx_period}) > {adx_min} and rsi(14) > {rsi_min}",
+#    "grid": {"adx_period": [10, 14], "adx_min": [20, 25, 30], "rsi_min": [40, 50]},
+#    "horizons": [1, 5, 10]}
+DEFAULT_HORIZONS = (1, 5, 10)
+# Upper bound on combination x observation cells held at once
+CHUNK_CELLS = 20_000_000
+
+_PLACEHOLDER = re.compile(r'\{(\w+)\}')
+
+
+# Split the template into its top-level `and` terms and group terms that share
+# a placeholder; each group is enumerated on its own and the groups are then
+# combined, so no term is evaluated once per full combination
+def _term_groups(template):
+    names = _PLACEHOLDER.findall(template)
+    tree = ast.parse(_PLACEHOLDER.sub(r'__\1__', template), mode='eval').body
+    terms = tree.values if isinstance(tree, ast.BoolOp) and isinstance(tree.op, ast.And) else [tree]
+    terms = [re.sub(r'__(\w+?)__', r'{\1}', ast.unparse(t)) for t in terms]
+
+    groups = []  # [set of placeholders, [terms]]
+    for term in terms:
+        used = set(_PLACEHOLDER.findall(term))
+        merged = [g for g in groups if g[0] & used]
+        for g in merged:
+            groups.remove(g)
+            used |= g[0]
+        groups.append([used, [t for g in merged for t in g[1]] + [term]])
+    return [(sorted(params), ' and '.join(f"({t})" for t in group_terms)) for params, group_terms in groups], set(names)
+
+
+def forward_returns(close, horizon):
+    out = np.full_like(close, np.nan)
+    if horizon < close.shape[1]:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[:, :-horizon] = close[:, horizon:] / close[:, :-horizon] - 1
+    return out
+
+
+class ParameterSweep:
+    def __init__(self, template, grid, horizons=DEFAULT_HORIZONS, eval_bars=None):
+        self.template = template
+        self.grid = {name: list(values) for name, values in grid.items()}
+        self.horizons = list(horizons)
+        self.eval_bars = eval_bars
+        self.groups, names = _term_groups(template)
+        missing = names - set(self.grid)
+        if missing:
+            raise ValueError(f"No grid values for {', '.join(sorted(missing))}")
+        # Rule name -> expression for every (group, local combination)
+        self.group_combos = []
+        rules = {}
+        for g, (params, expression) in enumerate(self.groups):
+            combos = [dict(zip(params, values)) for values in itertools.product(*(self.grid[p] for p in params))]
+            self.group_combos.append(combos)
+            for c, combo in enumerate(combos):
+                rules[f"g{g}_{c}"] = expression.format(**combo)
+        self.rule_set = RuleSet(rules)
+
+    @property
+    def combinations(self):
+        return int(np.prod([len(c) for c in self.group_combos]))
+
+    # Returns one dict per combination: its parameters, the number of
+    # (symbol, bar) hits in the evaluated window and, per horizon, the number
+    # of hits with a known forward return, their mean and their win rate
+    def run(self, panel):
+        started = time.time()
+        masks = self.rule_set.evaluate_history(panel)
+        close = panel.fields['close']
+        window = slice(-self.eval_bars, None) if self.eval_bars else slice(None)
+        observed = ~np.isnan(close[:, window]).ravel()
+        group_masks = [np.stack([masks[f"g{g}_{c}"][:, window].ravel()[observed] for c in range(len(combos))])
+                       for g, combos in enumerate(self.group_combos)]
+        returns = [forward_returns(close, h)[:, window].ravel()[observed] for h in self.horizons]
+        indicator_seconds = time.time() - started
+
+        # Largest group last: it joins the rest through a matrix product
+        order = sorted(range(len(group_masks)), key=lambda g: len(self.group_combos[g]))
+        head, last = order[:-1], order[-1]
+        head_size = int(np.prod([len(self.group_combos[g]) for g in head]))
+        n = observed.sum()
+        chunk = max(1, CHUNK_CELLS // max(head_size, 1))
+
+        hits = np.zeros((head_size, len(self.group_combos[last])))
+        counts = [np.zeros_like(hits) for _ in self.horizons]
+        sums = [np.zeros_like(hits) for _ in self.horizons]
+        wins = [np.zeros_like(hits) for _ in self.horizons]
+        for lo in range(0, n, chunk):
+            hi = min(n, lo + chunk)
+            joint = np.ones((1, hi - lo), dtype=bool)
+            for g in head:
+                joint = (joint[:, None, :] & group_masks[g][None, :, lo:hi]).reshape(-1, hi - lo)
+            joint = joint.astype(np.float32)
+            tail = group_masks[last][:, lo:hi].astype(np.float32)
+            hits += joint @ tail.T
+            for i, r in enumerate(returns):
+                r = r[lo:hi]
+                known = ~np.isnan(r)
+                counts[i] += joint @ (tail * known).T
+                sums[i] += joint @ (tail * np.where(known, r, 0.0)).T
+                wins[i] += joint @ (tail * (known & (r > 0))).T
+
+        results = []
+        for h_index, head_combo in enumerate(itertools.product(*(self.group_combos[g] for g in head))):
+            params = {k: v for combo in head_combo for k, v in combo.items()}
+            for l_index, last_combo in enumerate(self.group_combos[last]):
+                row = {**params, **last_combo, 'hits': int(hits[h_index, l_index])}
+                for i, h in enumerate(self.horizons):
+                    count = counts[i][h_index, l_index]
+                    row[f"n_{h}d"] = int(count)
+                    row[f"mean_{h}d"] = sums[i][h_index, l_index] / count if count else np.nan
+                    row[f"win_{h}d"] = wins[i][h_index, l_index] / count if count else np.nan
+                results.append(row)
+        logger.info(f"Swept {len(results)} combinations over {len(panel.symbols)} symbols x {n // max(len(panel.symbols), 1)} "
+                    f"bars: {self.rule_set.cache_misses} distinct sub-expressions in {indicator_seconds:.2f}s, "
+                    f"{time.time() - started:.2f}s in total")
+        return results
+
+
+def load_sweep(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_price_histories(directory=None):
+    directory = directory or os.path.dirname(state_path('prices', 'x'))
+    histories = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.parquet'))):
+        histories[os.path.splitext(os.path.basename(path))[0]] = pd.read_parquet(path)
+    return histories
+
+
+def write_results(results, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep screen periods and thresholds over cached price history")
+    parser.add_argument('sweep', help="JSON file with template, grid and horizons")
+    parser.add_argument('--prices', help="directory of <symbol>.parquet histories (default .state/prices)")
+    parser.add_argument('--symbols', nargs='+', help="download these symbols instead of using the cache")
+    parser.add_argument('--period', default='2y', help="history to download with --symbols")
+    parser.add_argument('--eval-bars', type=int, help="only score the last N bars")
+    parser.add_argument('--min-hits', type=int, default=20, help="hits needed to be listed in the top combinations")
+    parser.add_argument('--out', help="CSV of every combination (default .state/sweeps/<sweep>.csv)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    spec = load_sweep(args.sweep)
+    sweep = ParameterSweep(spec['template'], spec['grid'], spec.get('horizons', DEFAULT_HORIZONS),
+                           args.eval_bars or spec.get('eval_bars'))
+    if args.symbols:
+        from shared.price_cache import PriceCache
+        cache = PriceCache(period=args.period)
+        cache.prefetch(args.symbols)
+        histories = cache.histories()
+    else:
+        histories = load_price_histories(args.prices)
+    logger.info(f"Sweeping {sweep.combinations} combinations in {len(sweep.groups)} term groups "
+                f"over {len(histories)} histories")
+    results = sweep.run(IndicatorPanel.from_histories(histories))
+
+    out = args.out or state_path('sweeps', f"{os.path.splitext(os.path.basename(args.sweep))[0]}.csv")
+    write_results(results, out)
+    key = f"mean_{sweep.horizons[0]}d"
+    ranked = [r for r in results if r['hits'] >= args.min_hits and not np.isnan(r[key])]
+    ranked.sort(key=lambda r: r[key], reverse=True)
+    print(pd.DataFrame(ranked[:10]).to_string(index=False) if ranked else f"No combination has {args.min_hits} hits")
+    print(f"All {len(results)} combinations written to {out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import os
+import logging
+import threading
+from datetime import timedelta
+import pandas as pd
+
+from shared.state import state_path
+
+logger = logging.getLogger(__name__)
+
+# Higher timeframes derived from the daily bars already downloaded, so weekly
+# and monthly indicators cost no extra Yahoo requests
+TIMEFRAMES = {'weekly': 'W-FRI', 'monthly': 'M'}
+# Persisted bars of a symbol not updated for this long are dropped on save
+TIMEFRAME_KEEP_DAYS = int(os.environ.get('TIMEFRAME_KEEP_DAYS', '30'))
+
+
+def periods(index, freq):
+    if getattr(index, 'tz', None) is not None:
+        index = index.tz_localize(None)
+    return index.to_period(freq)
+
+
+def _naive(timestamp):
+    timestamp = pd.Timestamp(timestamp)
+    return timestamp.tz_localize(None) if timestamp.tz is not None else timestamp
+
+
+# Aggregate daily OHLCV into one bar per period; the newest bar covers the
+# (possibly unfinished) current week or month up to the latest daily bar
+def resample_ohlcv(daily, freq):
+    grouped = daily.groupby(periods(daily.index, freq))
+    bars = pd.DataFrame({
+        'Open': grouped['Open'].first(),
+        'High': grouped['High'].max(),
+        'Low': grouped['Low'].min(),
+        'Close': grouped['Close'].last(),
+        'Volume': grouped['Volume'].sum(),
+    })
+    bars.index.name = 'period'
+    return bars
+
+
+# Higher-timeframe bars for one symbol, updated incrementally: when new daily
+# bars arrive only the periods they touch are re-aggregated, and periods older
+# than the daily window are kept, so the weekly/monthly history can reach
+# further back than the daily fetch. A gap after the last update, or a daily
+# close at that date that no longer matches (a split or other adjustment),
+# rebuilds the bars from the daily history.
+class TimeframeBars:
+    def __init__(self, freq):
+        self.freq = freq
+        self.bars = None
+        self.last_daily = None
+        self.last_close = None
+        self.seeded = False  # Built from a history fetched deep enough for the timeframe lookbacks
+
+    def _matches(self, daily, index):
+        if self.bars is None or self.last_daily is None or index[0] > self.last_daily:
+            return False
+        at_last = daily['Close'][index == self.last_daily]
+        return len(at_last) == 1 and abs(float(at_last.iloc[0]) - self.last_close) <= 1e-6 * abs(self.last_close)
+
+    def update(self, daily):
+        if daily.empty:
+            return self.bars
+        index = daily.index.tz_localize(None) if daily.index.tz is not None else daily.index
+        if not self._matches(daily, index):
+            if self.bars is not None:
+                self.seeded = False  # The deeper periods are gone with the rebuild
+            self.bars = resample_ohlcv(daily, self.freq)
+        else:
+            new = daily[index > self.last_daily]
+            if new.empty:
+                return self.bars
+            first_period = periods(new.index[:1], self.freq)[0]
+            touched = daily[periods(daily.index, self.freq) >= first_period]
+            self.bars = pd.concat([self.bars[self.bars.index < first_period], resample_ohlcv(touched, self.freq)])
+        self.last_daily = _naive(daily.index[-1])
+        self.last_close = float(daily['Close'].iloc[-1])
+        return self.bars
+
+
+# Weekly/monthly bars for every symbol, keyed by (symbol, timeframe). A named
+# cache persists them in .state/timeframes/<name>.pkl between runs.
+class TimeframeCache:
+    def __init__(self, name=None, path=None):
+        self._lock = threading.Lock()
+        self._bars = {}
+        self.path = path or (state_path('timeframes', f"{name}.pkl") if name else None)
+        if self.path:
+            self._load()
+
+    def _load(self):
+        try:
+            self._bars = pd.read_pickle(self.path)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable timeframe cache {self.path}: {e}")
+            return
+        logger.info(f"Loaded {len(self._bars)} weekly/monthly bar sets from {self.path}")
+
+    def get(self, symbol, daily, timeframe):
+        with self._lock:
+            builder = self._bars.get((symbol, timeframe))
+            if builder is None:
+                builder = self._bars[(symbol, timeframe)] = TimeframeBars(TIMEFRAMES[timeframe])
+        return builder.update(daily)
+
+    # Higher-timeframe bars held for a symbol (0 when none)
+    def depth(self, symbol, timeframe):
+        builder = self._bars.get((symbol, timeframe))
+        return 0 if builder is None or builder.bars is None else len(builder.bars)
+
+    # Whether `symbol` lacks the bars in `needs` (timeframe -> bars) and has not
+    # been fetched deep enough already; young listings are only seeded once
+    def needs_seed(self, symbol, needs):
+        short = [tf for tf, bars in needs.items() if self.depth(symbol, tf) < bars]
+        return any(not (self._bars.get((symbol, tf)) and self._bars[(symbol, tf)].seeded) for tf in short)
+
+    def mark_seeded(self, symbols, timeframes):
+        with self._lock:
+            for symbol in symbols:
+                for timeframe in timeframes:
+                    builder = self._bars.get((symbol, timeframe))
+                    if builder is None:
+                        builder = self._bars[(symbol, timeframe)] = TimeframeBars(TIMEFRAMES[timeframe])
+                    builder.seeded = True
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            newest = max((b.last_daily for b in self._bars.values() if b.last_daily is not None), default=None)
+            if newest is not None:
+                oldest = newest - timedelta(days=TIMEFRAME_KEEP_DAYS)
+                self._bars = {k: b for k, b in self._bars.items() if b.last_daily is not None and b.last_daily >= oldest}
+            bars = dict(self._bars)
+        tmp = self.path + '.tmp'
+        pd.to_pickle(bars, tmp)
+        os.replace(tmp, self.path)
+        logger.info(f"Saved {len(bars)} weekly/monthly bar sets to {self.path}")
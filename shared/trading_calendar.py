@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import logging
+from datetime import date, timedelta
+
+from shared.state import REPO_ROOT, state_path
+
+logger = logging.getLogger(__name__)
+
+# NSE trading calendar from a local holiday file (year -> {date: holiday}),
+# kept in step with NSE's yearly holiday circular. Weekdays of a year missing
+# from the file count as sessions. Scheduled runs stop on weekends and
+# holidays after logging why; FORCE_RUN=1 (or --force) runs them anyway.
+NSE_HOLIDAYS = os.environ.get('NSE_HOLIDAYS', os.path.join(REPO_ROOT, 'nse_holidays.json'))
+FORCE_RUN = os.environ.get('FORCE_RUN', '').lower() in ('1', 'true', 'yes') or '--force' in sys.argv
+
+
+class TradingCalendar:
+    def __init__(self, path=NSE_HOLIDAYS):
+        self.path = path
+        try:
+            with open(path) as f:
+                years = json.load(f)
+        except FileNotFoundError:
+            logger.warning(f"No NSE holiday file at {path}, treating every weekday as a session")
+            years = {}
+        self.years = {int(year) for year in years}
+        self.holidays = {date.fromisoformat(day): name for days in years.values() for day, name in days.items()}
+        self._warned = set()
+
+    # Why the market is closed on `day` ('Saturday', 'Diwali-Balipratipada'),
+    # or None on a session
+    def closed_reason(self, day):
+        if day.weekday() >= 5:
+            return day.strftime('%A')
+        if day.year not in self.years and day.year not in self._warned:
+            self._warned.add(day.year)
+            logger.warning(f"{self.path} has no holidays for {day.year}, treating every weekday as a session")
+        return self.holidays.get(day)
+
+    def is_session(self, day):
+        return self.closed_reason(day) is None
+
+    def previous_session(self, day):
+        day -= timedelta(days=1)
+        while not self.is_session(day):
+            day -= timedelta(days=1)
+        return day
+
+    def next_session(self, day):
+        day += timedelta(days=1)
+        while not self.is_session(day):
+            day += timedelta(days=1)
+        return day
+
+
+# Whether a scheduled run of `name` on `today` goes ahead; logs the decision
+def should_run(calendar, name, today, force=FORCE_RUN):
+    reason = calendar.closed_reason(today)
+    if reason is None:
+        logger.info(f"{today} is an NSE session, running {name}")
+        return True
+    if force:
+        logger.info(f"{today} is not an NSE session ({reason}), running {name} anyway because FORCE_RUN is set")
+        return True
+    logger.info(f"Skipping {name}: {today} is not an NSE session ({reason}); "
+                f"the next session is {calendar.next_session(today)}")
+    return False
+
+
+# Latest bar each mode of a script ('report', 'precompute') fully processed,
+# in .state/<script>/sessions.json. A run whose expected session is already
+# covered would fetch the same final bars and send the same report, so it
+# stops before any fetch, sheet write or email; FORCE_RUN runs it anyway.
+class SessionLog:
+    def __init__(self, name, path=None):
+        self.path = path or state_path(name, 'sessions.json')
+        try:
+            with open(self.path) as f:
+                self.sessions = {mode: date.fromisoformat(day) for mode, day in json.load(f).items()}
+        except FileNotFoundError:
+            self.sessions = {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable session log {self.path}: {e}")
+            self.sessions = {}
+
+    # Whether `mode` already processed the `expected` session; logs the decision
+    def covers(self, mode, expected, force=FORCE_RUN):
+        latest = self.sessions.get(mode)
+        if latest is None or latest < expected:
+            logger.info(f"Latest {mode} covered {latest or 'no session'}, running for the {expected} session")
+            return False
+        if force:
+            logger.info(f"The {expected} session was already processed ({mode}), running anyway because FORCE_RUN is set")
+            return False
+        logger.info(f"Skipping {mode}: the latest stored bar ({latest}) was already processed and no session "
+                    f"has closed since, nothing can have changed")
+        return True
+
+    def record(self, mode, latest):
+        if latest is None or latest <= self.sessions.get(mode, date.min):
+            return
+        self.sessions[mode] = latest
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({m: d.isoformat() for m, d in self.sessions.items()}, f)
+        os.replace(tmp, self.path)
+        logger.info(f"Recorded {latest} as the latest session processed ({mode})")
+
+
+# Histories (symbol -> daily frame) whose latest bar is older than the
+# `expected` session, with that bar's date; logs how many are behind
+def check_freshness(histories, expected):
+    stale = {}
+    for symbol, hist in histories.items():
+        latest = hist.index[-1].date()
+        if latest < expected:
+            stale[symbol] = latest
+    if stale:
+        sample = ', '.join(f"{s} ({d})" for s, d in list(stale.items())[:5])
+        logger.warning(f"{len(stale)} of {len(histories)} histories end before the {expected} session: {sample}")
+    else:
+        logger.info(f"All {len(histories)} histories reach the {expected} session")
+    return stale
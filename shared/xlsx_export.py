@@ -0,0 +1,116 @@
+import os
+import re
+import csv
+import io
+import zipfile
+import logging
+from xml.sax.saxutils import escape
+
+logger = logging.getLogger(__name__)
+
+# Report exports are built in-process: EXPORT_FORMAT is xlsx or csv, and files
+# above EXPORT_ATTACH_MAX_BYTES are linked instead of attached
+EXPORT_FORMAT = os.environ.get('EXPORT_FORMAT', 'xlsx').lower()
+EXPORT_ATTACH_MAX_BYTES = int(os.environ.get('EXPORT_ATTACH_MAX_BYTES', str(10 * 1024 * 1024)))
+
+MIME_TYPES = {
+    'xlsx': ('application', 'vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'csv': ('text', 'csv'),
+}
+
+_NUMBER = re.compile(r'^-?(0|[1-9]\d*)(\.\d+)?$')
+_ILLEGAL_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+
+def column_letter(index):
+    letters = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def _cell(ref, value):
+    text = '' if value is None else str(value)
+    if _NUMBER.match(text):
+        return f'<c r="{ref}"><v>{text}</v></c>'
+    text = escape(_ILLEGAL_XML.sub('', text))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+# Minimal single-sheet workbook with inline strings; rows are streamed into the
+# compressed sheet part one at a time, so only one row is held as XML
+def write_xlsx(rows, fileobj, sheet_name='Sheet1'):
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        zf.writestr('_rels/.rels', _ROOT_RELS)
+        zf.writestr('xl/workbook.xml', _WORKBOOK.format(name=escape(sheet_name[:31], {'"': '&quot;'})))
+        zf.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+        with zf.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            for r, row in enumerate(rows, 1):
+                cells = ''.join(_cell(f"{column_letter(c)}{r}", v) for c, v in enumerate(row) if v not in (None, ''))
+                sheet.write(f'<row r="{r}">{cells}</row>'.encode('utf-8'))
+            sheet.write(b'</sheetData></worksheet>')
+
+
+def write_csv(rows, fileobj):
+    text = io.TextIOWrapper(fileobj, encoding='utf-8', newline='', write_through=True)
+    csv.writer(text).writerows(rows)
+    text.detach()
+
+
+# Write rows to `path` in the configured format; returns (filename, (maintype,
+# subtype), payload bytes or None when the file is too large to attach)
+def build_export(rows, path, sheet_name='Sheet1', fmt=EXPORT_FORMAT, max_bytes=EXPORT_ATTACH_MAX_BYTES):
+    if fmt not in MIME_TYPES:
+        raise ValueError(f"Unsupported export format {fmt!r}; use xlsx or csv")
+    path = f"{os.path.splitext(path)[0]}.{fmt}"
+    with open(path, 'wb') as f:
+        (write_xlsx(rows, f, sheet_name) if fmt == 'xlsx' else write_csv(rows, f))
+    size = os.path.getsize(path)
+    filename = os.path.basename(path)
+    if size > max_bytes:
+        logger.info(f"Export {filename} is {size / 1024:.0f} KiB, over the {max_bytes / 1024:.0f} KiB attachment limit")
+        return filename, MIME_TYPES[fmt], None
+    with open(path, 'rb') as f:
+        payload = f.read()
+    logger.info(f"Built {filename} ({size / 1024:.1f} KiB) for attachment")
+    return filename, MIME_TYPES[fmt], payload
@@ -0,0 +1,103 @@
+import smtplib
+from email.mime.text import MIMEText
+
+import pytest
+
+from shared import mail_queue
+from shared.mail_queue import MailQueue
+
+
+# Stand-in for smtplib.SMTP: servers in `down` drop every message, the rest
+# record what they accepted
+class FakeSMTP:
+    down = set()
+    delivered = []
+
+    def __init__(self, host, port, timeout=None):
+        self.host = host
+
+    def starttls(self):
+        pass
+
+    def login(self, username, password):
+        pass
+
+    def sendmail(self, sender, recipients, message):
+        if self.host in self.down:
+            raise smtplib.SMTPServerDisconnected(f"{self.host} is down")
+        FakeSMTP.delivered.append((self.host, recipients[0]))
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    monkeypatch.setattr(mail_queue.smtplib, 'SMTP', FakeSMTP)
+    FakeSMTP.down = set()
+    FakeSMTP.delivered = []
+    return FakeSMTP
+
+
+def account(host):
+    return {'host': host, 'port': 25, 'starttls': False, 'username': None, 'password': None, 'per_minute': 6000}
+
+
+def make_queue(tmp_path, hosts):
+    return MailQueue(db_path=str(tmp_path / 'outbox.sqlite3'), accounts=[account(h) for h in hosts], backoff=0)
+
+
+def messages(recipients):
+    out = []
+    for recipient in recipients:
+        msg = MIMEText(f"Report for {recipient}", 'html')
+        msg['From'] = 'reports@example.com'
+        msg['To'] = recipient
+        out.append((recipient, msg))
+    return out
+
+
+RECIPIENTS = [f"user{i}@example.com" for i in range(8)]
+
+
+def test_failed_account_hands_its_shard_to_the_next_one(tmp_path, smtp):
+    smtp.down = {'smtp-a'}
+    queue = make_queue(tmp_path, ['smtp-a', 'smtp-b'])
+    sharded_to_a = [r for r in RECIPIENTS if queue._shard(r) == 0]
+    assert sharded_to_a  # the failover path is exercised
+    assert queue.deliver('orb-2026-10-19', messages(RECIPIENTS), timeout=10) == len(RECIPIENTS)
+    assert sorted(r for _, r in smtp.delivered) == sorted(RECIPIENTS)
+    assert {host for host, _ in smtp.delivered} == {'smtp-b'}
+    assert queue.counts('orb-2026-10-19') == {'sent': len(RECIPIENTS)}
+
+
+def test_resume_after_crash_does_not_resend(tmp_path, smtp):
+    queue = make_queue(tmp_path, ['smtp-a'])
+    for recipient, msg in messages(RECIPIENTS):
+        queue.enqueue('orb-2026-10-19', recipient, msg)
+    # The crashed attempt had sent three rows and was in the middle of a fourth
+    ids = [row_id for (row_id,) in queue._db.execute("SELECT id FROM outbox ORDER BY id")]
+    for row_id in ids[:3]:
+        queue._mark_sent(row_id)
+    queue._db.execute("UPDATE outbox SET status = 'sending' WHERE id = ?", (ids[3],))
+    queue._db.commit()
+    queue._db.close()
+
+    resumed = make_queue(tmp_path, ['smtp-a'])
+    assert resumed.deliver('orb-2026-10-19', messages(RECIPIENTS), timeout=10) == len(RECIPIENTS)
+    assert sorted(r for _, r in smtp.delivered) == sorted(RECIPIENTS[3:])
+    assert sorted(resumed.sent_recipients('orb-2026-10-19')) == sorted(RECIPIENTS)
+
+
+def test_run_key_makes_delivery_idempotent(tmp_path, smtp):
+    queue = make_queue(tmp_path, ['smtp-a', 'smtp-b'])
+    assert queue.deliver('orb-2026-10-19', messages(RECIPIENTS), timeout=10) == len(RECIPIENTS)
+    # A retry of the same run queues nothing new
+    assert queue.deliver('orb-2026-10-19', messages(RECIPIENTS), timeout=10) == len(RECIPIENTS)
+    assert len(smtp.delivered) == len(RECIPIENTS)
+    # The next session's run is a new key and is delivered again
+    assert queue.deliver('orb-2026-10-20', messages(RECIPIENTS[:2]), timeout=10) == 2
+    assert len(smtp.delivered) == len(RECIPIENTS) + 2
@@ -0,0 +1,96 @@
+import os
+from datetime import date
+
+import numpy as np
+
+from shared.orb_stream import BarRing, OrbEngine, TapeReplayer
+
+TAPE = os.path.join(os.path.dirname(__file__), 'fixtures', 'orb_tape.csv')
+SESSION = date(2026, 10, 19)
+
+
+def replay(capacity=400, step=60):
+    source = TapeReplayer(TAPE, step=step)
+    fired = []
+    engine = OrbEngine(['AAA', 'BBB'], source, SESSION, or_minutes=5, on_alert=fired.extend, capacity=capacity)
+    while not source.exhausted:
+        engine.step()
+    return engine, fired
+
+
+# Hands back one prepared batch of bars per poll
+class ScriptedSource:
+    def __init__(self, polls):
+        self.polls = list(polls)
+
+    def poll(self, symbols):
+        return self.polls.pop(0) if self.polls else {}
+
+
+def test_alert_fires_once_on_first_bar_above_range_high():
+    engine, fired = replay()
+    assert fired == engine.alerts
+    assert len(engine.alerts) == 1
+    alert = engine.alerts[0]
+    assert alert.symbol == 'AAA'
+    # 09:21, the first minute after the 09:15-09:20 range to trade above 103;
+    # the 200 printed before the open is not part of the range
+    assert alert.ts == engine.open_ts + 6 * 60
+    assert alert.level == 103
+    assert alert.price == 103.2
+    assert engine.summary()['BBB'] == (51, 49.5, False)
+
+
+def test_replayed_duplicate_minute_replaces_the_bar():
+    engine, _ = replay()
+    ts, values = engine.rings['AAA'].last()
+    # 11 tape rows for AAA, one of them a re-poll of 09:21
+    assert len(engine.rings['AAA']) == 10
+    assert list(np.diff(ts)) == [60] * 9
+    assert list(values[ts == engine.open_ts + 6 * 60][0]) == [102.6, 103.4, 102.4, 103.2, 900]
+
+
+def test_forming_minute_polled_twice_is_replaced_not_appended():
+    open_ts = OrbEngine([], None, SESSION).open_ts
+    minute = open_ts + 5 * 60
+    range_bars = [(open_ts + 60 * m, np.array([10.0, 11.0, 9.0, 10.5, 100])) for m in range(5)]
+    source = ScriptedSource([
+        {'AAA': range_bars + [(minute, np.array([10.5, 10.8, 10.4, 10.6, 50]))]},
+        {'AAA': [(minute, np.array([10.5, 11.5, 10.4, 11.4, 120]))]},
+        {'AAA': [(minute, np.array([10.5, 11.6, 10.4, 11.2, 150]))]},
+    ])
+    engine = OrbEngine(['AAA'], source, SESSION, or_minutes=5)
+    assert engine.step() == []
+    assert [a.price for a in engine.step()] == [11.4]
+    assert engine.step() == []
+    ring = engine.rings['AAA']
+    assert len(ring) == 6
+    ts, values = ring.last(1)
+    assert ts[0] == minute
+    assert list(values[0]) == [10.5, 11.6, 10.4, 11.2, 150]
+
+
+def test_ring_wraps_at_capacity():
+    ring = BarRing(capacity=4)
+    for ts in range(1, 7):
+        assert ring.append(ts, np.full(5, float(ts)))
+    assert len(ring) == 4
+    ts, values = ring.last()
+    assert list(ts) == [3, 4, 5, 6]
+    assert list(values[:, 3]) == [3.0, 4.0, 5.0, 6.0]
+    assert list(ring.last(2)[0]) == [5, 6]
+    # The newest slot is replaced in place across the wrap; older minutes are dropped
+    assert not ring.append(6, np.full(5, 60.0))
+    assert not ring.append(2, np.full(5, 20.0))
+    ts, values = ring.last()
+    assert list(ts) == [3, 4, 5, 6]
+    assert values[-1, 3] == 60.0
+
+
+def test_engine_ring_keeps_the_latest_bars_when_the_tape_is_longer():
+    engine, _ = replay(capacity=4)
+    ts, _ = engine.rings['AAA'].last()
+    assert len(engine.rings['AAA']) == 4
+    assert list(ts) == [engine.open_ts + 60 * m for m in range(5, 9)]
+    # The range is tracked bar by bar, so wrapping does not lose the alert
+    assert [a.symbol for a in engine.alerts] == ['AAA']
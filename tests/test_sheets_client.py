@@ -0,0 +1,88 @@
+from gspread.worksheet import Worksheet
+
+from shared.sheets_client import (CoalescedWrites, QuotaEnforcingSession, QuotaHTTPClient, SheetsQuota,
+                                  VirtualClock, simulate)
+
+URL = 'https://sheets.googleapis.com/v4/spreadsheets/fake'
+
+
+# Fake backend that also keeps every accepted request's time, per kind
+class RecordingSession(QuotaEnforcingSession):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.accepted = {'read': [], 'write': []}
+
+    def request(self, method, url, **kwargs):
+        response = super().request(method, url, **kwargs)
+        if response.status_code == 200:
+            self.accepted[SheetsQuota.classify(method)].append(self.clock())
+        return response
+
+
+def busiest_minute(times):
+    return max((sum(1 for t in times if start <= t < start + 60) for start in times), default=0)
+
+
+def make_client(reads=60, writes=60, backend_reads=60, backend_writes=60, fail_every=0):
+    clock = VirtualClock()
+    session = RecordingSession(backend_reads, backend_writes, clock=clock, fail_every=fail_every)
+    quota = SheetsQuota(reads, writes, clock=clock, sleep=clock.sleep)
+    return QuotaHTTPClient(None, session=session, quota=quota), session, clock
+
+
+def test_burst_stays_within_the_per_minute_budgets():
+    http, session, clock = make_client()
+    for _ in range(150):
+        http.request('get', URL + '/values/A1')
+        http.request('post', URL + '/values:batchUpdate', json={})
+    assert session.rejected == {}
+    assert http.quota.report()['retries'] == 0
+    assert len(session.accepted['read']) == len(session.accepted['write']) == 150
+    assert busiest_minute(session.accepted['read']) <= 60
+    assert busiest_minute(session.accepted['write']) <= 60
+    # 150 requests of each kind need three one-minute windows
+    assert clock.now >= 120
+
+
+def test_lower_budget_is_respected():
+    http, session, _ = make_client(reads=20, writes=10)
+    for _ in range(50):
+        http.request('get', URL + '/values/A1')
+        http.request('post', URL + '/values:batchUpdate', json={})
+    assert busiest_minute(session.accepted['read']) <= 20
+    assert busiest_minute(session.accepted['write']) <= 10
+    assert session.rejected == {}
+
+
+def test_backend_errors_are_retried_without_surfacing():
+    report = simulate(100, 100, 60, 60, 60, 60, fail_every=7)
+    assert report['retries'] > 0
+    assert report['errors'] == 0
+
+
+def test_tighter_backend_quota_is_absorbed_by_retries():
+    # The backend allows fewer requests than the client budgets for; its 429s
+    # are retried after a backoff instead of reaching the caller
+    http, session, _ = make_client(backend_reads=40, backend_writes=40)
+    for _ in range(100):
+        http.request('get', URL + '/values/A1')
+    assert session.rejected['read'] > 0
+    assert http.quota.report()['errors'] == 0
+    assert len(session.accepted['read']) == 100
+    assert busiest_minute(session.accepted['read']) <= 40
+
+
+def test_coalesced_writes_send_one_request_per_kind():
+    http, session, _ = make_client(writes=2)
+    worksheet = Worksheet(None, {'title': 'compare', 'sheetId': 0, 'index': 0,
+                                 'gridProperties': {'rowCount': 100, 'columnCount': 20}}, 'fake', http)
+    for _ in range(5):
+        with CoalescedWrites(worksheet) as writes:
+            writes.batch_clear(['B4:E', 'G4:J'])
+            for column in 'BCDE':
+                writes.update(f'{column}4:{column}6', [[1], [2], [3]], value_input_option='USER_ENTERED')
+            writes.update('H4', [['x']])
+    # One clear and one update per value input option, per block
+    assert session.calls['write'] == 15
+    assert session.rejected == {}
+    assert busiest_minute(session.accepted['write']) <= 2